@@ -0,0 +1,235 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Synthetic fleet benchmark (not used by Ground System)
+#
+# --mode=router (default) routes packets from 1, 10, ... --senders
+# spacecraft through TelemetryRouter in process and prints the cost per
+# packet, which should not grow with the number of spacecraft.
+#
+# --mode=stations routes the packets of one spacecraft received by 1, 2, 4,
+# ... --stations ground stations, each missing --loss of the packets and
+# lagging the previous one, and prints the cost per copy received and
+# whether the merged stream has every packet once (see StreamMerge.py).
+#
+# --mode=udp sends packets to a running Ground System from --senders UDP
+# sockets, each bound to its own 127.0.x.x address so every sender is
+# routed as a separate spacecraft.
+#
+#   ~$ python3 FleetBenchmark.py --senders=200 --packets=1000000
+#
+
+import getopt
+import itertools
+import random
+import socket
+import struct
+import sys
+import time
+
+from TelemetryRouter import TelemetryRouter
+
+# Receive port of the routing service (see RoutingService.py)
+udp_recv_port = 2234
+
+# Housekeeping packet IDs each synthetic spacecraft cycles through
+PACKET_IDS = (0x0800, 0x0801, 0x0808, 0x0809, 0x080A, 0x080B, 0x080C,
+              0x0883, 0x0884, 0x0885)
+
+
+#
+# Returns (ip address, datagram) pairs, round robin over the senders
+# and packet IDs
+#
+def make_traffic(senders, size=64):
+    traffic = []
+    for pkt_id, n in itertools.product(PACKET_IDS, range(senders)):
+        header = struct.pack('>HHH', pkt_id, 0xC000, size - 7)
+        traffic.append(
+            (f'127.0.{1 + n // 250}.{1 + n % 250}',
+             header + bytes(size - len(header))))
+    return traffic
+
+
+#
+# Returns the packets of one spacecraft and the (ip address, datagram)
+# copies of them the stations deliver: station n misses a fraction loss
+# of the packets and lags station 0 by 3 * n packets
+#
+def make_station_traffic(stations, packets, loss, size=64):
+    rng = random.Random(1)
+    unique = []
+    for i in range(packets):
+        pkt_id = PACKET_IDS[i % len(PACKET_IDS)]
+        sequence = (i // len(PACKET_IDS)) & 0x3FFF
+        header = struct.pack('>HHHQ', pkt_id, 0xC000 | sequence, size - 7, i)
+        unique.append(header + bytes(size - len(header)))
+    traffic = []
+    for i in range(packets + 3 * stations):
+        for n in range(stations):
+            if 0 <= i - 3 * n < packets and rng.random() >= loss:
+                traffic.append((f'127.0.2.{1 + n}', unique[i - 3 * n]))
+    return unique, traffic
+
+
+class NullPublisher:
+
+    @staticmethod
+    def send_multipart(_):
+        pass
+
+
+class CollectingPublisher:
+
+    def __init__(self):
+        self.packets = []
+
+    def send_multipart(self, message):
+        if message[0].startswith(b'GroundSystem.'):
+            self.packets.append(message[1])
+
+
+def bench_router(senders, packets):
+    counts = sorted({1, 10, senders} | {c for c in (50, 100) if c < senders})
+    print(f'{"spacecraft":>10} {"packets":>10} {"ns/packet":>10}')
+    for count in counts:
+        router = TelemetryRouter(NullPublisher(), spacecraft_map={})
+        traffic = make_traffic(count)
+        route = router.route
+        # Discover every spacecraft before timing
+        for ip_address, datagram in traffic:
+            route(datagram, ip_address)
+        loops = max(packets // len(traffic), 1)
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            for ip_address, datagram in traffic:
+                route(datagram, ip_address)
+        elapsed = time.perf_counter_ns() - start
+        total = loops * len(traffic)
+        print(f'{count:>10} {total:>10} {elapsed / total:>10.0f}')
+        router.close()
+
+
+def bench_stations(stations, packets, loss):
+    counts = sorted({1, stations} | {c for c in (2, 4, 8) if c < stations})
+    print(f'{"stations":>8} {"copies":>9} {"published":>9} {"missing":>7} '
+          f'{"late":>5} {"in order":>8} {"ns/copy":>7} {"keys":>5}')
+    for count in counts:
+        unique, traffic = make_station_traffic(count, packets, loss)
+        publisher = CollectingPublisher()
+        router = TelemetryRouter(
+            publisher, spacecraft_map={f'127.0.2.{1 + n}': 'Merged'
+                                       for n in range(count)})
+        route = router.route
+        start = time.perf_counter_ns()
+        for ip_address, datagram in traffic:
+            route(datagram, ip_address)
+        elapsed = time.perf_counter_ns() - start
+        router.flush(float('inf'))
+        merge = router.spacecraft['127.0.2.1'].merge
+        # Packets of each packet id in sequence count order
+        published = {}
+        for packet in publisher.packets:
+            published.setdefault(packet[:2], []).append(packet[8:16])
+        in_order = all(numbers == sorted(numbers)
+                       for numbers in published.values())
+        print(f'{count:>8} {len(traffic):>9} {len(publisher.packets):>9} '
+              f'{len(set(unique) - set(publisher.packets)):>7} '
+              f'{merge.late if merge else 0:>5} {str(in_order):>8} '
+              f'{elapsed / len(traffic):>7.0f} '
+              f'{len(merge.seen) if merge else 0:>5}')
+        router.close()
+
+
+def bench_udp(senders, packets, host):
+    traffic = make_traffic(senders)
+    sockets = {}
+    for ip_address, _ in traffic:
+        if ip_address not in sockets:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((ip_address, 0))
+            sockets[ip_address] = sock
+    start = time.perf_counter()
+    sent = 0
+    while sent < packets:
+        for ip_address, datagram in traffic:
+            sockets[ip_address].sendto(datagram, (host, udp_recv_port))
+        sent += len(traffic)
+    elapsed = time.perf_counter() - start
+    print(f'Sent {sent} packets from {len(sockets)} senders in '
+          f'{elapsed:.2f} s ({sent / elapsed:.0f} packets/s)')
+    for sock in sockets.values():
+        sock.close()
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: FleetBenchmark.py [--mode=router|stations|udp] "
+           "[--senders=<n>] [--packets=<n>] [--host=<ground system address>] "
+           "[--stations=<n>] [--loss=<fraction>]\n\n"
+           "example: --mode=udp --senders=200 --packets=1000000"))
+
+
+#
+# Main
+#
+if __name__ == '__main__':
+    mode = 'router'
+    num_senders = 200
+    num_packets = 1000000
+    send_host = '127.0.0.1'
+    num_stations = 8
+    station_loss = 0.01
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hm:s:p:",
+                                   ["help", "mode=", "senders=", "packets=",
+                                    "host=", "stations=", "loss="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-m", "--mode"):
+            mode = arg
+        elif opt in ("-s", "--senders"):
+            num_senders = int(arg)
+        elif opt in ("-p", "--packets"):
+            num_packets = int(arg)
+        elif opt == "--host":
+            send_host = arg
+        elif opt == "--stations":
+            num_stations = int(arg)
+        elif opt == "--loss":
+            station_loss = float(arg)
+
+    if mode == 'router':
+        bench_router(num_senders, num_packets)
+    elif mode == 'stations':
+        bench_stations(num_stations, num_packets, station_loss)
+    elif mode == 'udp':
+        bench_udp(num_senders, num_packets, send_host)
+    else:
+        usage()
+        sys.exit(2)
@@ -0,0 +1,349 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Extracts space packets from what the routing service receives
+#
+# The format is set in framing.txt:
+#   packets  one space packet per UDP datagram (TO_Lab, the default)
+#   tm       CCSDS TM transfer frames (CCSDS 132.0-B)
+#   aos      CCSDS AOS transfer frames (CCSDS 732.0-B)
+#
+# A datagram may hold any whole number of frames. Packets may span frames:
+# each virtual channel keeps a preallocated buffer for the packet in
+# progress, found again from the first header pointer after a lost frame.
+# Idle packets and idle frames are dropped.
+#
+# In every format, packets with CCSDS segmentation flags (first,
+# continuation, last segment) are joined into one unsegmented packet
+# before they are published.
+#
+# The work per frame is a few slice copies; bytes are never handled one
+# by one in Python.
+#
+
+import csv
+import sys
+from binascii import crc_hqx
+from pathlib import Path
+
+ROOTDIR = Path(__file__).resolve().parent
+sys.path.insert(0, f'{ROOTDIR}/Subsystems/tlmGUI')
+
+# pylint: disable=wrong-import-position
+from Profiling import timed
+
+FRAMING_FILE = f'{ROOTDIR}/framing.txt'
+
+FORMATS = ('packets', 'tm', 'aos')
+PRIMARY_HEADER_SIZE = 6
+MAX_PACKET_SIZE = 65536 + 7
+# First header pointer values
+NO_PACKET_START = 0x7FF
+IDLE_DATA = 0x7FE
+# Sequence flags
+CONTINUATION, FIRST_SEGMENT, LAST_SEGMENT, UNSEGMENTED = range(4)
+
+COUNTERS = ('frames', 'idle_frames', 'bad_frames', 'crc_errors',
+            'lost_frames', 'packets', 'idle_packets', 'dropped_packets',
+            'segmented_packets', 'segment_errors', 'short_datagrams')
+
+
+#
+# Reads framing.txt into FrameDecoder keyword arguments
+#
+def load_framing(framing_file=FRAMING_FILE):
+    settings = {}
+    try:
+        with open(framing_file) as framing_obj:
+            for row in csv.reader(framing_obj, delimiter='=',
+                                  skipinitialspace=True):
+                if not row or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                key, value = row[0].strip(), row[1].strip()
+                if key == 'format':
+                    settings['frame_format'] = value
+                elif key in ('frame_length', 'insert_zone'):
+                    settings[key] = int(value)
+                elif key in ('ocf', 'fecf', 'frame_header_ecf'):
+                    settings[key] = value.lower() in ('1', 'yes', 'true')
+                else:
+                    raise ValueError(f'{framing_file}: unknown setting {key}')
+    except IOError:
+        pass
+    return settings
+
+
+class PacketBuffer:
+    __slots__ = ('buf', 'fill', 'needed', 'count')
+
+    def __init__(self):
+        self.buf = bytearray(MAX_PACKET_SIZE)
+        self.fill = 0
+        # Length of the packet in progress, 0 until its header is complete
+        # (or, for segments, the expected sequence count)
+        self.needed = 0
+        # Frame count expected next (None before the first frame)
+        self.count = None
+
+
+class FrameDecoder:
+
+    def __init__(self, frame_format='packets', frame_length=0, ocf=False,
+                 fecf=False, insert_zone=0, frame_header_ecf=False):
+        if frame_format not in FORMATS:
+            raise ValueError(f'Unknown framing format {frame_format}')
+        if frame_format != 'packets' and \
+                frame_length < PRIMARY_HEADER_SIZE + 8:
+            raise ValueError(f'Invalid frame_length {frame_length}')
+        self.frame_format = frame_format
+        self.decode = getattr(self, f'decode_{frame_format}')
+        self.frame_length = frame_length
+        self.ocf = ocf
+        self.fecf = fecf
+        self.trailer = (4 if ocf else 0) + (2 if fecf else 0)
+        self.aos_data_start = PRIMARY_HEADER_SIZE + insert_zone + \
+            (2 if frame_header_ecf else 0)
+        # (source, spacecraft id, virtual channel): PacketBuffer
+        self.channels = {}
+        # (source, apid): PacketBuffer
+        self.segments = {}
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+
+    def counters(self):
+        return {counter: getattr(self, counter) for counter in COUNTERS}
+
+    #
+    # One packet per datagram
+    #
+    @timed('frames')
+    def decode_packets(self, datagram, source):
+        if len(datagram) < PRIMARY_HEADER_SIZE:
+            self.short_datagrams += 1
+            return ()
+        if datagram[0] & 7 == 7 and datagram[1] == 0xFF:
+            self.idle_packets += 1
+            return ()
+        self.packets += 1
+        if datagram[2] >> 6 == UNSEGMENTED:
+            return (datagram,)
+        packets = []
+        self.desegment(memoryview(datagram), source, packets)
+        return packets
+
+    @timed('frames')
+    def decode_tm(self, datagram, source):
+        packets = []
+        view = memoryview(datagram)
+        length = self.frame_length
+        for start in range(0, len(view) - length + 1, length):
+            frame = view[start:start + length]
+            self.frames += 1
+            if frame[0] >> 6 != 0 or not self.check_fecf(frame):
+                self.bad_frames += 1
+                continue
+            status = (frame[4] << 8) | frame[5]
+            if status & 0x4000:
+                # Synchronous data, not packets
+                self.bad_frames += 1
+                continue
+            data_start = PRIMARY_HEADER_SIZE
+            if status & 0x8000:
+                data_start += (frame[6] & 0x3F) + 1
+            data_end = length - (4 if frame[1] & 1 else 0) - \
+                (2 if self.fecf else 0)
+            channel = self.channel(
+                source, ((frame[0] & 0x3F) << 4) | (frame[1] >> 4),
+                (frame[1] >> 1) & 7, frame[3], 0xFF)
+            self.extract(channel, frame[data_start:data_end], status & 0x7FF,
+                         source, packets)
+        if len(view) % length:
+            self.bad_frames += 1
+        return packets
+
+    @timed('frames')
+    def decode_aos(self, datagram, source):
+        packets = []
+        view = memoryview(datagram)
+        length = self.frame_length
+        data_start = self.aos_data_start
+        data_end = length - self.trailer
+        for start in range(0, len(view) - length + 1, length):
+            frame = view[start:start + length]
+            self.frames += 1
+            if frame[0] >> 6 != 1 or not self.check_fecf(frame):
+                self.bad_frames += 1
+                continue
+            if frame[1] & 0x3F == 0x3F:
+                self.idle_frames += 1
+                continue
+            channel = self.channel(
+                source, ((frame[0] & 0x3F) << 2) | (frame[1] >> 6),
+                frame[1] & 0x3F,
+                (frame[2] << 16) | (frame[3] << 8) | frame[4], 0xFFFFFF)
+            fhp = ((frame[data_start] & 7) << 8) | frame[data_start + 1]
+            self.extract(channel, frame[data_start + 2:data_end], fhp,
+                         source, packets)
+        if len(view) % length:
+            self.bad_frames += 1
+        return packets
+
+    def check_fecf(self, frame):
+        if not self.fecf:
+            return True
+        if crc_hqx(frame[:-2], 0xFFFF) == (frame[-2] << 8) | frame[-1]:
+            return True
+        self.crc_errors += 1
+        return False
+
+    #
+    # Returns the virtual channel's buffer, abandoning its packet in
+    # progress if frames were lost
+    #
+    def channel(self, source, scid, vcid, count, count_mask):
+        key = (source, scid, vcid)
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = PacketBuffer()
+        elif count != channel.count:
+            self.lost_frames += (count - channel.count) & count_mask
+            if channel.fill:
+                self.dropped_packets += 1
+                channel.fill = 0
+        channel.count = (count + 1) & count_mask
+        return channel
+
+    #
+    # Extracts the packets of a frame's data field
+    #
+    def extract(self, channel, data, fhp, source, packets):
+        size = len(data)
+        if fhp == IDLE_DATA:
+            self.idle_frames += 1
+            return
+        if fhp != NO_PACKET_START and fhp >= size:
+            self.bad_frames += 1
+            channel.fill = 0
+            return
+        pos = size if fhp == NO_PACKET_START else fhp
+        if channel.fill:
+            self.resume(channel, data, pos, fhp != NO_PACKET_START, source,
+                        packets)
+
+        buf = channel.buf
+        while pos < size:
+            if size - pos < PRIMARY_HEADER_SIZE:
+                total = 0
+            else:
+                total = ((data[pos + 4] << 8) | data[pos + 5]) + 7
+                if pos + total <= size:
+                    self.emit(data[pos:pos + total], source, packets)
+                    pos += total
+                    continue
+            # Continued in the next frame
+            channel.fill = size - pos
+            channel.needed = total
+            buf[:channel.fill] = data[pos:]
+            break
+
+    #
+    # Adds the first limit bytes of data to the packet in progress
+    #
+    def resume(self, channel, data, limit, next_packet, source, packets):
+        buf, fill = channel.buf, channel.fill
+        start = 0
+        if not channel.needed:
+            start = min(PRIMARY_HEADER_SIZE - fill, limit)
+            buf[fill:fill + start] = data[:start]
+            fill += start
+            if fill < PRIMARY_HEADER_SIZE:
+                if next_packet:
+                    # A new packet starts before the header is complete
+                    self.dropped_packets += 1
+                    fill = 0
+                channel.fill = fill
+                return
+            channel.needed = ((buf[4] << 8) | buf[5]) + 7
+        end = min(start + channel.needed - fill, limit)
+        buf[fill:fill + end - start] = data[start:end]
+        fill += end - start
+        if fill == channel.needed:
+            channel.fill = 0
+            self.emit(memoryview(buf)[:fill], source, packets)
+            if end != limit:
+                # The first header pointer disagrees with the packet length
+                self.bad_frames += 1
+        elif next_packet:
+            self.dropped_packets += 1
+            channel.fill = 0
+        else:
+            channel.fill = fill
+
+    def emit(self, packet, source, packets):
+        if packet[0] & 7 == 7 and packet[1] == 0xFF:
+            self.idle_packets += 1
+            return
+        self.packets += 1
+        if packet[2] >> 6 == UNSEGMENTED:
+            packets.append(bytes(packet))
+        else:
+            self.desegment(packet, source, packets)
+
+    #
+    # Joins segmented packets; the joined packet keeps the first segment's
+    # headers, with the sequence flags and length of an unsegmented packet
+    #
+    def desegment(self, packet, source, packets):
+        flags = packet[2] >> 6
+        apid = ((packet[0] & 7) << 8) | packet[1]
+        seq = ((packet[2] & 0x3F) << 8) | packet[3]
+        end = min(((packet[4] << 8) | packet[5]) + 7, len(packet))
+        key = (source, apid)
+        segment = self.segments.get(key)
+        if segment is None:
+            segment = self.segments[key] = PacketBuffer()
+
+        if flags == FIRST_SEGMENT:
+            if segment.fill:
+                self.segment_errors += 1
+            segment.buf[:end] = packet[:end]
+            segment.fill = end
+            segment.needed = (seq + 1) & 0x3FFF
+            return
+        if not segment.fill or seq != segment.needed:
+            self.segment_errors += 1
+            segment.fill = 0
+            return
+        fill = segment.fill + end - PRIMARY_HEADER_SIZE
+        if fill > MAX_PACKET_SIZE:
+            self.segment_errors += 1
+            segment.fill = 0
+            return
+        segment.buf[segment.fill:fill] = packet[PRIMARY_HEADER_SIZE:end]
+        segment.needed = (seq + 1) & 0x3FFF
+        if flags == CONTINUATION:
+            segment.fill = fill
+            return
+
+        buf = segment.buf
+        buf[2] |= 0xC0
+        buf[4:6] = (fill - 7).to_bytes(2, 'big')
+        segment.fill = 0
+        self.segmented_packets += 1
+        packets.append(bytes(buf[:fill]))
@@ -28,7 +28,14 @@ import getpass
 
 from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox
 
+# ROOTDIR = Path(sys.argv[0]).resolve().parent
+ROOTDIR = pathlib.Path(__file__).parent.absolute()
+sys.path.insert(0, f'{ROOTDIR}/Subsystems/tlmGUI')
+
+# pylint: disable=wrong-import-position
 from RoutingService import RoutingService
+from Metrics import start_metrics
+from Profiling import start_profiling
 from UiMainWindow import UiMainWindow
 
 from _version import __version__ as _version
@@ -36,9 +43,6 @@ from _version import _version_string
 
 __version__ = _version
 
-# ROOTDIR = Path(sys.argv[0]).resolve().parent
-ROOTDIR = pathlib.Path(__file__).parent.absolute()
-
 
 #
 # CFS Ground System: Setup and manage the main window
@@ -73,9 +77,8 @@ class GroundSystem(QMainWindow, UiMainWindow):
 
         for sb in (self.sb_tlm_offset, self.sb_cmd_offset_pri, self.sb_cmd_offset_sec):
             sb.valueChanged.connect(self.save_offsets)
-        # Init lists
-        self.ip_addresses_list = ['All']
-        self.spacecraft_names = ['All']
+        # ip address: spacecraft name
+        self.spacecraft_by_ip = {'All': 'All'}
 
     def closeEvent(self, evnt):
         if self.routing_service:
@@ -90,8 +93,8 @@ class GroundSystem(QMainWindow, UiMainWindow):
 
     # Returns the name of the selected spacecraft
     def get_selected_spacecraft_name(self):
-        return self.spacecraft_names[self.ip_addresses_list.index(
-            self.get_selected_spacecraft_address())].strip()
+        return self.spacecraft_by_ip.get(
+            self.get_selected_spacecraft_address(), 'All')
 
     #
     # Display popup with error
@@ -169,8 +172,7 @@ class GroundSystem(QMainWindow, UiMainWindow):
 
     # Update the combo box list in gui
     def update_ip_list(self, ip, name):
-        self.ip_addresses_list.append(ip)
-        self.spacecraft_names.append(name)
+        self.spacecraft_by_ip[ip] = name
         self.combo_box_ip_addresses.addItem(ip)
 
     # Start the routing service (see RoutingService.py)
@@ -188,6 +190,11 @@ def main():
     # Report Version Number upon startup
     print(_version_string)
 
+    # CPU and memory profiling, if enabled (see Profiling.py)
+    start_profiling('GroundSystem')
+    # Metrics endpoint (see Metrics.py)
+    start_metrics('GroundSystem')
+
     # Init app
     app = QApplication(sys.argv)
 
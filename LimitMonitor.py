@@ -0,0 +1,194 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Limit checking for the RoutingService
+#
+# Items in the telemetry definition files (Subsystems/tlmGUI/*-tlm.txt) may
+# carry limits in the columns after the display type, e.g.
+#
+#   Battery Volts, 40, 2, H, Poly, 0.0, 0.01, red_low=22, yellow_low=24,
+#   yellow_high=32, red_high=34, yellow_delta=1.5
+#
+# (one line in the file). Limits apply to the displayed value, i.e. in
+# engineering units for converted items. The *_delta limits apply to the
+# change from the previous packet.
+#
+# Every packet is checked when it is routed. The checks for a packet ID are
+# compiled once and only run for packets with that ID. When an item's limit
+# state changes, an alarm is published with the topic
+#
+#   Alarms.<spacecraft>.<packet id>
+#
+# (outside the GroundSystem topics, so telemetry subscribers don't receive
+# alarms) and a JSON body, e.g.
+#
+#   {"spacecraft": "Spacecraft1", "packet": "0x800", "item": "Battery Volts",
+#    "value": 34.2, "state": "RED_HIGH", "previous": "NOMINAL"}
+#
+
+import getpass
+import json
+import mmap
+import sys
+import time
+from pathlib import Path
+
+ROOTDIR = Path(__file__).resolve().parent
+TLM_DIR = f'{ROOTDIR}/Subsystems/tlmGUI'
+sys.path.insert(0, TLM_DIR)
+
+# pylint: disable=wrong-import-position
+from Metrics import counter
+from Profiling import timed
+from TelemetryConversions import compile_packet
+from TelemetryDefinitions import load_items, load_pages
+
+NOMINAL = 'NOMINAL'
+INF = float('inf')
+
+# Seconds between attempts to open the offset file if it doesn't exist yet
+OFFSET_RETRY = 1.0
+
+ALARMS = counter('groundsystem_limit_alarms', 'Limit state changes',
+                 ('state',))
+
+
+class LimitMonitor:
+
+    def __init__(self, endian='L', tlm_dir=TLM_DIR):
+        # packet id: [(convert, [(index, desc, red_low, yellow_low,
+        #                         yellow_high, red_high, yellow_delta,
+        #                         red_delta)])]
+        self.checkers = {}
+        # (spacecraft, def file, index): (state, last value)
+        self.states = {}
+        self.mm = None
+        self.mm_retry = 0
+
+        for page in load_pages(tlm_dir):
+            if page.def_file == 'null':
+                continue
+            try:
+                items = load_items(page.def_file, tlm_dir)
+            except (IOError, ValueError) as e:
+                print(f"Limit monitor couldn't load {page.def_file}:", e)
+                continue
+            checks = []
+            for index, item in enumerate(items):
+                if item.limits:
+                    limits = dict(item.limits)
+                    checks.append(
+                        (index, item.desc, (page.def_file, index),
+                         limits.get('red_low', -INF),
+                         limits.get('yellow_low', -INF),
+                         limits.get('yellow_high', INF),
+                         limits.get('red_high', INF),
+                         limits.get('yellow_delta', INF),
+                         limits.get('red_delta', INF)))
+            if checks:
+                convert = compile_packet(items, endian, page.def_file,
+                                         only=[check[0] for check in checks])
+                self.checkers.setdefault(page.appid, []).append(
+                    (convert, checks))
+
+        if self.checkers:
+            print('Limit monitor checking',
+                  sum(len(c[1]) for cs in self.checkers.values() for c in cs),
+                  'items in', len(self.checkers), 'packets')
+
+    #
+    # Telemetry header offset selected in the main window
+    #
+    def tlm_offset(self):
+        if self.mm is None:
+            if time.monotonic() < self.mm_retry:
+                return 0
+            try:
+                with open(f"/tmp/OffsetData-{getpass.getuser()}",
+                          "r+b") as f:
+                    self.mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+            except (IOError, ValueError):
+                self.mm_retry = time.monotonic() + OFFSET_RETRY
+                return 0
+        try:
+            return self.mm[0]
+        except (IndexError, ValueError):
+            return 0
+
+    #
+    # Checks a packet; returns [(topic, alarm)] for every limit state change
+    #
+    @timed('limits')
+    def check(self, spacecraft, datagram):
+        checkers = self.checkers.get((datagram[0] << 8) | datagram[1])
+        if checkers is None:
+            return []
+
+        alarms = []
+        offset = self.tlm_offset()
+        for convert, checks in checkers:
+            values = convert(datagram, offset)
+            if values is None:
+                continue
+            for index, desc, key, red_low, yellow_low, yellow_high, \
+                    red_high, yellow_delta, red_delta in checks:
+                value = values[index]
+                state_key = (spacecraft, key)
+                prev_state, prev_value = self.states.get(state_key,
+                                                         (NOMINAL, value))
+                delta = abs(value - prev_value)
+                if value <= red_low:
+                    state = 'RED_LOW'
+                elif value >= red_high:
+                    state = 'RED_HIGH'
+                elif delta > red_delta:
+                    state = 'RED_DELTA'
+                elif value <= yellow_low:
+                    state = 'YELLOW_LOW'
+                elif value >= yellow_high:
+                    state = 'YELLOW_HIGH'
+                elif delta > yellow_delta:
+                    state = 'YELLOW_DELTA'
+                else:
+                    state = NOMINAL
+                self.states[state_key] = (state, value)
+                if state != prev_state:
+                    alarms.append(self.alarm(spacecraft, datagram, desc,
+                                             value, state, prev_state))
+        return alarms
+
+    @staticmethod
+    def alarm(spacecraft, datagram, desc, value, state, prev_state):
+        ALARMS.labels(state=state).inc()
+        pkt_id = hex((datagram[0] << 8) | datagram[1])
+        topic = f'Alarms.{spacecraft}.{pkt_id}'
+        body = json.dumps({
+            'spacecraft': spacecraft,
+            'packet': pkt_id,
+            'item': desc,
+            'value': value,
+            'state': state,
+            'previous': prev_state
+        })
+        return topic.encode(), body.encode()
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
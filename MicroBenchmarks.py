@@ -0,0 +1,456 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Microbenchmarks of the functions run for every packet or command (not
+# used by Ground System)
+#
+# Each benchmark calls one function in isolation on representative packets
+# (built from the telemetry definitions, see TlmUDPSender.py). It is run
+# --repeats times, each repeat long enough to take at least REPEAT_TIME
+# seconds, giving one time per call per repeat.
+#
+# The repeats of all the benchmarks are interleaved, and each time is
+# divided by that of a fixed reference workload in the same round, so that
+# results from a slower or busier host than the baseline's still compare.
+# These relative times are compared with microbenchmarks-baseline.json: a
+# benchmark is flagged as a regression when it is slower than the baseline
+# with a one-sided Mann-Whitney U test at p < ALPHA, and its median is
+# more than --threshold percent slower. The exit status is 1 if any benchmark is
+# flagged. --save writes the results of the benchmarks run as the new
+# baseline, keeping the others.
+#
+# Benchmarks of Qt pages run under the offscreen platform and are skipped
+# if PyQt5 isn't installed.
+#
+#   ~$ python3 MicroBenchmarks.py
+#   ~$ python3 MicroBenchmarks.py --filter=route --save
+#
+
+import getopt
+import getpass
+import json
+import math
+import os
+import platform
+import statistics
+import struct
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOTDIR = Path(__file__).resolve().parent
+TLM_DIR = f'{ROOTDIR}/Subsystems/tlmGUI'
+CMD_DIR = f'{ROOTDIR}/Subsystems/cmdGui'
+sys.path.insert(0, TLM_DIR)
+sys.path.insert(0, CMD_DIR)
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# pylint: disable=wrong-import-position
+from FleetBenchmark import NullPublisher
+from LatencyHistogram import LatencyRecorder
+from LimitMonitor import LimitMonitor
+from MiniCmdUtil import MiniCmdUtil
+from TelemetryConversions import compile_packet
+from TelemetryDefinitions import load_items
+from TelemetryRouter import TelemetryRouter
+from TlmUDPSender import EVENT_ITEMS, EVENT_MSG_ID, build_variants
+
+try:
+    from PyQt5.QtWidgets import QApplication, QTableWidgetItem
+except ImportError:
+    QApplication = None
+
+BASELINE_FILE = f'{ROOTDIR}/microbenchmarks-baseline.json'
+OFFSET_FILE = f'/tmp/OffsetData-{getpass.getuser()}'
+
+# Seconds each repeat runs for, at least
+REPEAT_TIME = 0.02
+# Significance level of the regression test
+ALPHA = 0.01
+
+HK_MSG_ID = 0x800
+HK_DEF_FILE = 'cfe-es-hk-tlm.txt'
+COMMAND_PARAMETERS = '--uint16=2 --uint32=100000 --string="20:SAMPLE_APP"'
+
+# name: (setup, needs Qt); setup returns the function to time
+BENCHMARKS = {}
+REFERENCE = 'reference'
+
+
+def benchmark(name, qt=False):
+    def register(setup):
+        BENCHMARKS[name] = (setup, qt)
+        return setup
+    return register
+
+
+#
+# Representative packets: (housekeeping packets, definition items)
+#
+def hk_packets():
+    items = load_items(HK_DEF_FILE, TLM_DIR)
+    return build_variants(HK_MSG_ID, items, 0, 'L'), items
+
+
+def event_packets():
+    return build_variants(EVENT_MSG_ID, EVENT_ITEMS, 0, 'L')
+
+
+#
+# The telemetry and command pages read the header offsets saved by the
+# main window; a fresh host has none
+#
+def ensure_offsets():
+    if not os.path.exists(OFFSET_FILE):
+        with open(OFFSET_FILE, 'wb') as f:
+            f.write(bytes(3))
+
+
+def qt_app():
+    return QApplication.instance() or QApplication(['MicroBenchmarks'])
+
+
+#
+# Fixed pure Python work timed with the benchmarks. Benchmarks are compared
+# with the baseline relative to it, which takes out most of the difference
+# between a fast and a slow (or busy) host.
+#
+@benchmark(REFERENCE)
+def bench_reference():
+    data = bytes(range(64))
+    unpack_from = struct.Struct('<HIf').unpack_from
+    table = {n: str(n) for n in range(64)}
+
+    def reference():
+        total = 0
+        for offset in range(0, 48, 4):
+            values = unpack_from(data, offset)
+            total += values[0] + len(table[values[0] & 63])
+        return total
+    return reference
+
+
+# Cycles through a list of packets, one per call
+def cycle(packets):
+    count = len(packets)
+    state = [0]
+
+    def next_packet():
+        state[0] = (state[0] + 1) % count
+        return packets[state[0]]
+    return next_packet
+
+
+@benchmark('route')
+def bench_route():
+    packets, _ = hk_packets()
+    next_packet = cycle([bytes(p) for p in packets])
+    route = TelemetryRouter(NullPublisher(), spacecraft_map={}).route
+    return lambda: route(next_packet(), '127.0.0.1', 1)
+
+
+@benchmark('route_limits')
+def bench_route_limits():
+    packets, _ = hk_packets()
+    next_packet = cycle([bytes(p) for p in packets])
+    route = TelemetryRouter(NullPublisher(), spacecraft_map={},
+                            limit_monitor=LimitMonitor()).route
+    return lambda: route(next_packet(), '127.0.0.1', 1)
+
+
+@benchmark('convert_packet')
+def bench_convert_packet():
+    packets, items = hk_packets()
+    next_packet = cycle([bytes(p) for p in packets])
+    convert = compile_packet(items, 'L', HK_DEF_FILE)
+    return lambda: convert(next_packet(), 0)
+
+
+@benchmark('assemble_packet')
+def bench_assemble_packet():
+    ensure_offsets()
+    util = MiniCmdUtil('127.0.0.1', 1234, 'LE', '0x1882', 3,
+                       COMMAND_PARAMETERS)
+
+    def assemble():
+        # assemble_packet() appends to these
+        util.payload = bytearray()
+        util.packet = bytearray()
+        util.assemble_packet()
+    return assemble
+
+
+@benchmark('get_pkt_id', qt=True)
+def bench_get_pkt_id():
+    from RoutingService import RoutingService
+    packets, _ = hk_packets()
+    next_packet = cycle([bytes(p) for p in packets])
+    get_pkt_id = RoutingService.get_pkt_id
+    return lambda: get_pkt_id(next_packet())
+
+
+#
+# A telemetry page showing the housekeeping packet, set up as
+# GenericTelemetry.py's main does
+#
+def generic_page():
+    ensure_offsets()
+    qt_app()
+    import GenericTelemetry
+    packets, items = hk_packets()
+    GenericTelemetry.tlm_items = items
+    GenericTelemetry.convert_packet = compile_packet(items, 'L', HK_DEF_FILE,
+                                                     partial=True)
+    page = GenericTelemetry.SubsystemTelemetry()
+    for i in range(len(items)):
+        page.tbl_telemetry.insertRow(i)
+        page.tbl_telemetry.setItem(i, 0, QTableWidgetItem())
+        page.tbl_telemetry.setItem(i, 1, QTableWidgetItem())
+    page.thread = SimpleNamespace(latency=LatencyRecorder('MicroBenchmarks'))
+    return page, [bytes(p) for p in packets], items
+
+
+@benchmark('display_telemetry_item', qt=True)
+def bench_display_telemetry_item():
+    page, packets, items = generic_page()
+    values = compile_packet(items, 'L', HK_DEF_FILE)(packets[1], 0)
+    label = page.tbl_telemetry.item(0, 0)
+    value = page.tbl_telemetry.item(0, 1)
+    display = page.display_telemetry_item
+    fields = [(values[k], k) for k in range(len(items))]
+    next_field = cycle(fields)
+
+    def display_item():
+        tlm_field, index = next_field()
+        display(tlm_field, index, label, value)
+    return display_item
+
+
+@benchmark('generic_process_datagram', qt=True)
+def bench_generic_process_datagram():
+    page, packets, _ = generic_page()
+    next_packet = cycle(packets)
+    process = page.process_pending_datagrams
+    return lambda: process(next_packet(), time.time_ns())
+
+
+@benchmark('event_process_datagram', qt=True)
+def bench_event_process_datagram():
+    ensure_offsets()
+    qt_app()
+    import EventMessage
+    page = EventMessage.EventMessageTelemetry('0x808')
+    page.thread = SimpleNamespace(latency=LatencyRecorder('MicroBenchmarks'))
+    # Keep the log from growing without bound while timing
+    page.event_output.setMaximumBlockCount(1000)
+    next_packet = cycle([bytes(p) for p in event_packets()])
+    process = page.process_pending_datagrams
+    return lambda: process(next_packet(), time.time_ns())
+
+
+#
+# Calls per repeat for func to run for at least REPEAT_TIME
+#
+def calibrate(func):
+    calls = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            func()
+        if time.perf_counter_ns() - start >= REPEAT_TIME * 1e9:
+            return calls
+        calls *= 2
+
+
+#
+# Returns {name: [time per call (ns) of each repeat]}. The repeats of the
+# benchmarks are interleaved so that a change in the host's speed affects
+# them all alike.
+#
+def measure(funcs, repeats):
+    calls = {name: calibrate(func) for name, func in funcs.items()}
+    samples = {name: [] for name in funcs}
+    for _ in range(repeats):
+        for name, func in funcs.items():
+            count = calls[name]
+            start = time.perf_counter_ns()
+            for _ in range(count):
+                func()
+            samples[name].append((time.perf_counter_ns() - start) / count)
+    return samples
+
+
+#
+# One-sided Mann-Whitney U test (normal approximation with tie
+# correction); returns the p value of current being larger than baseline
+#
+def mann_whitney_greater(current, baseline):
+    n1, n2 = len(current), len(baseline)
+    ranked = sorted([(value, 0) for value in current] +
+                    [(value, 1) for value in baseline])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        size = j - i + 1
+        ties += size ** 3 - size
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, ranked)
+                   if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def load_baseline(baseline_file):
+    try:
+        with open(baseline_file) as baseline_obj:
+            return json.load(baseline_obj)
+    except IOError:
+        return {'benchmarks': {}}
+
+
+def save_baseline(baseline_file, baseline, results, relative):
+    baseline['host'] = platform.node()
+    baseline['platform'] = platform.platform()
+    baseline['python'] = platform.python_version()
+    baseline['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    for name, samples in results.items():
+        baseline['benchmarks'][name] = {
+            'median_ns': statistics.median(samples),
+            'samples_ns': [round(sample, 2) for sample in samples],
+            'relative': [round(sample, 5) for sample in relative[name]]
+        }
+    tmp_file = f'{baseline_file}.tmp'
+    with open(tmp_file, 'w') as baseline_obj:
+        json.dump(baseline, baseline_obj, indent=2, sort_keys=True)
+        baseline_obj.write('\n')
+    os.replace(tmp_file, baseline_file)
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: MicroBenchmarks.py [--filter=<text>] [--repeats=<n>] "
+           "[--threshold=<percent>] [--baseline=<file>] [--save] [--list]"
+           "\n\nexample: --filter=route --repeats=50"))
+
+
+#
+# Main
+#
+if __name__ == '__main__':
+    name_filter = ''
+    repeat_count = 30
+    threshold = 20.0
+    baseline_path = BASELINE_FILE
+    save = False
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "hf:r:t:b:sl",
+            ["help", "filter=", "repeats=", "threshold=", "baseline=",
+             "save", "list"])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif opt in ("-f", "--filter"):
+                name_filter = arg
+            elif opt in ("-r", "--repeats"):
+                repeat_count = int(arg)
+            elif opt in ("-t", "--threshold"):
+                threshold = float(arg)
+            elif opt in ("-b", "--baseline"):
+                baseline_path = arg
+            elif opt in ("-s", "--save"):
+                save = True
+            elif opt in ("-l", "--list"):
+                for bench_name, (_, needs_qt) in BENCHMARKS.items():
+                    print(bench_name, '(Qt)' if needs_qt else '')
+                sys.exit()
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    baseline_data = load_baseline(baseline_path)
+    if baseline_data.get('platform', platform.platform()) != \
+            platform.platform():
+        print(f'Note: baseline recorded on {baseline_data["platform"]}')
+
+    print(f'{"benchmark":<26} {"ns/call":>10} {"baseline":>10} '
+          f'{"change":>8} {"p":>8}')
+    bench_funcs = {}
+    for bench_name, (bench_setup, needs_qt) in BENCHMARKS.items():
+        if name_filter not in bench_name and bench_name != REFERENCE:
+            continue
+        if needs_qt and QApplication is None:
+            print(f'{bench_name:<26} {"skipped (PyQt5 not installed)":>30}')
+            continue
+        bench_funcs[bench_name] = bench_setup()
+    bench_results = measure(bench_funcs, repeat_count)
+    reference_samples = bench_results[REFERENCE]
+    bench_relative = {
+        name: [sample / ref for sample, ref in zip(samples,
+                                                   reference_samples)]
+        for name, samples in bench_results.items()}
+
+    regressions = []
+    for bench_name, bench_samples in bench_results.items():
+        median = statistics.median(bench_samples)
+        base = baseline_data['benchmarks'].get(bench_name)
+        if base is None or bench_name == REFERENCE:
+            base_median = f'{base["median_ns"]:.0f}' if base else '-'
+            print(f'{bench_name:<26} {median:>10.0f} {base_median:>10}')
+            continue
+        relative = bench_relative[bench_name]
+        change = 100 * (statistics.median(relative) /
+                        statistics.median(base['relative']) - 1)
+        p_value = mann_whitney_greater(relative, base['relative'])
+        flag = ''
+        if p_value < ALPHA and change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(bench_name)
+        print(f'{bench_name:<26} {median:>10.0f} '
+              f'{base["median_ns"]:>10.0f} {change:>+7.1f}% '
+              f'{p_value:>8.4f} {flag}')
+
+    if save:
+        save_baseline(baseline_path, baseline_data, bench_results,
+                      bench_relative)
+        print('Baseline written to', baseline_path)
+    elif regressions:
+        print(f'\n{len(regressions)} regression(s):', ', '.join(regressions))
+        sys.exit(1)
@@ -0,0 +1,226 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Priority classes of the packets published by the routing service (see
+# TelemetryRouter.py), set in priority.txt
+#
+# Each packet id is in a class, and each class has its own bounded queue.
+# The router reads every datagram waiting on its socket into the queues
+# before it publishes, so when telemetry comes in faster than it can be
+# published, packets wait and are shed in the queues, by class, rather than
+# in the socket buffer, where any packet may be lost:
+#
+#   - a class with decimation N only keeps one of every N packets of each
+#     packet id while its queue is more than half full
+#   - when a queue is full, the oldest packet in it is dropped (drop =
+#     oldest, for housekeeping, where the latest values matter most) or
+#     the new one is (drop = newest, for event messages, which are read in
+#     order)
+#
+# Queues are drained by strict priority (the first class listed always
+# goes first) or weighted (in turn, each class publishing up to its weight
+# in packets, so no class is starved), at most rate packets per second if
+# rate is set, which keeps the publishing within what the subscribers can
+# take.
+#
+# Putting and getting a packet are a few deque and dictionary operations.
+#
+
+import csv
+import time
+from collections import deque
+from pathlib import Path
+
+ROOTDIR = Path(__file__).resolve().parent
+
+PRIORITY_FILE = f'{ROOTDIR}/priority.txt'
+
+SCHEDULING = ('strict', 'weighted')
+DROP = ('oldest', 'newest')
+# Most packets published at once after a pause, in seconds of rate
+BURST = 0.1
+
+COUNTERS = ('queued', 'published', 'dropped', 'decimated')
+
+
+#
+# Reads priority.txt into PriorityQueues keyword arguments; returns {} if
+# it defines no class
+#
+def load_priority(priority_file=PRIORITY_FILE):
+    settings = {'classes': [], 'packet_classes': {}}
+    try:
+        with open(priority_file) as priority_obj:
+            for row in csv.reader(priority_obj, skipinitialspace=True):
+                if not row or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                row = [field.strip() for field in row]
+                if row[0] == 'class' and len(row) == 6:
+                    settings['classes'].append(
+                        (row[1], int(row[2]), int(row[3]), row[4],
+                         int(row[5])))
+                elif row[0] in ('scheduling', 'default') and len(row) == 2:
+                    settings[row[0]] = row[1]
+                elif row[0] == 'rate' and len(row) == 2:
+                    settings['rate'] = float(row[1])
+                elif len(row) == 2:
+                    settings['packet_classes'][int(row[0], 0)] = row[1]
+                else:
+                    raise ValueError(f'{priority_file}: invalid line '
+                                     f'{", ".join(row)}')
+    except IOError:
+        pass
+    return settings if settings['classes'] else {}
+
+
+class PriorityClass:
+    __slots__ = ('name', 'queue', 'length', 'weight', 'drop_oldest',
+                 'decimation', 'decimation_counts', 'credit', 'queued',
+                 'published', 'dropped', 'decimated')
+
+    def __init__(self, name, length, weight, drop, decimation):
+        if length < 1 or weight < 1 or decimation < 1 or drop not in DROP:
+            raise ValueError(f'Invalid priority class {name}')
+        self.name = name
+        self.queue = deque()
+        self.length = length
+        self.weight = weight
+        self.drop_oldest = drop == 'oldest'
+        self.decimation = decimation
+        # packet id: packets seen while decimating
+        self.decimation_counts = {}
+        # Packets left to publish in its turn (weighted)
+        self.credit = weight
+        self.queued = 0
+        self.published = 0
+        self.dropped = 0
+        self.decimated = 0
+
+
+class PriorityQueues:
+
+    #
+    # classes are (name, queue length, weight, drop, decimation), from the
+    # highest priority to the lowest; packet_classes is {packet id: class
+    # name}, other packets are in the default class (the last one if not
+    # given)
+    #
+    def __init__(self, classes, packet_classes=None, default=None,
+                 scheduling='strict', rate=0.0):
+        if not classes:
+            raise ValueError('No priority class')
+        if scheduling not in SCHEDULING:
+            raise ValueError(f'Unknown scheduling {scheduling}')
+        self.classes = [PriorityClass(*settings) for settings in classes]
+        by_name = {cls.name: cls for cls in self.classes}
+        try:
+            self.default = by_name[default] if default else self.classes[-1]
+            # packet id: PriorityClass
+            self.packet_classes = {
+                pkt_id: by_name[name]
+                for pkt_id, name in (packet_classes or {}).items()}
+        except KeyError as e:
+            raise ValueError(f'Unknown priority class {e}')
+        self.weighted = scheduling == 'weighted'
+        # Class whose turn it is (weighted)
+        self.turn = 0
+        self.rate = rate
+        self.burst = max(rate * BURST, 1.0)
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+        # Packets in all the queues
+        self.total = 0
+
+    def counters(self):
+        return {cls.name: dict({counter: getattr(cls, counter)
+                                for counter in COUNTERS},
+                               depth=len(cls.queue))
+                for cls in self.classes}
+
+    #
+    # Queues item for the packet id, or sheds it or an older one
+    #
+    def put(self, pkt_id, item):
+        cls = self.packet_classes.get(pkt_id, self.default)
+        queue = cls.queue
+        if cls.decimation > 1 and len(queue) * 2 > cls.length:
+            count = cls.decimation_counts.get(pkt_id, 0)
+            cls.decimation_counts[pkt_id] = count + 1
+            if count % cls.decimation:
+                cls.decimated += 1
+                return
+        if len(queue) >= cls.length:
+            cls.dropped += 1
+            if not cls.drop_oldest:
+                return
+            queue.popleft()
+            self.total -= 1
+        queue.append(item)
+        cls.queued += 1
+        self.total += 1
+
+    #
+    # True if there is something to publish now
+    #
+    def ready(self, now):
+        return self.total > 0 and (not self.rate or self.refill(now) >= 1)
+
+    def refill(self, now):
+        self.tokens = min(self.tokens + (now - self.last_refill) * self.rate,
+                          self.burst)
+        self.last_refill = now
+        return self.tokens
+
+    #
+    # Returns up to limit items to publish, in order, now being
+    # time.monotonic()
+    #
+    def get(self, limit, now):
+        if self.rate:
+            limit = min(limit, int(self.refill(now)))
+        limit = min(limit, self.total)
+        if limit <= 0:
+            return []
+        self.total -= limit
+        self.tokens -= limit if self.rate else 0
+        items = []
+        if not self.weighted:
+            for cls in self.classes:
+                take = min(limit - len(items), len(cls.queue))
+                if take:
+                    popleft = cls.queue.popleft
+                    items.extend(popleft() for _ in range(take))
+                    cls.published += take
+                    if len(items) == limit:
+                        break
+            return items
+
+        classes = self.classes
+        while len(items) < limit:
+            cls = classes[self.turn]
+            if cls.queue and cls.credit:
+                take = min(limit - len(items), len(cls.queue), cls.credit)
+                popleft = cls.queue.popleft
+                items.extend(popleft() for _ in range(take))
+                cls.published += take
+                cls.credit -= take
+            else:
+                self.turn = (self.turn + 1) % len(classes)
+                classes[self.turn].credit = classes[self.turn].weight
+        return items
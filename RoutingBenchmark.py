@@ -0,0 +1,452 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# End-to-end routing benchmark (not used by Ground System, no Qt needed)
+#
+# Runs the routing path of the RoutingService headless in its own process
+# (UDP socket, FrameDecoder, LimitMonitor and TelemetryRouter, publishing
+# on a private bus) and, for every combination of --rates and --sizes:
+#
+#   - starts --subscribers ZMQ subscribers, each in its own process. The
+#     first subscribes like TSTlmReceiver (every packet), the others like
+#     GTTlmReceiver (one page's packet ID each, round robin over the
+#     FleetBenchmark packet IDs)
+#   - sends UDP packets at the rate for --duration seconds, each carrying
+#     its send time and a sequence number after the 12 byte headers
+#   - waits for the subscribers to drain and compares what they received
+#     with what was sent
+#
+# Reported for each subscriber kind: throughput, loss, and p50/p99/p999/max
+# latency from the send time (end to end) and from the router's receive
+# time stamp (bus). The results are written as JSON to --output and
+# summarized as a table.
+#
+# --priority routes through the priority queues of priority.txt (see
+# PriorityQueues.py), or of its commented out example if it has no class
+# lines, publishing at most --publish-rate packets per second
+# if given, and reports the page subscribers by priority class, e.g. for
+# ten times more telemetry than is published:
+#
+#   ~$ python3 RoutingBenchmark.py --rates=1000,10000,0 --sizes=64,1024
+#   ~$ python3 RoutingBenchmark.py --rates=20000 --priority --publish-rate=2000
+#
+
+import getopt
+import getpass
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import struct
+import sys
+import time
+from array import array
+
+import zmq
+
+from FleetBenchmark import PACKET_IDS
+from FrameDecoder import FrameDecoder
+from LimitMonitor import LimitMonitor
+from PriorityQueues import PriorityQueues, load_priority
+from TelemetryRouter import RECEIVE_TIME, SOCKET_BUFFER, TelemetryRouter
+
+BENCH_BUS = f'ipc:///tmp/GroundSystem-bench-{getpass.getuser()}'
+
+# Send time (time.time_ns()) and sequence number, after the primary and
+# secondary headers
+SEND_STAMP = struct.Struct('>QI')
+STAMP_OFFSET = 12
+MIN_SIZE = STAMP_OFFSET + SEND_STAMP.size
+MAX_SIZE = 65507
+
+# Seconds between sends of the rate limited sender
+TICK = 0.001
+# Most packets sent at once when unlimited or catching up
+MAX_BATCH = 256
+# Seconds for the subscriptions to reach the router before sending
+SETTLE = 0.5
+# Seconds without a message after which a subscriber is done
+IDLE = 0.5
+
+PERCENTILES = (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))
+
+# The example classes of priority.txt
+EXAMPLE_PRIORITY = {
+    'classes': [('critical', 4096, 8, 'newest', 1),
+                ('housekeeping', 4096, 4, 'oldest', 1),
+                ('bulk', 4096, 1, 'oldest', 10)],
+    'scheduling': 'strict',
+    'default': 'housekeeping',
+    'packet_classes': {0x0808: 'critical'}
+}
+
+
+#
+# Routes datagrams from a UDP socket on an ephemeral port, as
+# RoutingService.run() does, until stop is set and the socket is idle;
+# priority is PriorityQueues keyword arguments, or None
+#
+def router_process(bus, port, ready, stop, priority):
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind(bus)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.1)
+    port.value = sock.getsockname()[1]
+
+    try:
+        limit_monitor = LimitMonitor()
+    except (IOError, ValueError) as e:
+        print("Limit monitor disabled:", e)
+        limit_monitor = None
+    router = TelemetryRouter(publisher, spacecraft_map={},
+                             limit_monitor=limit_monitor)
+    router.framing = FrameDecoder()
+    if priority:
+        router.queues = PriorityQueues(**priority)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        sock.setblocking(False)
+    ready.set()
+
+    try:
+        while True:
+            try:
+                router.receive(sock)
+                if priority and not router.queues.total and stop.is_set():
+                    break
+            except socket.timeout:
+                if stop.is_set():
+                    break
+    except KeyboardInterrupt:
+        pass
+    sock.close()
+    if limit_monitor:
+        limit_monitor.close()
+    context.destroy()
+
+
+#
+# Receives like TSTlmReceiver (msg_id None) or GTTlmReceiver until stop is
+# set and no message has arrived for IDLE seconds; puts its counts and
+# latencies (ns) on results
+#
+def subscriber_process(index, msg_id, bus, ready, stop, results):
+    context = zmq.Context()
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.RCVHWM, 0)
+    subscriber.connect(bus)
+    if msg_id is None:
+        subscriber.setsockopt_string(zmq.SUBSCRIBE, 'GroundSystem')
+        suffix = b''
+    else:
+        # A page opened from the main window (see page_subscription() in
+        # Subsystems/tlmGUI/GenericTelemetry.py)
+        topic = f'.TelemetryPackets.{hex(msg_id)}'
+        subscriber.setsockopt_string(zmq.SUBSCRIBE,
+                                     f'GroundSystem.Spacecraft1{topic}')
+        suffix = topic.encode()
+    ready.release()
+
+    latencies = array('q')
+    bus_latencies = array('q')
+    received = 0
+    first = last = 0
+    try:
+        while True:
+            if not subscriber.poll(IDLE * 1000):
+                if stop.is_set():
+                    break
+                continue
+            parts = subscriber.recv_multipart()
+            now = time.time_ns()
+            if not parts[0].endswith(suffix):
+                continue
+            send_ns = SEND_STAMP.unpack_from(parts[1], STAMP_OFFSET)[0]
+            latencies.append(now - send_ns)
+            if len(parts) > 2:
+                bus_latencies.append(now - RECEIVE_TIME.unpack(parts[2])[0])
+            received += 1
+            first = first or now
+            last = now
+    except KeyboardInterrupt:
+        pass
+    context.destroy()
+    results.put((index, received, first, last, latencies.tobytes(),
+                 bus_latencies.tobytes()))
+
+
+#
+# Sends packets of the given size at rate packets per second (0 for as
+# fast as possible) for duration seconds, round robin over PACKET_IDS;
+# puts the number sent per packet ID on results
+#
+def sender_process(port, rate, size, duration, results):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    dest = ('127.0.0.1', port)
+    packets = [bytearray(struct.pack('>HHH', msg_id, 0xC000, size - 7) +
+                         bytes(size - 6)) for msg_id in PACKET_IDS]
+    sent = [0] * len(PACKET_IDS)
+    num_ids = len(PACKET_IDS)
+    pack_into, time_ns = SEND_STAMP.pack_into, time.time_ns
+    seq = 0
+    credit = 0.0
+    start = last = time.monotonic()
+    while last - start < duration:
+        now = time.monotonic()
+        if rate:
+            credit = min(credit + rate * (now - last), MAX_BATCH)
+            count = int(credit)
+            credit -= count
+        else:
+            count = MAX_BATCH
+        last = now
+        for _ in range(count):
+            index = seq % num_ids
+            packet = packets[index]
+            packet[2:4] = (0xC000 | (seq & 0x3FFF)).to_bytes(2, 'big')
+            pack_into(packet, STAMP_OFFSET, time_ns(), seq)
+            try:
+                sock.sendto(packet, dest)
+            except OSError:
+                # Full socket buffer: counts as sent, i.e. lost
+                pass
+            sent[index] += 1
+            seq += 1
+        if rate:
+            time.sleep(max(TICK - (time.monotonic() - now), 0))
+    elapsed = time.monotonic() - start
+    sock.close()
+    results.put((sent, elapsed))
+
+
+#
+# Percentiles of latencies (ns) in microseconds
+#
+def latency_summary(latencies):
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    summary = {name: ordered[min(int(fraction * len(ordered)),
+                                 len(ordered) - 1)] / 1000
+               for name, fraction in PERCENTILES}
+    summary['max'] = ordered[-1] / 1000
+    return summary
+
+
+#
+# Runs one rate and size; returns its results. Page subscribers are
+# reported by the priority class of their packet ID if priority is given
+#
+def run_point(port, rate, size, duration, num_subscribers, priority=None):
+    stop = multiprocessing.Event()
+    ready = multiprocessing.Semaphore(0)
+    results = multiprocessing.Queue()
+    # None: every packet (TSTlmReceiver), otherwise one page's packet ID
+    subscriptions = [None] + [PACKET_IDS[n % len(PACKET_IDS)]
+                              for n in range(num_subscribers - 1)]
+    subscribers = [multiprocessing.Process(
+        target=subscriber_process,
+        args=(index, msg_id, BENCH_BUS, ready, stop, results))
+        for index, msg_id in enumerate(subscriptions)]
+    for subscriber in subscribers:
+        subscriber.start()
+    for _ in subscribers:
+        ready.acquire()
+    time.sleep(SETTLE)
+
+    sender_results = multiprocessing.Queue()
+    sender = multiprocessing.Process(
+        target=sender_process,
+        args=(port, rate, size, duration, sender_results))
+    sender.start()
+    sent, elapsed = sender_results.get()
+    sender.join()
+    stop.set()
+    received = sorted(results.get() for _ in subscribers)
+    for subscriber in subscribers:
+        subscriber.join()
+
+    total_sent = sum(sent)
+    point = {
+        'rate': rate,
+        'size': size,
+        'sent': total_sent,
+        'send_rate': round(total_sent / elapsed),
+        'kinds': {}
+    }
+    kinds = {}
+    for result in received:
+        msg_id = subscriptions[result[0]]
+        if msg_id is None:
+            kind = 'system'
+        elif priority:
+            kind = priority['packet_classes'].get(
+                msg_id, priority.get('default', priority['classes'][-1][0]))
+        else:
+            kind = 'page'
+        kinds.setdefault(kind, []).append(result)
+    for kind, members in kinds.items():
+        expected = count = 0
+        throughputs = []
+        latencies, bus_latencies = array('q'), array('q')
+        for index, got, first, last, lat, bus_lat in members:
+            msg_id = subscriptions[index]
+            expected += total_sent if msg_id is None else \
+                sent[PACKET_IDS.index(msg_id)]
+            count += got
+            if last > first:
+                throughputs.append(got / ((last - first) / 1e9))
+            latencies.frombytes(lat)
+            bus_latencies.frombytes(bus_lat)
+        point['kinds'][kind] = {
+            'subscribers': len(members),
+            'expected': expected,
+            'received': count,
+            'loss': round(1 - count / expected, 6) if expected else 0.0,
+            'throughput': round(sum(throughputs) / len(throughputs))
+            if throughputs else 0,
+            'latency_us': latency_summary(latencies),
+            'bus_latency_us': latency_summary(bus_latencies)
+        }
+    return point
+
+
+def print_table(points):
+    print(f'{"rate":>8} {"size":>6} {"sent/s":>8} {"kind":>12} {"subs":>5} '
+          f'{"recv/s":>8} {"loss %":>7} {"p50 us":>9} {"p99 us":>9} '
+          f'{"p999 us":>9} {"max us":>9}')
+    for point in points:
+        for kind, stats in point['kinds'].items():
+            latency = stats['latency_us'] or dict.fromkeys(
+                ('p50', 'p99', 'p999', 'max'), 0)
+            print(f'{point["rate"] or "max":>8} {point["size"]:>6} '
+                  f'{point["send_rate"]:>8} {kind:>12} '
+                  f'{stats["subscribers"]:>5} {stats["throughput"]:>8} '
+                  f'{100 * stats["loss"]:>7.2f} {latency["p50"]:>9.0f} '
+                  f'{latency["p99"]:>9.0f} {latency["p999"]:>9.0f} '
+                  f'{latency["max"]:>9.0f}')
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: RoutingBenchmark.py [--rates=<pps>,...] "
+           "[--sizes=<bytes>,...] [--duration=<s>] [--subscribers=<n>] "
+           "[--output=<file>] [--priority] [--publish-rate=<pps>]\n\n"
+           "A rate of 0 sends as fast as possible.\n"
+           "example: --rates=1000,10000,0 --sizes=64,1024 --subscribers=8"))
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    sweep_rates = [1000, 10000, 50000]
+    sweep_sizes = [64, 512, 1400]
+    point_duration = 3.0
+    subscriber_count = 4
+    output_file = 'routing-benchmark.json'
+    priority_settings = None
+    publish_rate = None
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "hd:s:o:",
+            ["help", "rates=", "sizes=", "duration=", "subscribers=",
+             "output=", "priority", "publish-rate="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif opt == "--rates":
+                sweep_rates = [int(rate) for rate in arg.split(',')]
+            elif opt == "--sizes":
+                sweep_sizes = [int(size) for size in arg.split(',')]
+            elif opt in ("-d", "--duration"):
+                point_duration = float(arg)
+            elif opt in ("-s", "--subscribers"):
+                subscriber_count = int(arg)
+            elif opt in ("-o", "--output"):
+                output_file = arg
+            elif opt == "--priority":
+                priority_settings = load_priority() or dict(EXAMPLE_PRIORITY)
+            elif opt == "--publish-rate":
+                publish_rate = float(arg)
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    if subscriber_count < 1 or \
+            not all(MIN_SIZE <= size <= MAX_SIZE for size in sweep_sizes):
+        print(f'Need at least one subscriber and sizes of {MIN_SIZE} to '
+              f'{MAX_SIZE} bytes')
+        sys.exit(2)
+    if priority_settings and publish_rate is not None:
+        priority_settings['rate'] = publish_rate
+
+    router_port = multiprocessing.Value('i', 0)
+    router_ready = multiprocessing.Event()
+    router_stop = multiprocessing.Event()
+    router = multiprocessing.Process(
+        target=router_process,
+        args=(BENCH_BUS, router_port, router_ready, router_stop,
+              priority_settings))
+    router.start()
+    if not router_ready.wait(10):
+        print('Router did not start')
+        router.terminate()
+        sys.exit(1)
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'duration': point_duration,
+        'subscribers': subscriber_count,
+        'priority': priority_settings,
+        'points': []
+    }
+    try:
+        for sweep_rate in sweep_rates:
+            for sweep_size in sweep_sizes:
+                print(f'rate {sweep_rate or "max"}, size {sweep_size} ...')
+                report['points'].append(
+                    run_point(router_port.value, sweep_rate, sweep_size,
+                              point_duration, subscriber_count,
+                              priority_settings))
+    except KeyboardInterrupt:
+        pass
+    router_stop.set()
+    router.join()
+
+    with open(output_file, 'w') as output_obj:
+        json.dump(report, output_obj, indent=2)
+    print()
+    print_table(report['points'])
+    print('\nResults written to', output_file)
@@ -25,11 +25,21 @@ from time import sleep
 import zmq
 from PyQt5.QtCore import QThread, pyqtSignal
 
+from FrameDecoder import FrameDecoder, load_framing
+from LimitMonitor import LimitMonitor
+from PriorityQueues import PriorityQueues, load_priority
+from TelemetryRouter import MERGE_FLUSH_INTERVAL, SOCKET_BUFFER, \
+    TelemetryRouter
+from Metrics import counter
+
 import getpass
 
 # Receive port where the CFS TO_Lab app sends the telemetry packets
 udp_recv_port = 2234
 
+SOCKET_ERRORS = counter('groundsystem_router_socket_errors',
+                        'Errors reading the telemetry socket')
+
 
 #
 # Receive telemetry packets, apply the appropriate header
@@ -37,28 +47,57 @@ udp_recv_port = 2234
 #
 class RoutingService(QThread):
     # Signal to update the spacecraft combo box (list) on main window GUI
-    signal_update_ip_list = pyqtSignal(str, bytes)
+    signal_update_ip_list = pyqtSignal(str, str)
 
     def __init__(self):
         super().__init__()
 
-        # Init lists
-        self.ip_addresses_list = ["All"]
-        self.spacecraft_names = ["All"]
-        self.special_pkt_id = []
-        self.special_pkt_name = []
-
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
         # Init zeroMQ
         self.context = zmq.Context()
-        self.publisher = self.context.socket(zmq.PUB)
+        # XPUB to see the filter subscriptions (see TelemetryRouter.py)
+        self.publisher = self.context.socket(zmq.XPUB)
         self.publisher.bind(f"ipc:///tmp/GroundSystem-{getpass.getuser()}")
 
+        # Limit checking (see LimitMonitor.py)
+        try:
+            self.limit_monitor = LimitMonitor()
+        except (IOError, ValueError) as e:
+            print("Limit monitor disabled:", e)
+            self.limit_monitor = None
+
+        # Packet extraction from transfer frames (see FrameDecoder.py)
+        self.framing = FrameDecoder(**load_framing())
+
+        # Spacecraft names and packet routing (see TelemetryRouter.py)
+        self.router = TelemetryRouter(self.publisher,
+                                      limit_monitor=self.limit_monitor)
+        self.router.framing = self.framing
+        if self.limit_monitor:
+            self.router.tlm_offset = self.limit_monitor.tlm_offset
+
+        # Priority classes and load shedding (see PriorityQueues.py)
+        try:
+            priority = load_priority()
+            if priority:
+                self.router.queues = PriorityQueues(**priority)
+        except ValueError as e:
+            print("Priority queues disabled:", e)
+
     # Run thread
     def run(self):
         # Init udp socket
         self.sock.bind(('', udp_recv_port))
+        # With priority queues the router waits for datagrams itself;
+        # otherwise wake up to release merged packets held for a gap when
+        # nothing arrives (see StreamMerge.py)
+        if self.router.queues is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 SOCKET_BUFFER)
+            self.sock.setblocking(False)
+        elif self.router.merged_names:
+            self.sock.settimeout(MERGE_FLUSH_INTERVAL)
 
         print('Attempting to wait for UDP messages')
 
@@ -68,52 +107,27 @@ class RoutingService(QThread):
             # Wait for UDP messages
             while True:
                 try:
-                    # Receive message
-                    datagram, host = self.sock.recvfrom(
-                        4096)  # buffer size is 1024 bytes
-
-                    # Ignore datagram if it is not long enough (doesn't contain tlm header?)
-                    if len(datagram) < 6:
-                        continue
-
-                    # Read host address
-                    host_ip_address = host[0]
-
-                    #
-                    # Add Host to the list if not already in list
-                    #
-                    if host_ip_address not in self.ip_addresses_list:
-                        ## MAKE SURE THERE'S NO SPACE BETWEEN "Spacecraft"
-                        ## AND THE FIRST CURLY BRACE!!!
-                        hostname = f'Spacecraft{len(self.spacecraft_names)}'
-                        my_hostname_as_bytes = hostname.encode()
-                        print("Detected", hostname, "at", host_ip_address)
-                        self.ip_addresses_list.append(host_ip_address)
-                        self.spacecraft_names.append(my_hostname_as_bytes)
-                        self.signal_update_ip_list.emit(host_ip_address,
-                                                        my_hostname_as_bytes)
-
-                    # Forward the message using zeroMQ
-                    name = self.spacecraft_names[self.ip_addresses_list.index(
-                        host_ip_address)]
-                    self.forwardMessage(datagram, name)
+                    # Receive message and forward the packets in it
+                    # using zeroMQ
+                    new_spacecraft = self.router.receive(self.sock)
+
+                    # Add Host to the list on first contact
+                    if new_spacecraft:
+                        print("Detected", new_spacecraft.name, "at",
+                              new_spacecraft.addresses[-1])
+                        self.signal_update_ip_list.emit(
+                            new_spacecraft.addresses[-1], new_spacecraft.name)
+
+                except socket.timeout:
+                    self.router.flush()
 
                 # Handle errors
                 except socket.error:
                     print('Ignored socket error for attempt', socket_error_count)
                     socket_error_count += 1
+                    SOCKET_ERRORS.inc()
                     sleep(1)
 
-    # Apply header using hostname and packet id and send msg using zeroMQ
-    def forwardMessage(self, datagram, hostName):
-        # Forward message to channel GroundSystem.<hostname>.<pkt_id>
-        pkt_id = self.get_pkt_id(datagram)
-        my_decoded_hostname = hostName.decode()
-        header = f"GroundSystem.{my_decoded_hostname}.TelemetryPackets.{pkt_id}"
-        my_header_as_bytes = header.encode()
-        self.publisher.send_multipart([my_header_as_bytes, datagram])
-        # print(header)
-
     # Read the packet id from the telemetry packet
     @staticmethod
     def get_pkt_id(datagram):
@@ -124,4 +138,7 @@ class RoutingService(QThread):
     # Close ZMQ vars
     def stop(self):
         self.sock.close()
+        self.router.close()
+        if self.limit_monitor:
+            self.limit_monitor.close()
         self.context.destroy()
@@ -0,0 +1,214 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Merges the packets of one spacecraft received by several ground stations
+# into one stream (see TelemetryRouter.py)
+#
+# Every station forwards its own copy of a packet, and may miss packets or
+# deliver them late. StreamMerge drops the copies and puts the packets of
+# each packet id back in sequence count order:
+#
+#   - a packet is a duplicate if a packet with the same first 4 bytes
+#     (packet id and sequence count) and the same content hash is among the
+#     last window packets; the window is a fixed ring of keys, so memory
+#     doesn't grow with the number of stations or the traffic
+#   - a packet with the next sequence count of its packet id is released
+#     at once (the usual case, a few dictionary lookups)
+#   - a packet after a gap is held until the missing packets arrive, from
+#     any station, or for at most jitter seconds; then the gap is counted
+#     as lost and the held packets are released in order
+#   - a packet from before the next sequence count (it came after its gap
+#     was given up on, or the counts restarted) is released at once as late
+#
+# Duplicates are dropped before anything else is done with them, so the
+# cost per packet doesn't depend on the number of stations.
+#
+# The settings are read from merge.txt.
+#
+
+import csv
+import math
+from heapq import heappop, heappush
+from pathlib import Path
+
+ROOTDIR = Path(__file__).resolve().parent
+
+MERGE_FILE = f'{ROOTDIR}/merge.txt'
+
+SEQUENCE_MASK = 0x3FFF
+# Sequence counts up to half the range ahead of the next one are gaps,
+# the others are late
+HALF_SEQUENCE = 0x2000
+
+COUNTERS = ('copies', 'duplicates', 'reordered', 'late', 'lost')
+
+
+#
+# Reads merge.txt into StreamMerge keyword arguments
+#
+def load_merge(merge_file=MERGE_FILE):
+    settings = {}
+    try:
+        with open(merge_file) as merge_obj:
+            for row in csv.reader(merge_obj, delimiter='=',
+                                  skipinitialspace=True):
+                if not row or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                key, value = row[0].strip(), row[1].strip()
+                if key == 'window':
+                    settings[key] = int(value)
+                elif key == 'jitter':
+                    settings[key] = float(value)
+                else:
+                    raise ValueError(f'{merge_file}: unknown setting {key}')
+    except IOError:
+        pass
+    return settings
+
+
+class Stream:
+    __slots__ = ('next', 'pending', 'deadline')
+
+    def __init__(self, sequence):
+        # Next sequence count to release, not wrapped
+        self.next = sequence
+        # Heap of the held packets, as (sequence count not wrapped, packet,
+        # receive time, deadline)
+        self.pending = []
+        # When the first gap is given up on
+        self.deadline = math.inf
+
+
+class StreamMerge:
+
+    def __init__(self, window=4096, jitter=0.05):
+        if window < 1 or jitter < 0:
+            raise ValueError(f'Invalid merge window {window} or jitter '
+                             f'{jitter}')
+        self.window = window
+        self.jitter = jitter
+        # Keys of the last window packets, and the same in a ring
+        self.seen = set()
+        self.ring = [None] * window
+        self.ring_index = 0
+        # packet id: Stream
+        self.streams = {}
+        # Streams with held packets
+        self.waiting = set()
+        self.held = 0
+        self.next_deadline = math.inf
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+
+    def counters(self):
+        return {counter: getattr(self, counter) for counter in COUNTERS}
+
+    #
+    # Adds a packet received at recv_ns (time.time_ns()) from any station,
+    # now being time.monotonic(); returns the [(packet, receive time)] to
+    # publish, in order
+    #
+    def add(self, packet, recv_ns, now):
+        self.copies += 1
+        key = (packet[:4], hash(packet))
+        if key in self.seen:
+            self.duplicates += 1
+            return ()
+        index = self.ring_index
+        evicted = self.ring[index]
+        if evicted is not None:
+            self.seen.discard(evicted)
+        self.ring[index] = key
+        self.seen.add(key)
+        self.ring_index = index + 1 if index + 1 < self.window else 0
+
+        stream_id = (packet[0] << 8) | packet[1]
+        sequence = ((packet[2] & 0x3F) << 8) | packet[3]
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            stream = self.streams[stream_id] = Stream(sequence)
+        ahead = (sequence - stream.next) & SEQUENCE_MASK
+        if ahead == 0:
+            stream.next += 1
+            if not stream.pending:
+                return ((packet, recv_ns),)
+            released = [(packet, recv_ns)]
+            self.release(stream, released)
+            return released
+        if ahead >= HALF_SEQUENCE:
+            self.late += 1
+            return ((packet, recv_ns),)
+
+        deadline = now + self.jitter
+        heappush(stream.pending,
+                 (stream.next + ahead, packet, recv_ns, deadline))
+        self.held += 1
+        if stream.deadline == math.inf:
+            stream.deadline = deadline
+            self.waiting.add(stream)
+            self.next_deadline = min(self.next_deadline, deadline)
+        released = []
+        # Keeps the held packets bounded if a gap lasts
+        while self.held > self.window and stream.pending:
+            self.skip(stream, released)
+        return released
+
+    #
+    # Returns the [(packet, receive time)] whose gaps have waited for
+    # jitter seconds, in order
+    #
+    def flush(self, now):
+        if now < self.next_deadline:
+            return ()
+        released = []
+        next_deadline = math.inf
+        for stream in list(self.waiting):
+            while stream.pending and stream.deadline <= now:
+                self.skip(stream, released)
+            if stream.pending:
+                next_deadline = min(next_deadline, stream.deadline)
+            else:
+                self.waiting.discard(stream)
+        self.next_deadline = next_deadline
+        return released
+
+    #
+    # Releases the held packets of stream that are next in sequence
+    #
+    def release(self, stream, released):
+        pending = stream.pending
+        if not pending or pending[0][0] > stream.next:
+            return
+        while pending and pending[0][0] <= stream.next:
+            number, packet, recv_ns, _ = heappop(pending)
+            if number == stream.next:
+                stream.next += 1
+            self.held -= 1
+            self.reordered += 1
+            released.append((packet, recv_ns))
+        stream.deadline = min(entry[3] for entry in pending) if pending \
+            else math.inf
+
+    #
+    # Gives up on the first gap of stream and releases what follows it
+    #
+    def skip(self, stream, released):
+        self.lost += stream.pending[0][0] - stream.next
+        stream.next = stream.pending[0][0]
+        self.release(stream, released)
@@ -53,14 +53,27 @@
 # ~$ python CHeaderParser.py
 #	The above command would look in CHeaderParser-hdr-paths.txt for its list
 #	of header paths.
+# ~$ python CHeaderParser.py --batch
+#	Same list of headers, but all command codes and command structures are
+#	resolved automatically without prompting (see run_batch()).
 #
 ###############################################################################
 
+import atexit
+import getopt
+import hashlib
+import json
+import os
 import pickle
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from CommandDatabase import DEFAULT_DB_FILE, update_database
+from HTMLDocsParser import get_macro_index
+from MacroIndex import COMMENT_RE, DEFINE_RE, MacroIndex
+
 ROOTDIR = Path(sys.argv[0]).resolve().parent
 
 
@@ -109,16 +122,305 @@ def get_file_list(filename='CHeaderParser-hdr-paths.txt'):
     return []
 
 
+#
+# Batch mode
+#
+# Parses every header in the paths file without prompting. Each header is
+# scanned once (in a process pool) into an index of its #defines, typedef
+# aliases and structures; command codes are then matched to command
+# structures by name and the CommandFiles/ParameterFiles pickles written.
+# Parse results are cached by header content hash so unchanged headers are
+# not parsed again on the next run.
+#
+CACHE_FILE = f'{ROOTDIR}/.CHeaderParser-cache.json'
+CACHE_VERSION = 1
+MACRO_CACHE_FILE = f'{ROOTDIR}/.MacroIndex-cache.json'
+
+ALIAS_RE = re.compile(r'\btypedef\s+(?:const\s+)?(\w+)\s+(\w+)\s*;')
+STRUCT_RE = re.compile(r'\b(typedef\s+)?struct\s*(\w+)?\s*\{')
+FIELD_RE = re.compile(r'^(?:const\s+|volatile\s+)*(\w+)\s+(\w+)\s*((?:\[[^\]]*\])*)$')
+CAMEL_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+
+#
+# Single pass over one header: returns its defines, aliases and structs
+#
+def index_header(hdr_file):
+    with open(hdr_file) as hdr_obj:
+        text = COMMENT_RE.sub(' ', hdr_obj.read())
+
+    defines = dict(DEFINE_RE.findall(text))
+    aliases = {new: old for old, new in ALIAS_RE.findall(text)}
+    structs = {}
+
+    for match in STRUCT_RE.finditer(text):
+        # Find the matching closing brace (bodies may contain unions)
+        depth, pos = 1, match.end()
+        while depth and pos < len(text):
+            if text[pos] == '{':
+                depth += 1
+            elif text[pos] == '}':
+                depth -= 1
+            pos += 1
+        body = text[match.end():pos - 1]
+        tail = text[pos:text.find(';', pos)].strip()
+        names = [n for n in (match.group(2), tail.split(',')[0].strip()) if n]
+
+        fields = []
+        for decl in body.split(';'):
+            field = FIELD_RE.match(' '.join(decl.split()))
+            if field:
+                fields.append(list(field.groups()))
+        for name in names:
+            structs[name] = fields
+
+    return {'defines': defines, 'aliases': aliases, 'structs': structs}
+
+
+#
+# Splits an identifier into a set of lower case words for name matching,
+# e.g. CFE_ES_SetMaxPRCountCmd_t and CFE_ES_SET_MAX_PR_COUNT_CC both
+# become {cfe, es, set, max, pr, count}
+#
+def name_words(name):
+    words = set()
+    for part in name.split('_'):
+        words.update(w.lower() for w in CAMEL_RE.findall(part))
+    return frozenset(words - {'cmd', 't', 'cc'})
+
+
+#
+# Builds the macro index for a list of headers, falling back to the
+# headers searched by HTMLDocsParser (e.g. for OS_MAX_API_NAME)
+#
+def build_macro_index(file_list):
+    macros = MacroIndex(file_list, MACRO_CACHE_FILE)
+    macros.add_defines(get_macro_index().defines)
+    return macros
+
+
+#
+# Flattens a command structure into its parameters, skipping the command
+# header and descending into payload structures
+#
+def flatten_struct(struct_name, structs, aliases, depth=0):
+    params = []
+    for c_type, name, dims in structs.get(struct_name, []):
+        while c_type in aliases and c_type not in structs:
+            c_type = aliases[c_type]
+        if any(x in name or x in c_type for x in ('Header', 'Hdr')):
+            continue
+        if c_type in structs and not dims and depth < 8:
+            params.extend(flatten_struct(c_type, structs, aliases, depth + 1))
+        else:
+            params.append((c_type, name, dims))
+    return params
+
+
+def file_digest(hdr_file):
+    with open(hdr_file, 'rb') as hdr_obj:
+        return hashlib.sha256(hdr_obj.read()).hexdigest()
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as cache_obj:
+            cache = json.load(cache_obj)
+        if cache.get('version') == CACHE_VERSION:
+            return cache['headers']
+    except (IOError, ValueError):
+        pass
+    return {}
+
+
+def save_cache(headers):
+    with open(CACHE_FILE, 'w') as cache_obj:
+        json.dump({'version': CACHE_VERSION, 'headers': headers}, cache_obj)
+
+
+#
+# Writes a pickle only if its contents changed
+#
+def write_pickle(pickle_file, data):
+    new = pickle.dumps(data)
+    try:
+        with open(pickle_file, 'rb') as pickle_obj:
+            if pickle_obj.read() == new:
+                return False
+    except IOError:
+        pass
+    with open(pickle_file, 'wb') as pickle_obj:
+        pickle_obj.write(new)
+    return True
+
+
+#
+# Keeps the compiled command database in step with the pickles
+#
+def rebuild_database():
+    if update_database():
+        print(f"Rebuilt {DEFAULT_DB_FILE}")
+
+
+def run_batch(file_list, jobs=None):
+    cache = load_cache()
+    digests = {hdr: file_digest(hdr) for hdr in file_list}
+    stale = [hdr for hdr in file_list if digests[hdr] not in cache]
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for hdr, index in zip(stale, pool.map(index_header, stale)):
+                cache[digests[hdr]] = index
+    print(f"Parsed {len(stale)} of {len(file_list)} header files "
+          f"({len(file_list) - len(stale)} unchanged)")
+
+    # Merge the per-file indexes; macros and structs may be split across
+    # several headers (e.g. *_msg.h and *_msgdefs.h)
+    macros = MacroIndex()
+    aliases, structs = {}, {}
+    for hdr in file_list:
+        index = cache[digests[hdr]]
+        macros.add_defines(index['defines'])
+        aliases.update(index['aliases'])
+        structs.update(index['structs'])
+    macros.add_defines(get_macro_index().defines)
+
+    # Command structures are often aliases of a shared one
+    # (e.g. typedef CFE_ES_NoArgsCmd_t CFE_ES_NoopCmd_t;)
+    struct_words = {}
+    for name in list(structs) + list(aliases):
+        struct_name = name
+        while struct_name in aliases and struct_name not in structs:
+            struct_name = aliases[struct_name]
+        if struct_name in structs and 'payload' not in name.lower():
+            struct_words.setdefault(name_words(name), []).append(struct_name)
+
+    # Command codes, grouped by app prefix (e.g. CFE_ES_NOOP_CC -> CFE_ES_CMD)
+    cmd_groups = {}
+    for hdr in file_list:
+        cmds = []
+        for name, value in cache[digests[hdr]]['defines'].items():
+            code = macros.resolve(value)
+            if name.endswith('_CC') and code is not None:
+                cmds.append((name, code))
+        if cmds:
+            # Without _CC, so the command word of a header with a single
+            # command isn't part of it
+            prefix = os.path.commonprefix([name[:-3] for name, _ in cmds])
+            prefix = prefix[:prefix.rfind('_') + 1]
+            cmd_groups.setdefault(f'{prefix}CMD', []).extend(cmds)
+
+    written, unresolved = 0, []
+    for cmd_file_name, cmds in cmd_groups.items():
+        cmd_desc = [name for name, _ in cmds]
+        cmd_codes = [str(code) for _, code in cmds]
+        written += write_pickle(f'{ROOTDIR}/CommandFiles/{cmd_file_name}',
+                                [cmd_desc, cmd_codes, cmd_desc])
+
+        for cmd_name, _ in cmds:
+            candidates = struct_words.get(name_words(cmd_name), [])
+            if not candidates:
+                unresolved.append((cmd_name, 'no command structure found'))
+                continue
+            # Prefer the command typedef over a same-named struct tag
+            struct_name = sorted(candidates,
+                                 key=lambda n: not n.endswith('_t'))[0]
+
+            param_names, param_desc, data_types_orig, \
+            data_types_new, param_lens, string_lens = ([] for _ in range(6))
+            for c_type, name, dims in flatten_struct(struct_name, structs,
+                                                     aliases):
+                base_type = c_type
+                while base_type in aliases:
+                    base_type = aliases[base_type]
+                data_type_new = find_data_type_new(
+                    base_type, f'{name}{dims}' if dims else name)
+                if not data_type_new:
+                    unresolved.append((cmd_name,
+                                       f'unknown type {c_type} for {name}'))
+                    break
+                string_len = ''
+                if dims:
+                    array_size = dims.strip('[]').split('][')[0]
+                    string_len = macros.resolve(array_size)
+                    if string_len is None or string_len not in range(129):
+                        unresolved.append(
+                            (cmd_name, f'array size {array_size} of {name}'))
+                        break
+                    param_lens.append(array_size)
+                else:
+                    param_lens.append('')
+                data_types_orig.append(c_type)
+                param_names.append(name)
+                param_desc.append('')
+                data_types_new.append(data_type_new)
+                string_lens.append(str(string_len))
+            else:
+                if param_names:
+                    written += write_pickle(
+                        f'{ROOTDIR}/ParameterFiles/{cmd_name}', [
+                            data_types_orig, param_names, param_lens,
+                            param_desc, data_types_new, string_lens
+                        ])
+
+    save_cache({digests[hdr]: cache[digests[hdr]] for hdr in file_list})
+
+    print(f"Wrote {written} updated definition files")
+
+    rebuild_database()
+    for cmd_name, reason in unresolved:
+        print(f"WARNING: {cmd_name} skipped ({reason}); "
+              "use interactive mode to add it")
+    return not unresolved
+
+
+#
+# Display usage
+#
+def usage():
+    print("usage: CHeaderParser.py [--batch [--jobs=<N>]] "
+          "[--file=<header paths file>]\n\n"
+          "Without --batch the parser runs interactively.")
+
+
 if __name__ == '__main__':
 
+    batch_mode = False
+    batch_jobs = None
+    paths_file = 'CHeaderParser-hdr-paths.txt'
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hbj:f:",
+                                   ["help", "batch", "jobs=", "file="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-b", "--batch"):
+            batch_mode = True
+        elif opt in ("-j", "--jobs"):
+            batch_jobs = int(arg)
+        elif opt in ("-f", "--file"):
+            paths_file = arg
+
     # Get list of files to parse
-    file_list = get_file_list()
+    file_list = get_file_list(paths_file)
 
     # If list is empty, exit now
     if not file_list:
         print("ERROR: Empty file list. Nothing to be done. Exiting now.")
         sys.exit()
 
+    if batch_mode:
+        sys.exit(0 if run_batch(file_list, batch_jobs) else 1)
+
+    # Index of all #defines, used to resolve array size macros
+    macros = build_macro_index(file_list)
+
     # initialize command codes/descriptions lists as empty lists
     cmd_codes = []
     cmd_desc = []
@@ -186,6 +488,9 @@ if __name__ == '__main__':
     # therefore picklefile = CommandFiles/app_msg
     pickle_file = f'{ROOTDIR}/CommandFiles/{cmd_file_name}'
 
+    # However the session ends, once the pickle files are written
+    atexit.register(rebuild_database)
+
     # Open pickle file for storing command codes/descriptions
     with open(pickle_file, 'wb') as pickle_obj:
         #
@@ -441,6 +746,12 @@ if __name__ == '__main__':
                         # Add array size to the parameter list
                         param_lens.append(array_size)
 
+                        # Resolve macros such as OS_MAX_API_NAME
+                        if not array_size.isdigit():
+                            resolved = macros.resolve(array_size)
+                            if resolved is not None:
+                                array_size = str(resolved)
+
                         print("Array size:", array_size)
 
                         # This while loop will make sure that
@@ -0,0 +1,489 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+##############################################################################
+# Description:
+#	CommandDatabase.py compiles every command definition (CommandFiles/),
+# parameter definition (ParameterFiles/) and command page (command-pages.txt)
+# into a single read-only binary file. The file is memory-mapped, so every
+# ground system process shares the same pages, and nothing is unpickled at
+# run time.
+#
+#	The mtime and size of every source file are recorded in the database.
+# When they no longer match, the database is rebuilt the next time it is
+# opened (see CommandDefinitions.get_database()); CHeaderParser.py and
+# CommandParser.py rebuild it when they write definition files.
+#
+# Usage:
+#	~$ python3 CommandDatabase.py [output file]
+#	Builds the database. The default output is command-db.bin next to this
+#	file.
+#
+# File layout (all integers little-endian):
+#	header   - magic, format version and the (offset, count) of each table
+#	strings  - u32 offsets[count + 1] followed by the UTF-8 string data
+#	files    - command definition files  (name, first command, count)
+#	commands - (description, code string, code, parameter file, layout)
+#	layouts  - parameter definition files (name, first parameter, count)
+#	params   - (C type, name, length, description, cmdUtil type, str len)
+#	pages    - command-pages.txt rows (desc, file, pkt id, endian, addr, port)
+#	keys     - (pkt id, cmd code, command) for every page/command pair
+#	index    - open addressing hash table over names, subsystems and keys
+#	sources  - (path, mtime in ns, size) of every source file
+#
+##############################################################################
+
+import csv
+import mmap
+import os
+import pickle
+import struct
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+# ../cFS/tools/cFS-GroundSystem/Subsystems/cmdGui/
+ROOTDIR = Path(__file__).resolve().parent
+DEFAULT_DB_FILE = f'{ROOTDIR}/command-db.bin'
+
+MAGIC = b'CFSCMDDB'
+FORMAT_VERSION = 2
+
+# Tables in the order they appear in the header
+TABLES = ('strings', 'files', 'commands', 'layouts', 'params', 'pages',
+          'keys', 'index', 'sources')
+
+HEADER = struct.Struct(f'<8sHH{2 * len(TABLES)}I')
+FILE_REC = struct.Struct('<III')
+CMD_REC = struct.Struct('<IIIIi')
+LAYOUT_REC = struct.Struct('<III')
+PARAM_REC = struct.Struct('<6I')
+PAGE_REC = struct.Struct('<IiHHII')
+KEY_REC = struct.Struct('<HHI')
+INDEX_SLOT = struct.Struct('<QII')
+SOURCE_REC = struct.Struct('<IqQ')
+
+# Kinds of entries in the hash index
+KIND_FILE, KIND_LAYOUT, KIND_PAGE, KIND_KEY = range(1, 5)
+
+NO_INDEX = -1
+
+Command = namedtuple('Command', 'desc, code, param_file, file')
+Page = namedtuple('Page', 'desc, file, pkt_id, endian, address, port')
+
+
+#
+# 64-bit FNV-1a hash, stable across processes (unlike hash())
+#
+def fnv1a(data):
+    h = 0xCBF29CE484222325
+    for b in data:
+        h = ((h ^ b) * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def _name_key(kind, name):
+    return bytes((kind, )) + name.encode()
+
+
+def _pkt_key(pkt_id, cmd_code):
+    return bytes((KIND_KEY, )) + struct.pack('<HH', pkt_id, cmd_code)
+
+
+def _to_int(value, base=10):
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return int(str(value).strip(), base)
+    except ValueError:
+        return None
+
+
+#
+# Returns {path relative to root: (mtime in ns, size)} of every source file
+#
+def source_stats(root=ROOTDIR):
+    paths = ['command-pages.txt'] + [
+        f'{folder}/{name}' for folder in ('ParameterFiles', 'CommandFiles')
+        for name in sorted(os.listdir(f'{root}/{folder}'))
+        if not name.startswith('__')]
+    stats = {}
+    for path in paths:
+        stat = os.stat(f'{root}/{path}')
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+#
+# Reads all definition sources and writes the database to out_file
+#
+class CommandDatabaseCompiler:
+
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.files, self.commands, self.layouts, self.params, self.pages, \
+        self.keys = ([] for _ in range(6))
+        self.file_ids = {}
+        self.layout_ids = {}
+        self.sources = {}
+
+    def sid(self, value):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'ignore')
+        value = str(value)
+        if value not in self.string_ids:
+            self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self.string_ids[value]
+
+    def add_layout(self, name, definition):
+        # Older parameter files may be missing trailing columns
+        columns = [list(col) for col in definition] + [[]] * (6 - len(definition))
+        count = len(columns[1])
+        self.layout_ids[name] = len(self.layouts)
+        self.layouts.append((self.sid(name), len(self.params), count))
+        for i in range(count):
+            self.params.append(tuple(
+                self.sid(col[i] if i < len(col) else '') for col in columns[:6]))
+
+    def add_command_file(self, name, definition):
+        cmd_desc, cmd_codes, param_files = definition
+        self.file_ids[name] = len(self.files)
+        self.files.append((self.sid(name), len(self.commands), len(cmd_desc)))
+        for desc, code, param_file in zip(cmd_desc, cmd_codes, param_files):
+            if isinstance(param_file, bytes):
+                param_file = param_file.decode()
+            layout = self.layout_ids.get(param_file.split('.')[0], NO_INDEX)
+            int_code = _to_int(code)
+            self.commands.append(
+                (self.sid(desc), self.sid(code),
+                 int_code if int_code is not None else 0xFFFFFFFF,
+                 self.sid(param_file), layout))
+
+    def add_page(self, row):
+        desc, def_file, pkt_id, endian, _, address, port = (
+            col.strip() for col in row[:7])
+        pkt_id = _to_int(pkt_id, 16) or 0
+        file_idx = self.file_ids.get(def_file, NO_INDEX)
+        self.pages.append((self.sid(desc), file_idx, pkt_id,
+                           self.sid(endian), self.sid(address),
+                           _to_int(port) or 0))
+        if file_idx == NO_INDEX:
+            return
+        _, first, count = self.files[file_idx]
+        for cmd_idx in range(first, first + count):
+            code = self.commands[cmd_idx][2]
+            if code <= 0xFFFF:
+                self.keys.append((pkt_id, code, cmd_idx))
+
+    def load_sources(self, root=ROOTDIR):
+        # Taken first, so a file changed while reading makes it stale
+        self.sources = source_stats(root)
+        for name in sorted(os.listdir(f'{root}/ParameterFiles')):
+            if name.startswith('__'):
+                continue
+            with open(f'{root}/ParameterFiles/{name}', 'rb') as pickle_obj:
+                self.add_layout(name, pickle.load(pickle_obj))
+        for name in sorted(os.listdir(f'{root}/CommandFiles')):
+            if name.startswith('__'):
+                continue
+            with open(f'{root}/CommandFiles/{name}', 'rb') as pickle_obj:
+                self.add_command_file(name, pickle.load(pickle_obj))
+        with open(f'{root}/command-pages.txt') as cmdfile:
+            for row in csv.reader(cmdfile, skipinitialspace=True):
+                if row and not row[0].startswith('#') and len(row) >= 7:
+                    self.add_page(row)
+
+    def build_index(self):
+        entries = []
+        for i, (name_sid, _, _) in enumerate(self.files):
+            entries.append((_name_key(KIND_FILE, self.strings[name_sid]),
+                            KIND_FILE, i))
+        for i, (name_sid, _, _) in enumerate(self.layouts):
+            entries.append((_name_key(KIND_LAYOUT, self.strings[name_sid]),
+                            KIND_LAYOUT, i))
+        for i, page in enumerate(self.pages):
+            entries.append((_name_key(KIND_PAGE, self.strings[page[0]]),
+                            KIND_PAGE, i))
+        for i, (pkt_id, code, _) in enumerate(self.keys):
+            entries.append((_pkt_key(pkt_id, code), KIND_KEY, i))
+
+        size = 1
+        while size < 2 * len(entries):
+            size <<= 1
+        slots = [None] * size
+        seen = set()
+        for key, kind, idx in entries:
+            # First definition wins, matching the order of command-pages.txt
+            if key in seen:
+                continue
+            seen.add(key)
+            h = fnv1a(key)
+            pos = h & (size - 1)
+            while slots[pos] is not None:
+                pos = (pos + 1) & (size - 1)
+            slots[pos] = (h, kind, idx)
+        return slots
+
+    def write(self, out_file=DEFAULT_DB_FILE):
+        sections = {}
+        body = bytearray()
+
+        def section(name, count, data):
+            # Keep every table 8-byte aligned
+            body.extend(bytes(-(HEADER.size + len(body)) % 8))
+            sections[name] = (HEADER.size + len(body), count)
+            body.extend(data)
+
+        # Before the strings are written out, as the paths are strings
+        sources = [SOURCE_REC.pack(self.sid(path), mtime, size)
+                   for path, (mtime, size) in self.sources.items()]
+        encoded = [s.encode() for s in self.strings]
+        offsets, pos = [], 0
+        for s in encoded:
+            offsets.append(pos)
+            pos += len(s)
+        offsets.append(pos)
+        section('strings', len(encoded),
+                struct.pack(f'<{len(offsets)}I', *offsets) + b''.join(encoded))
+        section('files', len(self.files),
+                b''.join(FILE_REC.pack(*r) for r in self.files))
+        section('commands', len(self.commands),
+                b''.join(CMD_REC.pack(*r) for r in self.commands))
+        section('layouts', len(self.layouts),
+                b''.join(LAYOUT_REC.pack(*r) for r in self.layouts))
+        section('params', len(self.params),
+                b''.join(PARAM_REC.pack(*r) for r in self.params))
+        section('pages', len(self.pages),
+                b''.join(PAGE_REC.pack(*r) for r in self.pages))
+        section('keys', len(self.keys),
+                b''.join(KEY_REC.pack(*r) for r in self.keys))
+        slots = self.build_index()
+        section('index', len(slots),
+                b''.join(INDEX_SLOT.pack(*(s or (0, 0, 0))) for s in slots))
+        section('sources', len(sources), b''.join(sources))
+
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, 0,
+                             *(v for name in TABLES for v in sections[name]))
+        # Write to a temporary file first so readers never see a partial file
+        tmp_file = f'{out_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as db_obj:
+            db_obj.write(header)
+            db_obj.write(body)
+        os.replace(tmp_file, out_file)
+
+
+#
+# Read-only, memory-mapped view of a compiled command database
+#
+class CommandDatabase:
+
+    def __init__(self, db_file=DEFAULT_DB_FILE):
+        with open(db_file, 'rb') as db_obj:
+            self.mm = mmap.mmap(db_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fields = HEADER.unpack_from(self.mm, 0)
+        except struct.error:
+            self.mm.close()
+            raise ValueError(f'{db_file} is not a command database')
+        magic, version = fields[:2]
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.mm.close()
+            raise ValueError(f'{db_file} has unsupported format '
+                             f'{magic!r} v{version}; please rebuild it')
+        self.tables = dict(zip(TABLES, zip(fields[3::2], fields[4::2])))
+        str_off, str_count = self.tables['strings']
+        self.str_data = str_off + 4 * (str_count + 1)
+        self.index_off, self.index_size = self.tables['index']
+
+    def close(self):
+        self.mm.close()
+
+    #
+    # True if no source file was added, removed or changed since the
+    # database was built
+    #
+    def is_current(self, root=ROOTDIR):
+        try:
+            stats = source_stats(root)
+        except OSError:
+            return False
+        off, count = self.tables['sources']
+        if count != len(stats):
+            return False
+        for i in range(count):
+            path, mtime, size = SOURCE_REC.unpack_from(
+                self.mm, off + SOURCE_REC.size * i)
+            if stats.get(self.string(path)) != (mtime, size):
+                return False
+        return True
+
+    def string(self, sid):
+        off = self.tables['strings'][0] + 4 * sid
+        start, end = struct.unpack_from('<II', self.mm, off)
+        return self.mm[self.str_data + start:self.str_data + end].decode()
+
+    def record(self, table, rec, idx):
+        return rec.unpack_from(self.mm, self.tables[table][0] + rec.size * idx)
+
+    def lookup(self, key, kind):
+        if not self.index_size:
+            return NO_INDEX
+        h = fnv1a(key)
+        mask = self.index_size - 1
+        pos = h & mask
+        while True:
+            slot_h, slot_kind, idx = INDEX_SLOT.unpack_from(
+                self.mm, self.index_off + INDEX_SLOT.size * pos)
+            if not slot_kind:
+                return NO_INDEX
+            if slot_h == h and slot_kind == kind and self.key_of(
+                    kind, idx) == key:
+                return idx
+            pos = (pos + 1) & mask
+
+    #
+    # Rebuilds the index key of a record so hash hits can be verified
+    #
+    def key_of(self, kind, idx):
+        if kind == KIND_KEY:
+            return _pkt_key(*self.record('keys', KEY_REC, idx)[:2])
+        table, rec = {
+            KIND_FILE: ('files', FILE_REC),
+            KIND_LAYOUT: ('layouts', LAYOUT_REC),
+            KIND_PAGE: ('pages', PAGE_REC)
+        }[kind]
+        return _name_key(kind, self.string(self.record(table, rec, idx)[0]))
+
+    def _command(self, idx):
+        desc, code, _, param_file, _ = self.record('commands', CMD_REC, idx)
+        return desc, code, param_file
+
+    #
+    # Returns [cmd_desc, cmd_codes, param_files], as stored in CommandFiles/
+    #
+    def command_file(self, name):
+        idx = self.lookup(_name_key(KIND_FILE, name), KIND_FILE)
+        if idx == NO_INDEX:
+            return None
+        _, first, count = self.record('files', FILE_REC, idx)
+        columns = ([], [], [])
+        for cmd_idx in range(first, first + count):
+            for col, sid in zip(columns, self._command(cmd_idx)):
+                col.append(self.string(sid))
+        return list(columns)
+
+    #
+    # Returns the six parameter lists, as stored in ParameterFiles/
+    #
+    def parameter_file(self, name):
+        idx = self.lookup(_name_key(KIND_LAYOUT, name.split('.')[0]),
+                          KIND_LAYOUT)
+        if idx == NO_INDEX:
+            return None
+        _, first, count = self.record('layouts', LAYOUT_REC, idx)
+        columns = [[] for _ in range(PARAM_REC.size // 4)]
+        for param_idx in range(first, first + count):
+            for col, sid in zip(columns, self.record('params', PARAM_REC,
+                                                     param_idx)):
+                col.append(self.string(sid))
+        return columns
+
+    #
+    # Returns the Command sent with the given packet ID and command code
+    #
+    def command(self, pkt_id, cmd_code):
+        idx = self.lookup(_pkt_key(int(pkt_id), int(cmd_code)), KIND_KEY)
+        if idx == NO_INDEX:
+            return None
+        _, _, cmd_idx = self.record('keys', KEY_REC, idx)
+        desc, code, param_file = (self.string(sid)
+                                  for sid in self._command(cmd_idx))
+        return Command(desc, code, param_file, self.file_of(cmd_idx))
+
+    def file_of(self, cmd_idx):
+        lo, hi = 0, self.tables['files'][1]
+        # Command records are stored grouped by file, in file order
+        while lo < hi:
+            mid = (lo + hi) // 2
+            _, first, count = self.record('files', FILE_REC, mid)
+            if cmd_idx < first:
+                hi = mid
+            elif cmd_idx >= first + count:
+                lo = mid + 1
+            else:
+                return self.string(self.record('files', FILE_REC, mid)[0])
+        return None
+
+    #
+    # Returns the command page (subsystem) with the given description
+    #
+    def subsystem(self, desc):
+        idx = self.lookup(_name_key(KIND_PAGE, desc), KIND_PAGE)
+        if idx == NO_INDEX:
+            return None
+        desc_sid, file_idx, pkt_id, endian, address, port = self.record(
+            'pages', PAGE_REC, idx)
+        file_name = None
+        if file_idx != NO_INDEX:
+            file_name = self.string(self.record('files', FILE_REC,
+                                                file_idx)[0])
+        return Page(self.string(desc_sid), file_name, pkt_id,
+                    self.string(endian), self.string(address), port)
+
+
+#
+# Compiles the definition files under root into db_file
+#
+def build_database(db_file=DEFAULT_DB_FILE, root=ROOTDIR):
+    compiler = CommandDatabaseCompiler()
+    compiler.load_sources(root)
+    compiler.write(db_file)
+    return compiler
+
+
+#
+# Rebuilds db_file if it exists and isn't current; returns True if it was
+# rebuilt
+#
+def update_database(db_file=DEFAULT_DB_FILE, root=ROOTDIR):
+    try:
+        database = CommandDatabase(db_file)
+    except IOError:
+        return False
+    except ValueError:
+        pass  # Older format
+    else:
+        current = database.is_current(root)
+        database.close()
+        if current:
+            return False
+    build_database(db_file, root)
+    return True
+
+
+#
+# Main
+#
+if __name__ == '__main__':
+    db_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DB_FILE
+    compiler = build_database(db_file)
+    print(f'Wrote {len(compiler.files)} command files, '
+          f'{len(compiler.layouts)} parameter files and '
+          f'{len(compiler.pages)} pages to {db_file}')
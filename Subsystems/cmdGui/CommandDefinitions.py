@@ -0,0 +1,109 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+## Process-wide cache of the command and parameter definition files found
+## in CommandFiles/ and ParameterFiles/. Each file is read from disk at most
+## once per process; every page and dialog after that shares the same copy.
+## Definitions come from the compiled command database (see
+## CommandDatabase.py) when it exists, otherwise from the pickle files. A
+## database older than the pickle files is rebuilt first.
+
+import pickle
+import re
+from functools import lru_cache
+from pathlib import Path
+
+from CommandDatabase import CommandDatabase, build_database
+
+# ../cFS/tools/cFS-GroundSystem/Subsystems/cmdGui/
+ROOTDIR = Path(__file__).resolve().parent
+
+
+#
+# Returns the shared command database, or None if it hasn't been built
+#
+@lru_cache(maxsize=None)
+def get_database():
+    try:
+        database = CommandDatabase()
+        if database.is_current():
+            return database
+        database.close()
+    except IOError:
+        return None
+    except ValueError:
+        pass  # Older format
+    # Definition files changed since it was built
+    try:
+        build_database()
+        return CommandDatabase()
+    except (IOError, ValueError, EOFError, pickle.UnpicklingError) as e:
+        print("Couldn't rebuild the command database:", e)
+        return None
+
+
+#
+# Returns [cmd_desc, cmd_codes, param_files] for a command definition file
+#
+@lru_cache(maxsize=None)
+def load_command_file(file_name):
+    database = get_database()
+    if database:
+        definition = database.command_file(file_name)
+        if definition:
+            return definition
+    with open(f'{ROOTDIR}/CommandFiles/{file_name}', 'rb') as pickle_obj:
+        return pickle.load(pickle_obj)
+
+
+#
+# Returns [data_types_orig, param_names, param_lens, param_desc,
+# data_types_new, string_lens] for a parameter definition file, or None
+# if the command has no parameter file
+#
+@lru_cache(maxsize=None)
+def load_parameter_file(file_name):
+    database = get_database()
+    if database:
+        definition = database.parameter_file(file_name)
+        if definition:
+            return definition
+    # Doxygen generated names may still carry the .html extension
+    pickle_file = f'{ROOTDIR}/ParameterFiles/{re.split(r"[.]", file_name)[0]}'
+    try:
+        with open(pickle_file, 'rb') as pickle_obj:
+            return pickle.load(pickle_obj)
+    except IOError:
+        return None
+
+
+#
+# Determines if command requires parameters
+#
+def has_parameters(file_name):
+    params = load_parameter_file(file_name)
+    return params is not None and len(params[1]) > 0
+
+
+#
+# Loads every parameter file referenced by a command page up front so the
+# first button press doesn't pay for the disk read
+#
+def preload_parameter_files(file_names):
+    for file_name in file_names:
+        load_parameter_file(file_name)
@@ -16,85 +16,192 @@
 #  limitations under the License.
 #
 
+
+#
+# Extracts command names, command codes and command structure links from
+# the Doxygen cfe__*msg_8h.html pages in a single streaming pass per file.
+# Files are processed in parallel, and a file is skipped when its content
+# hash matches the last run and its output still exists.
+#
+
 import glob
+import hashlib
+import json
+import os
 import pickle
 import re
+from concurrent.futures import ProcessPoolExecutor
 from html.parser import HTMLParser
+from pathlib import Path
+
+from CommandDatabase import DEFAULT_DB_FILE, update_database
+
+# ../cFS/tools/cFS-GroundSystem/Subsystems/cmdGui/
+ROOTDIR = Path(__file__).resolve().parent
+CACHE_FILE = f'{ROOTDIR}/.CommandParser-cache.json'
+CHUNK_SIZE = 1 << 16
 
-from bs4 import BeautifulSoup
+# Elements that never have an end tag
+VOID_TAGS = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+             'link', 'meta', 'source', 'track', 'wbr')
 
 
 class CommandParser(HTMLParser):
 
     #
-    # Initializes allData variable
+    # Initializes the extracted fields and the parser state
     #
     def reset(self):
-        self.all_data = []
-        self.all_href = []
+        self.cmd_names = []  # names of commands
+        self.cmd_codes = []  # command codes
+        self.html_files = []  # HTML files with parameter information
+
+        self.open_tds = []  # text of each <td> still open
+        self.last_td = None  # text of the most recently opened <td>
+        self.want_href = False  # next link follows "Command Structure"
+        self.want_name = False  # next node follows "Name:"
+        self.name_tag = None  # [tag, depth, text] while reading a name
+        self.text = []  # pieces of the text node in progress
         HTMLParser.reset(self)
 
     #
-    # Appends HTML file content to allData variable
+    # Handles pieces of text nodes (a node is split where a chunk ends)
     #
     def handle_data(self, data):
-        if data.strip():  # excludes new lines
-            self.all_data.append(data.strip())
-            # print self.allData[-1]
+        for td_text in self.open_tds:
+            td_text.append(data)
+
+        if self.name_tag:
+            self.name_tag[2].append(data)
+        else:
+            self.text.append(data)
+
+    #
+    # Handles the text node in progress, complete at the next tag
+    #
+    def end_text(self):
+        text = ''.join(self.text).strip()
+        self.text = []
+        if not text:  # excludes new lines
+            return
+        if self.want_name:
+            self.cmd_names.append(text)
+            self.want_name = False
+        elif text == 'Command Structure':
+            self.want_href = True
+        elif text == 'Name:':
+            # The command code is the last word of the enclosing/previous
+            # cell; it is read once that cell is complete (see close())
+            self.cmd_codes.append(self.last_td or [])
+            self.want_name = True
 
     #
-    # Appends href tag contents to hrefTags variable
+    # Handles start tags: table cells, links and the element after "Name:"
     #
     def handle_starttag(self, tag, attrs):
-        if tag == 'a':
+        self.end_text()
+        if tag == 'td':
+            self.last_td = []
+            self.open_tds.append(self.last_td)
+        elif tag == 'a' and self.want_href:
             for name, value in attrs:
-                if name == 'href':
+                if name == 'href' and value:
                     val = re.split('#', value)[0]
-                    self.all_href.append(val)
-                    # print self.allhref[-1]
+                    self.html_files.append(re.split(r'\.', val)[0])
+                    self.want_href = False
+
+        if self.name_tag and tag == self.name_tag[0]:
+            self.name_tag[1] += 1
+        elif self.want_name and tag not in VOID_TAGS:
+            self.name_tag = [tag, 1, []]
+            self.want_name = False
+
+    def handle_endtag(self, tag):
+        self.end_text()
+        if tag == 'td' and self.open_tds:
+            self.open_tds.pop()
+        if self.name_tag and tag == self.name_tag[0]:
+            self.name_tag[1] -= 1
+            if not self.name_tag[1]:
+                self.cmd_names.append(''.join(self.name_tag[2]).strip())
+                self.name_tag = None
+
+    #
+    # Finishes the pass and resolves the command codes
+    #
+    def close(self):
+        HTMLParser.close(self)
+        self.end_text()
+        codes = []
+        for td_text in self.cmd_codes:
+            words = ''.join(td_text).split()
+            codes.append(words[-1] if words else '')
+        self.cmd_codes = codes
+
+
+#
+# Streams one HTML file through the parser
+#
+def extract_commands(html_file):
+    parser = CommandParser()
+    with open(html_file) as html_obj:
+        for chunk in iter(lambda: html_obj.read(CHUNK_SIZE), ''):
+            parser.feed(chunk)
+    parser.close()
+    return parser.cmd_names, parser.cmd_codes, parser.html_files
+
+
+def file_digest(html_file):
+    with open(html_file, 'rb') as html_obj:
+        return hashlib.sha256(html_obj.read()).hexdigest()
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as cache_obj:
+            return json.load(cache_obj)
+    except (IOError, ValueError):
+        return {}
 
 
 if __name__ == '__main__':
 
     #
-    # Searches for and reads HTML files
+    # Searches for HTML files
     #
     file_list = glob.glob(
         '../../docs/cFE UsersGuide/Doxygen/cfe__*msg_8h.html')
 
-    for html_file in file_list:
-        with open(html_file) as html_obj:
-
-            # initializes variables
+    cache = load_cache()
+    digests = {html_file: file_digest(html_file) for html_file in file_list}
+    pickle_files = {
+        html_file: f'{ROOTDIR}/CommandFiles/{re.split(r"/|[.]", html_file)[-2]}'
+        for html_file in file_list
+    }
+    stale = [
+        html_file for html_file in file_list
+        if cache.get(html_file) != digests[html_file]
+        or not os.path.exists(pickle_files[html_file])
+    ]
+    print(f'{len(stale)} of {len(file_list)} files changed')
+
+    with ProcessPoolExecutor() as pool:
+        for html_file, (cmd_names, cmd_codes, html_files) in zip(
+                stale, pool.map(extract_commands, stale)):
+            # prints values after processing the whole file
             print('\nFILE:', html_file)
-            reader = html_obj.read()
-            soup = BeautifulSoup(reader)
-            cmd_names = []  # names of commands
-            cmd_codes = []  # command codes
-            html_files = []  # HTML files with parameter information
-
-            # gets HTML file names
-            for link in soup.findAll(text="Command Structure"):
-                html_file = link.find_next('a')[
-                    'href']  # next element with 'a' tag
-                html_file = re.split(r'\.', html_file)[0]
-                html_files.append(html_file.encode('ascii'))
-
-            # gets command names and command codes
-            for names in soup.findAll(text="Name:"):  # finds all 'Name:' text
-                pre_cmdCode = names.find_previous('td').get_text()
-                cmd_code = pre_cmdCode.split()[-1]
-                cmd_codes.append(cmd_code.encode('ascii'))
-                cmd_name = names.next_element.get_text(
-                )  # finds next text element
-                cmd_names.append(cmd_name.encode('ascii'))
-
-            # prints values after iterating through whole file
             print('CMD NAMES:', cmd_names)
             print('CMD CODES:', cmd_codes)
             print('HTML FILES:', html_files)
 
             # writes data to pickle file
-            pickle_file = 'CommandFiles/' + re.split(r'/|\.', html_file)[-2]
-            with open(pickle_file, 'wb') as pickle_obj:
+            with open(pickle_files[html_file], 'wb') as pickle_obj:
                 pickle.dump([cmd_names, cmd_codes, html_files], pickle_obj)
+            cache[html_file] = digests[html_file]
+
+    with open(CACHE_FILE, 'w') as cache_obj:
+        json.dump(cache, cache_obj)
+
+    # Keep the compiled command database in step with the pickles
+    if update_database():
+        print(f'Rebuilt {DEFAULT_DB_FILE}')
@@ -19,7 +19,6 @@
 #
 
 import csv
-import pickle
 import shlex
 import subprocess
 import sys
@@ -28,7 +27,14 @@ from pathlib import Path
 from PyQt5.QtWidgets import (QApplication, QDialog, QHeaderView, QPushButton,
                              QTableWidgetItem)
 
+sys.path.insert(0, f'{Path(__file__).resolve().parent.parent}/tlmGUI')
+
+# pylint: disable=wrong-import-position
+from CommandDefinitions import has_parameters, preload_parameter_files
 from MiniCmdUtil import MiniCmdUtil
+from Parameter import Parameter
+from Metrics import start_metrics
+from Profiling import start_profiling
 from UiCommandsystemdialog import UiCommandsystemdialog
 
 # ../cFS/tools/cFS-GroundSystem/Subsystems/cmdGui/
@@ -45,6 +51,7 @@ class CommandSystem(QDialog, UiCommandsystemdialog):
         self.setupUi(self)
         self.move(800, 100)
         self.mcu = None
+        self.param_dialogs = []
 
     #
     # Processes 'Display Page' button
@@ -66,13 +73,7 @@ class CommandSystem(QDialog, UiCommandsystemdialog):
     #
     @staticmethod
     def check_params(idx):
-        pickle_file = f'{ROOTDIR}/ParameterFiles/{quick_param[idx]}'
-        try:
-            with open(pickle_file, 'rb') as pickle_obj:
-                param_names = pickle.load(pickle_obj)[1]
-            return len(param_names) > 0
-        except IOError:
-            return False
+        return has_parameters(quick_param[idx])
 
     #
     # Processes quick button
@@ -85,18 +86,19 @@ class CommandSystem(QDialog, UiCommandsystemdialog):
 
             # if requires parameters
             if self.check_params(q_idx):
-                launch_string = (
-                    f'python3 {ROOTDIR}/Parameter.py '
-                    f'--title=\"{subsys[q_idx]}\" '
-                    f'--descrip=\"{quick_cmd[q_idx]}\" '
-                    f'--idx={idx} --host=\"{address}\" '
-                    f'--port={quick_port[q_idx]} '
-                    f'--pktid={pkt_id} --endian={quick_endian[q_idx]} '
-                    f'--cmdcode={quick_code[q_idx]} --file={quick_param[q_idx]}')
-                cmd_args = shlex.split(launch_string)
-                subprocess.Popen(cmd_args)
+                param_dialog = Parameter(subsys[q_idx], quick_cmd[q_idx],
+                                         address, quick_port[q_idx], pkt_id,
+                                         quick_endian[q_idx], quick_code[q_idx],
+                                         quick_param[q_idx])
+                param_dialog.finished.connect(
+                    lambda _, d=param_dialog: self.param_dialogs.remove(d))
+                self.param_dialogs.append(param_dialog)
+                param_dialog.show()
+                param_dialog.raise_()
             # if doesn't require parameters
             else:
+                if self.mcu:
+                    self.mcu.mm.close()
                 self.mcu = MiniCmdUtil(address, quick_port[q_idx],
                                        quick_endian[q_idx], pkt_id,
                                        quick_code[q_idx])
@@ -111,6 +113,8 @@ class CommandSystem(QDialog, UiCommandsystemdialog):
     def closeEvent(self, event):
         if self.mcu:
             self.mcu.mm.close()
+        for param_dialog in list(self.param_dialogs):
+            param_dialog.close()
         super().closeEvent(event)
 
 
@@ -118,6 +122,8 @@ class CommandSystem(QDialog, UiCommandsystemdialog):
 # Main
 #
 if __name__ == '__main__':
+    start_profiling('CommandSystem')
+    start_metrics('CommandSystem')
 
     #
     # Set defaults for the arguments
@@ -188,6 +194,7 @@ if __name__ == '__main__':
                 quick_address.append(fileRow[6].strip())
                 quick_port.append(fileRow[7].strip())
                 quick_param.append(fileRow[8].strip())
+    preload_parameter_files(quick_param)
 
     #
     # fill the data fields on the page
@@ -19,7 +19,28 @@
 import glob
 import pickle
 import re
+from functools import lru_cache
 from html.parser import HTMLParser
+from pathlib import Path
+
+from MacroIndex import MacroIndex
+
+# ../cFS/tools/cFS-GroundSystem/Subsystems/cmdGui/
+ROOTDIR = Path(__file__).resolve().parent
+
+# Headers searched for string length macros
+HDR_GLOBS = ('../../../build/cpu1/inc/*.h',
+             '../../fsw/cfe-core/src/inc/cfe_*.h',
+             '../../fsw/mission_inc/cfe_mission_cfg.h')
+
+
+#
+# Builds the #define index of HDR_GLOBS once per process
+#
+@lru_cache(maxsize=None)
+def get_macro_index():
+    hdr_files = [f for pattern in HDR_GLOBS for f in sorted(glob.glob(pattern))]
+    return MacroIndex(hdr_files, f'{ROOTDIR}/.MacroIndex-cache.json')
 
 
 class HTMLDocsParser(HTMLParser):
@@ -59,24 +80,8 @@ class HTMLDocsParser(HTMLParser):
     #
     @staticmethod
     def find_string_len(kywd):
-        hdr_files = glob.glob('../../../build/cpu1/inc/*.h')
-        hdr_files += glob.glob('../../fsw/cfe-core/src/inc/cfe_*.h')
-        hdr_files += glob.glob('../../fsw/mission_inc/cfe_mission_cfg.h')
-        val = ''
-        found = False
-        k = 0
-
-        while not found and k < len(hdr_files):
-            with open(hdr_files[k]) as hdr_obj:
-                file_lines = hdr_obj.readlines()
-                l = 0
-                while not found and l < len(file_lines):
-                    if f'#define {kywd}' in file_lines[l]:
-                        found = True
-                        val = file_lines[l].split()[2]
-                    l += 1
-            k += 1
-        return val
+        val = get_macro_index().resolve(kywd)
+        return '' if val is None else str(val)
 
 
 if __name__ == '__main__':
@@ -149,10 +154,9 @@ if __name__ == '__main__':
                         if data_type_new == '--string':
                             keyword = re.sub(r'\[|\]|\(|\)', '',
                                              param_len[-1])  # removes brackets
-                            while not keyword.isdigit():
+                            if not keyword.isdigit():
                                 keyword = parser.find_string_len(keyword)
-                                keyword = re.sub(r'\[|\]|\(|\)', '', keyword)
-                        if keyword == '0':
+                        if keyword in ('', '0'):
                             keyword = input(
                                 f'{param_len[-1]} not found. Please enter value manually: '
                             )
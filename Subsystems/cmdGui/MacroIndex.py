@@ -0,0 +1,189 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+## Index of every object-like #define in a set of C headers. The headers are
+## read once; resolving a macro (including macro-to-macro chains such as
+## CFE_MISSION_MAX_API_LEN -> OS_MAX_API_NAME -> 20 and simple integer
+## expressions) is then a dictionary lookup. The raw definitions of each
+## header are cached on disk and reused while the header's mtime and size
+## are unchanged.
+
+import ast
+import json
+import operator
+import os
+import re
+
+COMMENT_RE = re.compile(r'/\*.*?\*/|//[^\n]*', re.S)
+DEFINE_RE = re.compile(r'^[ \t]*#[ \t]*define[ \t]+(\w+)[ \t]+([^\n]+?)[ \t]*$',
+                       re.M)
+CAST_RE = re.compile(r'\(\s*(?:unsigned|signed|int|long|short|char|u?int\d+'
+                     r'|u?int\d+_t|size_t)\s*\)')
+INT_RE = re.compile(r'\b(0[xX][0-9a-fA-F]+|\d+)[uUlL]*\b')
+IDENT_RE = re.compile(r'\b[A-Za-z_]\w*\b')
+
+CACHE_VERSION = 1
+MAX_DEPTH = 32
+
+BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitAnd: operator.and_,
+    ast.BitXor: operator.xor
+}
+UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Invert: operator.invert
+}
+
+
+#
+# Returns the #defines of one header as {name: value text}
+#
+def read_defines(hdr_file):
+    with open(hdr_file, errors='ignore') as hdr_obj:
+        text = COMMENT_RE.sub(' ', hdr_obj.read())
+    return dict(DEFINE_RE.findall(text))
+
+
+#
+# Value of a C integer literal without suffix: hex, octal (a leading 0) or
+# decimal
+#
+def c_int(literal):
+    if literal[:2] in ('0x', '0X'):
+        return int(literal, 16)
+    if len(literal) > 1 and literal[0] == '0':
+        return int(literal, 8)
+    return int(literal)
+
+
+#
+# Evaluates a parsed integer expression; only arithmetic and bitwise
+# operators on integer constants are allowed
+#
+def _eval_node(node):
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, int):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in BIN_OPS:
+        return BIN_OPS[type(node.op)](_eval_node(node.left),
+                                      _eval_node(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+        return UNARY_OPS[type(node.op)](_eval_node(node.operand))
+    raise ValueError(f'Unsupported expression {ast.dump(node)}')
+
+
+class MacroIndex:
+
+    def __init__(self, hdr_files=(), cache_file=None):
+        self.defines = {}
+        self.values = {}
+        if hdr_files:
+            self.load(hdr_files, cache_file)
+
+    #
+    # Adds definitions; the first definition of a name wins, as it would
+    # when searching the headers in order
+    #
+    def add_defines(self, defines):
+        for name, value in defines.items():
+            self.defines.setdefault(name, value)
+        self.values.clear()
+
+    #
+    # Reads the #defines of each header, reusing cached entries for
+    # headers that haven't changed since the cache was written
+    #
+    def load(self, hdr_files, cache_file=None):
+        cached = {}
+        if cache_file:
+            try:
+                with open(cache_file) as cache_obj:
+                    cache = json.load(cache_obj)
+                if cache.get('version') == CACHE_VERSION:
+                    cached = cache['files']
+            except (IOError, ValueError):
+                pass
+
+        entries = {}
+        for hdr_file in hdr_files:
+            try:
+                stat = os.stat(hdr_file)
+            except OSError:
+                print("Couldn't read", hdr_file)
+                continue
+            key = [stat.st_mtime_ns, stat.st_size]
+            entry = cached.get(hdr_file)
+            if not entry or entry[0] != key:
+                entry = [key, read_defines(hdr_file)]
+            entries[hdr_file] = entry
+            self.add_defines(entry[1])
+
+        # Keep entries for other header sets sharing the same cache file
+        if cache_file and any(cached.get(hdr_file) != entry
+                              for hdr_file, entry in entries.items()):
+            cached.update(entries)
+            try:
+                with open(cache_file, 'w') as cache_obj:
+                    json.dump({'version': CACHE_VERSION, 'files': cached},
+                              cache_obj)
+            except IOError:
+                pass  # Cache is only an optimization
+
+    #
+    # Resolves a macro name or expression to an integer, or None
+    #
+    def resolve(self, text):
+        text = text.strip()
+        if text not in self.values:
+            try:
+                self.values[text] = self._evaluate(text, 0)
+            except (ValueError, SyntaxError, ZeroDivisionError, TypeError,
+                    RecursionError):
+                self.values[text] = None
+        return self.values[text]
+
+    def _evaluate(self, text, depth):
+        if depth > MAX_DEPTH:
+            raise ValueError(f'Macro {text} nests too deeply')
+        expr = CAST_RE.sub('', text)
+        expr = INT_RE.sub(lambda m: str(c_int(m.group(1))), expr)
+
+        def substitute(match):
+            name = match.group(0)
+            if name not in self.defines:
+                raise ValueError(f'Unknown macro {name}')
+            value_text = self.defines[name].strip()
+            value = self.values.get(value_text)
+            if value is None:
+                value = self._evaluate(value_text, depth + 1)
+                self.values[value_text] = value
+            return f'({value})'
+
+        # C integer division truncates; // only differs for negatives
+        expr = IDENT_RE.sub(substitute, expr).replace('/', '//')
+        return _eval_node(ast.parse(expr, mode='eval'))
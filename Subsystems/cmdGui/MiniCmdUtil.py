@@ -21,10 +21,22 @@
 
 import mmap
 import socket
+import sys
 from collections import namedtuple
+from pathlib import Path
 
 import getpass
 
+sys.path.insert(0, f'{Path(__file__).resolve().parent.parent}/tlmGUI')
+
+# pylint: disable=wrong-import-position
+from Metrics import counter
+
+COMMANDS_SENT = counter('groundsystem_commands_sent', 'Commands sent')
+COMMAND_BYTES = counter('groundsystem_command_bytes', 'Command bytes sent')
+COMMAND_ERRORS = counter('groundsystem_command_errors',
+                         'Commands that could not be sent')
+
 class MiniCmdUtil:
     # Class objects
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -141,7 +153,13 @@ class MiniCmdUtil:
             if (i + 1) % 8 == 0:
                 print()
         print()
-        bytes_sent = self.sock.sendto(self.packet, (self.host, self.port))
+        try:
+            bytes_sent = self.sock.sendto(self.packet, (self.host, self.port))
+        except OSError:
+            COMMAND_ERRORS.inc()
+            raise
+        COMMANDS_SENT.inc()
+        COMMAND_BYTES.inc(bytes_sent)
         return bytes_sent > 0
 
     def _get_offsets(self):
@@ -17,53 +17,102 @@
 #
 
 import getopt
-import pickle
-import re
 import sys
-from pathlib import Path
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (QApplication, QDialog, QHeaderView,
                              QTableWidgetItem)
 
+from CommandDefinitions import load_parameter_file
 from HTMLDocsParser import HTMLDocsParser
 from MiniCmdUtil import MiniCmdUtil
+# From Subsystems/tlmGUI (see MiniCmdUtil.py)
+from Metrics import start_metrics
 from UiParameterDialog import UiDialog
 
-ROOTDIR = Path(sys.argv[0]).resolve().parent
-
 
 class Parameter(QDialog, UiDialog):
     #
     # Initializes Parameter class
     #
-    def __init__(self):
-        super().__init__()
+    # Can be opened in-process by a command page or run standalone (see main)
+    #
+    def __init__(self,
+                 subsys_title='',
+                 cmd_desc='',
+                 address='',
+                 port=0,
+                 pkt_id=0,
+                 endian='',
+                 cmd_code='',
+                 param_file='struct_c_f_e___e_s___start_app_cmd__t.html',
+                 parent=None):
+        super().__init__(parent)
         self.setupUi(self)
         self.parser = HTMLDocsParser()
         self.setWindowTitle("Parameter Dialog")
         self.send_button_1.clicked.connect(self.ProcessSendButton)
         self.mcu = None
 
+        self.address = address
+        self.port = port
+        self.pkt_id = pkt_id
+        self.endian = endian
+        self.cmd_code = cmd_code
+
+        #
+        # Gets parameter information from the definition cache
+        #
+        _, param_names, _, param_desc, self.data_types_new, \
+        self.string_len = load_parameter_file(param_file)
+
+        #
+        # Sets text in GUI
+        #
+        self.sub_system_text_browser.setText(subsys_title)  # subsystem name
+        self.command_address_text_browser.setText(
+            f'{cmd_desc} Command')  # command name
+
+        tbl = self.tbl_parameters
+        for i, name in enumerate(param_names):
+            tbl.insertRow(i)
+            ## Create and insert the table items
+            for n in range(tbl.columnCount()):
+                tblItem = QTableWidgetItem()
+                tbl.setItem(i, n, tblItem)
+            ## Make the first two items in each row uneditable
+            for n in range(tbl.columnCount() - 1):
+                tbl.item(i, n).setFlags(Qt.ItemIsEnabled)
+            try:
+                tbl.item(i, 0).setText(name)
+                tbl.item(i, 1).setText(param_desc[i])
+            except IndexError:
+                pass  # Ignore nonexistent array items
+        tbl.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        # tbl.verticalHeader().setSectionResizeMode(QHeaderView.Stretch)
+
     #
     # Button method
     #
     def ProcessSendButton(self):
         input_list = []
         for j in range(self.tbl_parameters.rowCount()):
-            item = tbl.item(j, 2)
+            item = self.tbl_parameters.item(j, 2)
             input_list.append(item.text().strip())
 
         param_list = []
         for k, inpt in enumerate(input_list):
-            dataType = dataTypesNew[k]
+            dataType = self.data_types_new[k]
             if dataType == '--string':
-                param_list.append(f'{dataType}=\"{stringLen[k]}:{inpt}\"')
+                param_list.append(f'{dataType}=\"{self.string_len[k]}:{inpt}\"')
             else:
                 param_list.append(f'{dataType}={inpt}')  # --byte=4
         param_string = ' '.join(param_list)
-        self.mcu = MiniCmdUtil(pageAddress, pagePort, pageEndian, pagePktId,
-                               cmdCode, param_string.strip())
+        if self.mcu:
+            self.mcu.mm.close()
+        self.mcu = MiniCmdUtil(self.address, self.port, self.endian,
+                               self.pkt_id, self.cmd_code,
+                               param_string.strip())
         sendSuccess = self.mcu.send_packet()
         if sendSuccess:
             self.status_box.setText('Command sent!')
@@ -73,6 +122,7 @@ class Parameter(QDialog, UiDialog):
     def closeEvent(self, event):
         if self.mcu:
             self.mcu.mm.close()
+            self.mcu = None
         super().closeEvent(event)
 
 
@@ -80,6 +130,8 @@ class Parameter(QDialog, UiDialog):
 # Main method
 #
 if __name__ == '__main__':
+    start_metrics('Parameter')
+
     #
     # Initializes variables
     #
@@ -120,40 +172,8 @@ if __name__ == '__main__':
     # Initializes QT application and Parameter class
     #
     app = QApplication(sys.argv)  # creates instance of QtApplication class
-    param = Parameter()  # creates instance of Parameter class
-    tbl = param.tbl_parameters
-
-    #
-    # Gets parameter information from pickle files
-    #
-    pickle_file = f'{ROOTDIR}/ParameterFiles/' + re.split(r'\.', param_file)[0]
-    with open(pickle_file, 'rb') as pickle_obj:
-        _, paramNames, _, paramDesc, dataTypesNew, stringLen = pickle.load(
-            pickle_obj)
-
-    #
-    # Sets text in GUI
-    #
-    param.sub_system_text_browser.setText(subsysTitle)  # subsystem name
-    param.command_address_text_browser.setText(
-        f'{cmdDesc} Command')  # command name
-
-    for i, name in enumerate(paramNames):
-        tbl.insertRow(i)
-        ## Create and insert the table items
-        for n in range(tbl.columnCount()):
-            tblItem = QTableWidgetItem()
-            tbl.setItem(i, n, tblItem)
-        ## Make the first two items in each row uneditable
-        for n in range(tbl.columnCount() - 1):
-            tbl.item(i, n).setFlags(Qt.ItemIsEnabled)
-        try:
-            tbl.item(i, 0).setText(name)
-            tbl.item(i, 1).setText(paramDesc[i])
-        except IndexError:
-            pass  # Ignore nonexistent array items
-    tbl.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-    # tbl.verticalHeader().setSectionResizeMode(QHeaderView.Stretch)
+    param = Parameter(subsysTitle, cmdDesc, pageAddress, pagePort, pagePktId,
+                      pageEndian, cmdCode, param_file)
 
     #
     # Displays the dialog
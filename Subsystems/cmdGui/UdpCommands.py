@@ -32,21 +32,19 @@
 #                   wireless radio
 #
 import getopt
-import pickle
-import shlex
-import subprocess
 import sys
-from pathlib import Path
 
 from PyQt5.QtWidgets import (QApplication, QDialog, QHeaderView, QPushButton,
                              QTableWidgetItem)
 
+from CommandDefinitions import (has_parameters, load_command_file,
+                                preload_parameter_files)
 from MiniCmdUtil import MiniCmdUtil
+# From Subsystems/tlmGUI (see MiniCmdUtil.py)
+from Metrics import start_metrics
+from Parameter import Parameter
 from UiGenericcommanddialog import UiGenericcommanddialog
 
-# ../cFS/tools/cFS-GroundSystem/Subsystems/cmdGui/
-ROOTDIR = Path(sys.argv[0]).resolve().parent
-
 
 class SubsystemCommands(QDialog, UiGenericcommanddialog):
     #
@@ -57,19 +55,14 @@ class SubsystemCommands(QDialog, UiGenericcommanddialog):
         self.setupUi(self)
         self.setWindowTitle(page_title)
         self.mcu = None
+        self.param_dialogs = []
 
     #
     # Determines if command requires parameters
     #
     @staticmethod
     def check_params(idx):
-        pf = f'{ROOTDIR}/ParameterFiles/{param_files[idx]}'
-        try:
-            with open(pf, 'rb') as po:
-                param_names = pickle.load(po)[1]
-            return len(param_names) > 0  # if has parameters
-        except IOError:
-            return False
+        return has_parameters(param_files[idx])
 
     #
     # Generic button press method
@@ -79,18 +72,20 @@ class SubsystemCommands(QDialog, UiGenericcommanddialog):
             param_bool = self.check_params(idx)
             address = self.command_address_line_edit.text()
 
-            # If parameters are required, launches Parameters page
+            # If parameters are required, opens Parameters page
             if param_bool:
-                launch_string = (
-                    f'python3 {ROOTDIR}/Parameter.py --title=\"{page_title}\" '
-                    f'--descrip=\"{cmd_desc[idx]}\" --idx={idx} '
-                    f'--host=\"{address}\" --port={page_port} '
-                    f'--pktid={page_pkt_id} --endian={page_endian} '
-                    f'--cmdcode={cmd_codes[idx]} --file={param_files[idx]}')
-                cmd_args = shlex.split(launch_string)
-                subprocess.Popen(cmd_args)
+                param_dialog = Parameter(page_title, cmd_desc[idx], address,
+                                         page_port, page_pkt_id, page_endian,
+                                         cmd_codes[idx], param_files[idx])
+                param_dialog.finished.connect(
+                    lambda _, d=param_dialog: self.param_dialogs.remove(d))
+                self.param_dialogs.append(param_dialog)
+                param_dialog.show()
+                param_dialog.raise_()
             # If parameters not required, directly calls cmdUtil to send command
             else:
+                if self.mcu:
+                    self.mcu.mm.close()
                 self.mcu = MiniCmdUtil(address, page_port, page_endian,
                                        page_pkt_id, cmd_codes[idx])
                 send_success = self.mcu.send_packet()
@@ -103,6 +98,8 @@ class SubsystemCommands(QDialog, UiGenericcommanddialog):
     def closeEvent(self, event):
         if self.mcu:
             self.mcu.mm.close()
+        for param_dialog in list(self.param_dialogs):
+            param_dialog.close()
         super().closeEvent(event)
 
 
@@ -122,6 +119,8 @@ def usage():
 # Main
 #
 if __name__ == '__main__':
+    start_metrics('UdpCommands')
+
     #
     # Set defaults for the arguments
     #
@@ -173,9 +172,8 @@ if __name__ == '__main__':
     #
     # Reads commands from command definition file
     #
-    pickle_file = f'{ROOTDIR}/CommandFiles/{page_def_file}'
-    with open(pickle_file, 'rb') as pickle_obj:
-        cmd_desc, cmd_codes, param_files = pickle.load(pickle_obj)
+    cmd_desc, cmd_codes, param_files = load_command_file(page_def_file)
+    preload_parameter_files(param_files)
 
     cmd_item_is_valid = []
     for i in range(len(cmd_desc)):
@@ -59,6 +59,10 @@ import zmq
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QDialog
 
+from GenericTelemetry import page_subscription
+from LatencyHistogram import LatencyRecorder
+from Metrics import start_metrics
+from Profiling import start_profiling, timed
 from UiEventmessagedialog import UiEventmessagedialog
 
 import getpass
@@ -90,7 +94,8 @@ class EventMessageTelemetry(QDialog, UiEventmessagedialog):
         self.thread.start()
 
     # This method processes packets. Called when the TelemetryReceiver receives a message/packet
-    def process_pending_datagrams(self, datagram):
+    @timed('render')
+    def process_pending_datagrams(self, datagram, stamp):
         # Packet Header
         #   uint16  StreamId;   0
         #   uint16  Sequence;   2
@@ -120,6 +125,7 @@ class EventMessageTelemetry(QDialog, UiEventmessagedialog):
 
         event_string = f"EVENT --> {app_name}-{event_type_str} Event ID: {event_id} : {event_text}"
         self.event_output.appendPlainText(event_string)
+        self.thread.latency.displayed(stamp)
 
     # Reimplements closeEvent
     # to properly quit the thread
@@ -127,33 +133,38 @@ class EventMessageTelemetry(QDialog, UiEventmessagedialog):
     def closeEvent(self, event):
         self.thread.runs = False
         self.thread.wait(2000)
+        self.thread.latency.close()
         super().closeEvent(event)
 
 
 # Subscribes and receives zeroMQ messages
 class EMTlmReceiver(QThread):
     # Setup signal to communicate with front-end GUI
-    em_signal_tlm_datagram = pyqtSignal(bytes)
+    # (packet, receive time)
+    em_signal_tlm_datagram = pyqtSignal(bytes, object)
 
     def __init__(self, subscr, aid):
         super().__init__()
         self.app_id = aid
         self.runs = True
+        # Latency histograms (see LatencyHistogram.py)
+        self.latency = LatencyRecorder(f"{page_title} {subscr}")
 
         # Init zeroMQ
         self.context = zmq.Context()
         self.subscriber = self.context.socket(zmq.SUB)
         self.subscriber.connect(f"ipc:///tmp/GroundSystem-{getpass.getuser()}")
-        subscription_string = f"{subscr}.Spacecraft1.TelemetryPackets.{app_id}"
+        subscription_string, self.suffix = page_subscription(subscr)
         self.subscriber.setsockopt_string(zmq.SUBSCRIBE, subscription_string)
 
     def run(self):
         while self.runs:
             # Read envelope with address
-            address, datagram = self.subscriber.recv_multipart()
+            parts = self.subscriber.recv_multipart()
             # Ignore if not an event message
-            if self.app_id in address.decode():
-                self.em_signal_tlm_datagram.emit(datagram)
+            if parts[0].endswith(self.suffix):
+                self.em_signal_tlm_datagram.emit(
+                    parts[1], self.latency.received(parts))
 
 
 #
@@ -167,6 +178,9 @@ def usage():
 
 
 if __name__ == '__main__':
+    start_profiling('EventMessage')
+    start_metrics('EventMessage')
+
     #
     # Set defaults for the arguments
     #
@@ -203,8 +217,8 @@ if __name__ == '__main__':
         elif opt in ("-s", "--sub"):
             subscription = arg
 
-    if not subscription or len(subscription.split('.')) < 3:
-        subscription = "GroundSystem"
+    if len(subscription.split('.')) not in (2, 4):
+        subscription = f"GroundSystem.{app_id}"
 
     print('Event Messages Page started. Subscribed to', subscription)
 
@@ -17,18 +17,24 @@
 #  limitations under the License.
 #
 
-import csv
 import getopt
 import mmap
+import subprocess
 import sys
 from pathlib import Path
-from struct import unpack
+from struct import error, unpack
 
 import zmq
-from PyQt5.QtCore import QThread, pyqtSignal
-from PyQt5.QtWidgets import (QApplication, QDialog, QHeaderView,
+from PyQt5.QtCore import QRect, QThread, pyqtSignal
+from PyQt5.QtWidgets import (QApplication, QDialog, QHeaderView, QLabel,
                              QTableWidgetItem)
 
+from LatencyHistogram import LatencyRecorder
+from Metrics import start_metrics
+from Profiling import start_profiling, timed
+from SpacecraftTime import SpacecraftClock, format_utc, load_clock
+from TelemetryConversions import compile_packet
+from TelemetryDefinitions import load_items
 from UiGenerictelemetrydialog import UiGenerictelemetrydialog
 
 import getpass
@@ -46,47 +52,54 @@ class SubsystemTelemetry(QDialog, UiGenerictelemetrydialog):
         self.setupUi(self)
         with open(f"/tmp/OffsetData-{getpass.getuser()}", "r+b") as f:
             self.mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        self.tbl_telemetry.cellDoubleClicked.connect(self.open_strip_chart)
+
+        # Packet time from the secondary header (see SpacecraftTime.py)
+        self.clock = SpacecraftClock(**load_clock())
+        self.packet_time = QLabel(self)
+        self.packet_time.setGeometry(QRect(20, 724, 531, 24))
 
     #
-    # This method decodes a telemetry item from the packet and displays it
+    # This method displays a decoded telemetry item
     #
-    def display_telemetry_item(self, datagram, tlm_index, label_field, value_field):
-        if tlm_item_is_valid[tlm_index]:
-            tlm_offset = 0
-            try:
-                tlm_offset = self.mm[0]
-            except ValueError:
-                pass
-
-            tlm_field1 = tlm_item_format[tlm_index]
-            if tlm_field1[0] == "<":
-                tlm_field1 = tlm_field1[1:]
-        
-            item_start = 0
-            try:
-                item_start = int(tlm_item_start[tlm_index]) + tlm_offset
-            except UnboundLocalError:
-                pass
-            tlm_field2 = datagram[item_start:item_start +
-                                 int(tlm_item_size[tlm_index])]
-            if tlm_field2:
-                tlm_field = unpack(tlm_field1, tlm_field2)
-                if tlm_item_display_type[tlm_index] == 'Dec':
-                    value_field.setText(str(tlm_field[0]))
-                elif tlm_item_display_type[tlm_index] == 'Hex':
-                    value_field.setText(hex(tlm_field[0]))
-                elif tlm_item_display_type[tlm_index] == 'Enm':
-                    value_field.setText(tlm_item_enum[tlm_index][int(tlm_field[0])])
-                elif tlm_item_display_type[tlm_index] == 'Str':
-                    value_field.setText(tlm_field[0].decode('utf-8', 'ignore'))
-                label_field.setText(tlm_item_desc[tlm_index])
+    @staticmethod
+    def display_telemetry_item(tlm_field, tlm_index, label_field, value_field):
+        item = tlm_items[tlm_index]
+        if item.display == 'Dec':
+            value_field.setText(str(tlm_field))
+        elif item.display == 'Hex':
+            value_field.setText(hex(tlm_field))
+        elif item.display == 'Enm':
+            if 0 <= int(tlm_field) < len(item.args):
+                value_field.setText(item.args[int(tlm_field)])
             else:
-                print("ERROR: Can't unpack buffer of length", len(tlm_field2))
+                value_field.setText(str(tlm_field))
+        elif item.display == 'Str':
+            value_field.setText(tlm_field.decode('utf-8', 'ignore'))
+        else:
+            # Engineering units
+            value_field.setText(f'{tlm_field:.6g}')
+        label_field.setText(item.desc)
+
+    #
+    # Opens a strip chart of the double clicked item (see StripChart.py)
+    #
+    @staticmethod
+    def open_strip_chart(row, _):
+        item = tlm_items[row]
+        if item.display == 'Str':
+            return
+        subprocess.Popen([
+            'python3', f'{ROOTDIR}/StripChart.py', f'--title={page_title}',
+            f'--appid={app_id}', f'--file={tlm_def_file}',
+            f'--item={item.desc}', f'--endian={endian}',
+            f'--sub={subscription}'
+        ])
 
     # Start the telemetry receiver (see GTTlmReceiver class)
     def init_gt_tlm_receiver(self, subscr):
         self.setWindowTitle(f"{page_title} for: {subscr}")
-        self.thread = GTTlmReceiver(subscr)
+        self.thread = GTTlmReceiver(subscr, page_title)
         self.thread.gt_signal_tlm_datagram.connect(self.process_pending_datagrams)
         self.thread.finished.connect(self.thread.deleteLater)
         self.thread.start()
@@ -95,7 +108,8 @@ class SubsystemTelemetry(QDialog, UiGenerictelemetrydialog):
     # This method processes packets.
     # Called when the TelemetryReceiver receives a message/packet
     #
-    def process_pending_datagrams(self, datagram):
+    @timed('render')
+    def process_pending_datagrams(self, datagram, stamp):
         #
         # Show sequence number
         #
@@ -106,10 +120,41 @@ class SubsystemTelemetry(QDialog, UiGenerictelemetrydialog):
         #
         # Decode and display all packet elements
         #
-        for k in range(self.tbl_telemetry.rowCount()):
+        tlm_offset = 0
+        try:
+            tlm_offset = self.mm[0]
+        except ValueError:
+            pass
+        # Items past the end of a short packet are None and keep their
+        # last value
+        tlm_values = convert_packet(datagram, tlm_offset)
+        if None in tlm_values:
+            print("ERROR: Can't unpack buffer of length", len(datagram))
+
+        #
+        # Show packet time and how long after it the packet was received
+        #
+        try:
+            packet_utc = self.clock.utc(datagram, tlm_offset)
+        except error:
+            # Too short for the secondary header
+            packet_utc = None
+        if packet_utc is None:
+            pass
+        elif stamp:
+            self.packet_time.setText(
+                f"Packet time: {format_utc(packet_utc)} UTC "
+                f"(received {stamp / 1e9 - packet_utc:+.3f} s later)")
+        else:
+            self.packet_time.setText(
+                f"Packet time: {format_utc(packet_utc)} UTC")
+        for k, tlm_field in enumerate(tlm_values):
+            if tlm_field is None:
+                continue
             item_label = self.tbl_telemetry.item(k, 0)
             item_value = self.tbl_telemetry.item(k, 1)
-            self.display_telemetry_item(datagram, k, item_label, item_value)
+            self.display_telemetry_item(tlm_field, k, item_label, item_value)
+        self.thread.latency.displayed(stamp)
 
     # Reimplements closeEvent
     # to properly quit the thread
@@ -117,33 +162,52 @@ class SubsystemTelemetry(QDialog, UiGenerictelemetrydialog):
     def closeEvent(self, event):
         self.thread.runs = False
         self.thread.wait(2000)
+        self.thread.latency.close()
         self.mm.close()
         super().closeEvent(event)
 
 
+#
+# Returns the zeroMQ subscription and topic suffix for a page subscription,
+# which is either GroundSystem.<spacecraft>.TelemetryPackets.<packet id> or,
+# for all spacecraft, GroundSystem.<packet id>. zeroMQ matches on prefix
+# only, so receivers check the suffix (otherwise 0x80 would match 0x800).
+#
+def page_subscription(subscr):
+    parts = subscr.split('.')
+    suffix = f'.TelemetryPackets.{parts[-1]}'
+    if len(parts) == 4:
+        return subscr, suffix.encode()
+    return 'GroundSystem.', suffix.encode()
+
+
 # Subscribes and receives zeroMQ messages
 class GTTlmReceiver(QThread):
     # Setup signal to communicate with front-end GUI
-    gt_signal_tlm_datagram = pyqtSignal(bytes)
+    # (packet, receive time)
+    gt_signal_tlm_datagram = pyqtSignal(bytes, object)
 
-    def __init__(self, subscr):
+    def __init__(self, subscr, name="Telemetry Page"):
         super().__init__()
         self.runs = True
+        # Latency histograms (see LatencyHistogram.py)
+        self.latency = LatencyRecorder(f"{name} {subscr}")
 
         # Init zeroMQ
         context = zmq.Context()
         self.subscriber = context.socket(zmq.SUB)
         self.subscriber.connect(f"ipc:///tmp/GroundSystem-{getpass.getuser()}")
-        my_tlm_pg_apid = subscr.split(".", 1)
-        my_subscription = f"GroundSystem.Spacecraft1.TelemetryPackets.{my_tlm_pg_apid[1]}"
+        my_subscription, self.suffix = page_subscription(subscr)
         self.subscriber.setsockopt_string(zmq.SUBSCRIBE, my_subscription)
 
     def run(self):
         while self.runs:
             # Read envelope with address
-            _, datagram = self.subscriber.recv_multipart()
+            parts = self.subscriber.recv_multipart()
             # Send signal with received packet to front-end/GUI
-            self.gt_signal_tlm_datagram.emit(datagram)
+            if parts[0].endswith(self.suffix):
+                self.gt_signal_tlm_datagram.emit(
+                    parts[1], self.latency.received(parts))
 
 
 #
@@ -160,6 +224,9 @@ def usage():
 # Main
 #
 if __name__ == '__main__':
+    start_profiling('GenericTelemetry')
+    start_metrics('GenericTelemetry')
+
     #
     # Set defaults for the arguments
     #
@@ -199,12 +266,10 @@ if __name__ == '__main__':
             subscription = arg
 
     if not subscription:
-        subscription = "GroundSystem"
+        subscription = f"GroundSystem.{app_id}"
 
     print('Generic Telemetry Page started. Subscribed to', subscription)
 
-    py_endian = '<' if endian.upper() == 'L' else '>'
-
     #
     # Init the QT application and the telemetry class
     #
@@ -217,33 +282,15 @@ if __name__ == '__main__':
     #
     # Read in the contents of the telemetry packet definition
     #
-    tlm_item_is_valid, tlm_item_desc, \
-    tlm_item_start, tlm_item_size, \
-    tlm_item_display_type, tlm_item_format = ([] for _ in range(6))
-
-    tlm_item_enum = [None] * 40
-
-    i = 0
-    with open(f"{ROOTDIR}/{tlm_def_file}") as tlmfile:
-        reader = csv.reader(tlmfile, skipinitialspace=True)
-        for row in reader:
-            if not row[0].startswith("#"):
-                tlm_item_is_valid.append(True)
-                tlm_item_desc.append(row[0])
-                tlm_item_start.append(row[1])
-                tlm_item_size.append(row[2])
-                if row[3].lower() == 's':
-                    tlm_item_format.append(f'{row[2]}{row[3]}')
-                else:
-                    tlm_item_format.append(f'{py_endian}{row[3]}')
-                tlm_item_display_type.append(row[4])
-                if row[4] == 'Enm':
-                    tlm_item_enum[i] = row[5:9]
-                telem.tbl_telemetry.insertRow(i)
-                lbl_item, val_item = QTableWidgetItem(), QTableWidgetItem()
-                telem.tbl_telemetry.setItem(i, 0, lbl_item)
-                telem.tbl_telemetry.setItem(i, 1, val_item)
-                i += 1
+    tlm_items = load_items(tlm_def_file)
+    convert_packet = compile_packet(tlm_items, endian, tlm_def_file,
+                                    partial=True)
+
+    for i in range(len(tlm_items)):
+        telem.tbl_telemetry.insertRow(i)
+        lbl_item, val_item = QTableWidgetItem(), QTableWidgetItem()
+        telem.tbl_telemetry.setItem(i, 0, lbl_item)
+        telem.tbl_telemetry.setItem(i, 1, val_item)
     tbl.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
     tbl.verticalHeader().setSectionResizeMode(QHeaderView.Stretch)
 
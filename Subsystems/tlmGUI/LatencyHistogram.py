@@ -0,0 +1,209 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Latency of telemetry packets from the routing service to the screen
+#
+# The routing service sends every packet as three ZMQ frames:
+#   [topic, packet, receive time]
+# where the receive time is the time.time_ns() at which the UDP datagram
+# was read from the socket, as an unsigned 64 bit big endian integer.
+#
+# Each telemetry receiver keeps two histograms:
+#   bus      receive time to the page's receiver thread
+#   display  receive time to the page having updated its widgets
+# The difference between the two is the time the packet waited for the
+# page's event loop.
+#
+# The histograms are written every WRITE_INTERVAL seconds to
+# /tmp/GroundSystem-latency-<user>/, one file per page. To see them:
+#   ~$ python3 LatencyHistogram.py
+#
+# They are also exported as metrics (see Metrics.py), along with the number
+# of messages each page received.
+#
+
+import getpass
+import json
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+
+from Metrics import REGISTRY, counter, histogram_samples
+
+LATENCY_DIR = Path(f'/tmp/GroundSystem-latency-{getpass.getuser()}')
+WRITE_INTERVAL = 2.0
+STAMP = struct.Struct('>Q')
+
+# Bucket n counts latencies of [2**(n-1), 2**n) ns, up to about 9 minutes
+BUCKETS = 40
+# Buckets exported as metrics, from about 1 us (2**10 ns) to 34 s (2**35 ns);
+# the first holds the lower ones as well, +Inf the higher ones
+METRIC_BUCKETS = range(10, 36)
+
+MESSAGES = counter('groundsystem_page_messages',
+                   'Messages received from the bus', ('page',))
+
+
+#
+# Returns the receive time of a message from the bus, or 0 if the
+# message doesn't carry one
+#
+def receive_time(parts):
+    if len(parts) > 2 and len(parts[2]) == STAMP.size:
+        return STAMP.unpack(parts[2])[0]
+    return 0
+
+
+class LatencyHistogram:
+    __slots__ = ('counts', 'total', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, latency):
+        latency = max(latency, 0)
+        self.counts[min(latency.bit_length(), BUCKETS - 1)] += 1
+        self.total += 1
+        self.sum += latency
+        if latency > self.max:
+            self.max = latency
+
+    #
+    # Upper bound (ns) of the bucket holding the given fraction of samples
+    #
+    def percentile(self, fraction):
+        target = fraction * self.total
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(1 << bucket, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'mean_ns': self.sum // self.total if self.total else 0,
+            'p50_ns': self.percentile(0.5),
+            'p99_ns': self.percentile(0.99),
+            'max_ns': self.max,
+            'buckets': self.counts
+        }
+
+    def samples(self, name, labels):
+        counts = [sum(self.counts[:METRIC_BUCKETS[0] + 1])]
+        counts += self.counts[METRIC_BUCKETS[0] + 1:METRIC_BUCKETS[-1] + 1]
+        counts.append(sum(self.counts[METRIC_BUCKETS[-1] + 1:]))
+        return histogram_samples(name, labels,
+                                 [(1 << bucket) / 1e9
+                                  for bucket in METRIC_BUCKETS],
+                                 counts, self.sum / 1e9, self.total)
+
+
+class LatencyRecorder:
+
+    def __init__(self, name):
+        self.name = name
+        self.bus = LatencyHistogram()
+        self.display = LatencyHistogram()
+        self.path = LATENCY_DIR / f'{os.getpid()}.json'
+        self.next_write = time.monotonic() + WRITE_INTERVAL
+        self.messages = MESSAGES.labels(page=name)
+        REGISTRY.add_collector(self.collect_metrics)
+
+    #
+    # Records the bus latency of a message; returns its receive time
+    #
+    def received(self, parts):
+        self.messages.inc()
+        stamp = receive_time(parts)
+        if stamp:
+            self.bus.record(time.time_ns() - stamp)
+        return stamp
+
+    def displayed(self, stamp):
+        if stamp:
+            self.display.record(time.time_ns() - stamp)
+        if time.monotonic() >= self.next_write:
+            self.write()
+
+    def write(self):
+        self.next_write = time.monotonic() + WRITE_INTERVAL
+        report = {
+            'name': self.name,
+            'pid': os.getpid(),
+            'bus': self.bus.summary(),
+            'display': self.display.summary()
+        }
+        try:
+            LATENCY_DIR.mkdir(exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(report))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Couldn't write latency report:", e)
+
+    def collect_metrics(self):
+        labels = {'page': self.name}
+        return [
+            ('groundsystem_page_bus_latency_seconds', 'histogram',
+             'Routing service to page receiver latency',
+             self.bus.samples('groundsystem_page_bus_latency_seconds',
+                              labels)),
+            ('groundsystem_page_display_latency_seconds', 'histogram',
+             'Routing service to page display latency',
+             self.display.samples('groundsystem_page_display_latency_seconds',
+                                  labels))
+        ]
+
+    def close(self):
+        REGISTRY.remove_collector(self.collect_metrics)
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+
+def print_reports():
+    print(f'{"page":<40} {"":>8} {"count":>9} {"mean ms":>8} '
+          f'{"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for path in sorted(LATENCY_DIR.glob('*.json')):
+        try:
+            report = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for kind in ('bus', 'display'):
+            stats = report[kind]
+            print(f'{report["name"][:40]:<40} {kind:>8} {stats["count"]:>9} '
+                  f'{stats["mean_ns"] / 1e6:>8.3f} '
+                  f'{stats["p50_ns"] / 1e6:>8.3f} '
+                  f'{stats["p99_ns"] / 1e6:>8.3f} '
+                  f'{stats["max_ns"] / 1e6:>8.3f}')
+
+
+if __name__ == '__main__':
+    if not LATENCY_DIR.is_dir():
+        print('No latency reports in', LATENCY_DIR)
+        sys.exit(1)
+    print_reports()
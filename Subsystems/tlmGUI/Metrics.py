@@ -0,0 +1,472 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Counters, gauges and histograms shared by the Ground System processes,
+# exposed in the Prometheus text format
+#
+# Metrics are created once, at import or setup, with counter(), gauge() and
+# histogram(), optionally with label names; .labels(name=value, ...) then
+# returns the metric for one combination of values (keep it rather than
+# looking it up per packet). Each thread adds to its own cell of a metric,
+# so updates take no lock; the cells are summed when the metrics are read.
+#
+# Counts a component already keeps (e.g. per spacecraft in the router) are
+# exported by a collector, a function called at scrape time, so the packet
+# path pays nothing for them.
+#
+# start_metrics(<process name>) serves the process's metrics over HTTP on a
+# Unix socket, /tmp/GroundSystem-metrics-<user>/<process name>-<pid>.sock,
+# or on a TCP port if GROUNDSYSTEM_METRICS_PORT is set. GROUNDSYSTEM_METRICS=0
+# turns this off. To see or scrape the metrics of every process at once:
+#   ~$ python3 Metrics.py                 print them
+#   ~$ python3 Metrics.py --port=9464     serve them to Prometheus
+# Each sample is then labelled with its process and pid.
+#
+
+import atexit
+import getopt
+import getpass
+import http.server
+import os
+import socket
+import socketserver
+import sys
+import threading
+from bisect import bisect_left
+from pathlib import Path
+
+METRICS_DIR = Path(f'/tmp/GroundSystem-metrics-{getpass.getuser()}')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, 50 us to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in labels.items()) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+#
+# Per-thread cells of a metric: each thread only writes its own
+#
+class Cells:
+    __slots__ = ('local', 'cells', 'lock', 'size')
+
+    def __init__(self, size):
+        self.local = threading.local()
+        self.cells = []
+        self.lock = threading.Lock()
+        self.size = size
+
+    def new(self):
+        cell = [0] * self.size
+        with self.lock:
+            self.cells.append(cell)
+        self.local.cell = cell
+        return cell
+
+    def totals(self):
+        totals = [0] * self.size
+        with self.lock:
+            cells = list(self.cells)
+        for cell in cells:
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+
+class Counter:
+    __slots__ = ('cells', 'local')
+
+    def __init__(self):
+        self.cells = Cells(1)
+        self.local = self.cells.local
+
+    def inc(self, amount=1):
+        try:
+            self.local.cell[0] += amount
+        except AttributeError:
+            self.cells.new()[0] += amount
+
+    def value(self):
+        return self.cells.totals()[0]
+
+    def samples(self, name, labels):
+        return [(f'{name}_total', labels, self.value())]
+
+
+class Gauge:
+    __slots__ = ('cells', 'local', 'base', 'function')
+
+    def __init__(self):
+        self.cells = Cells(1)
+        self.local = self.cells.local
+        self.base = 0
+        self.function = None
+
+    def set(self, value):
+        # The cells hold what inc() and dec() added since
+        self.base = value - self.cells.totals()[0]
+
+    def set_function(self, function):
+        self.function = function
+
+    def inc(self, amount=1):
+        try:
+            self.local.cell[0] += amount
+        except AttributeError:
+            self.cells.new()[0] += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def value(self):
+        if self.function is not None:
+            return self.function()
+        return self.base + self.cells.totals()[0]
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value())]
+
+
+class Histogram:
+    __slots__ = ('cells', 'local', 'bounds')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        # Bucket counts, +Inf count, sum, count
+        self.cells = Cells(len(self.bounds) + 3)
+        self.local = self.cells.local
+
+    def observe(self, value):
+        try:
+            cell = self.local.cell
+        except AttributeError:
+            cell = self.cells.new()
+        cell[bisect_left(self.bounds, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def samples(self, name, labels):
+        totals = self.cells.totals()
+        return histogram_samples(name, labels, self.bounds, totals[:-2],
+                                 totals[-2], totals[-1])
+
+
+#
+# Samples of a histogram given the count of each bucket, the last being the
+# +Inf bucket
+#
+def histogram_samples(name, labels, bounds, counts, total_sum, total_count):
+    samples = []
+    cumulative = 0
+    for bound, count in zip(tuple(bounds) + (float('inf'),), counts):
+        cumulative += count
+        samples.append((f'{name}_bucket',
+                        {**labels, 'le': format_value(float(bound))},
+                        cumulative))
+    samples.append((f'{name}_sum', labels, total_sum))
+    samples.append((f'{name}_count', labels, total_count))
+    return samples
+
+
+#
+# A metric and its children, one per combination of label values
+#
+class Family:
+
+    def __init__(self, name, doc, kind, factory, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+        self.factory = factory
+        self.labelnames = tuple(labelnames)
+        # label values: metric
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = factory()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.factory())
+        return child
+
+    # The unlabelled metric's methods
+    def __getattr__(self, attr):
+        if attr == 'children' or self.labelnames:
+            raise AttributeError(attr)
+        return getattr(self.children[()], attr)
+
+    def collect(self):
+        samples = []
+        for key, child in list(self.children.items()):
+            samples += child.samples(self.name,
+                                     dict(zip(self.labelnames, key)))
+        return self.name, self.kind, self.doc, samples
+
+
+class Registry:
+
+    def __init__(self):
+        # name: Family
+        self.families = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def family(self, name, doc, kind, factory, labelnames):
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = \
+                    Family(name, doc, kind, factory, labelnames)
+            elif family.kind != kind:
+                raise ValueError(f'Metric {name} is already a {family.kind}')
+        return family
+
+    #
+    # Adds a function returning [(name, kind, help, [(sample name,
+    # {label: value}, value)])], called at every scrape
+    #
+    def add_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self.lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def collect(self):
+        with self.lock:
+            families = list(self.families.values())
+            collectors = list(self.collectors)
+        metrics = [family.collect() for family in families]
+        for collector in collectors:
+            metrics += collector()
+        return metrics
+
+    def exposition(self, extra_labels=None):
+        lines = []
+        for name, kind, doc, samples in self.collect():
+            lines.append(f'# HELP {name} {doc}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                if extra_labels:
+                    labels = {**extra_labels, **labels}
+                lines.append(f'{sample_name}{format_labels(labels)} '
+                             f'{format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, doc, labelnames=()):
+    return REGISTRY.family(name, doc, 'counter', Counter, labelnames)
+
+
+def gauge(name, doc, labelnames=()):
+    return REGISTRY.family(name, doc, 'gauge', Gauge, labelnames)
+
+
+def histogram(name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.family(name, doc, 'histogram',
+                           lambda: Histogram(buckets), labelnames)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        body = self.server.expose().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class UnixMetricsServer(socketserver.ThreadingMixIn,
+                        socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, expose):
+        self.expose = expose
+        super().__init__(str(path), MetricsHandler)
+
+
+class TCPMetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, expose):
+        self.expose = expose
+        super().__init__(address, MetricsHandler)
+
+
+#
+# Serves this process's metrics; returns the server, or None if metrics
+# are turned off or the endpoint couldn't be created. The TCP port is only
+# used by this process: the pages it starts serve on Unix sockets.
+#
+def start_metrics(name, registry=REGISTRY):
+    if os.environ.get('GROUNDSYSTEM_METRICS', '1').lower() in \
+            ('0', 'no', 'false', 'off'):
+        return None
+    port = os.environ.pop('GROUNDSYSTEM_METRICS_PORT', None)
+    try:
+        if port:
+            server = TCPMetricsServer(('127.0.0.1', int(port)),
+                                      registry.exposition)
+        else:
+            METRICS_DIR.mkdir(exist_ok=True)
+            path = METRICS_DIR / f'{name}-{os.getpid()}.sock'
+            path.unlink(missing_ok=True)
+            server = UnixMetricsServer(path, registry.exposition)
+            atexit.register(path.unlink, missing_ok=True)
+    except (OSError, ValueError) as e:
+        print("Metrics endpoint disabled:", e)
+        return None
+    threading.Thread(target=server.serve_forever, name='Metrics',
+                     daemon=True).start()
+    return server
+
+
+#
+# Reads the metrics of one process from its Unix socket
+#
+def scrape_socket(path, timeout=2.0):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(path))
+        sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    response = b''.join(chunks).decode()
+    return response.split('\r\n\r\n', 1)[1]
+
+
+#
+# The metrics of every process with a socket in METRICS_DIR, labelled with
+# the process name and pid. Sockets of processes that are gone are removed.
+#
+def scrape_all():
+    families = {}
+    for path in sorted(METRICS_DIR.glob('*.sock')):
+        process, _, pid = path.stem.rpartition('-')
+        try:
+            text = scrape_socket(path)
+        except ConnectionRefusedError:
+            path.unlink(missing_ok=True)
+            continue
+        except (OSError, IndexError):
+            continue
+        name = None
+        for line in text.splitlines():
+            if line.startswith('# '):
+                name = line.split()[2]
+                family = families.setdefault(name, {'meta': [], 'samples': []})
+                if line not in family['meta']:
+                    family['meta'].append(line)
+            elif line and name:
+                sample, _, value = line.rpartition(' ')
+                labels = f'process="{_escape(process)}",pid="{pid}"'
+                if sample.endswith('}'):
+                    sample = sample.replace('{', '{' + labels + ',', 1)
+                else:
+                    sample = f'{sample}{{{labels}}}'
+                families[name]['samples'].append(f'{sample} {value}')
+    return ''.join('\n'.join(family['meta'] + family['samples']) + '\n'
+                   for family in families.values())
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: Metrics.py [--port=<port>] [--bind=<address>]\n\n"
+           "Prints the metrics of every Ground System process, or serves "
+           "them over HTTP\nfor Prometheus with --port.\n"
+           "example: --port=9464"))
+
+
+#
+# Main
+#
+if __name__ == '__main__':
+    serve_port = None
+    bind_address = '127.0.0.1'
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hp:b:",
+                                   ["help", "port=", "bind="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif opt in ("-p", "--port"):
+                serve_port = int(arg)
+            elif opt in ("-b", "--bind"):
+                bind_address = arg
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    if serve_port is None:
+        sys.stdout.write(scrape_all())
+        sys.exit()
+
+    print(f'Serving the metrics of all processes on '
+          f'http://{bind_address}:{serve_port}/metrics')
+    try:
+        TCPMetricsServer((bind_address, serve_port),
+                         scrape_all).serve_forever()
+    except KeyboardInterrupt:
+        pass
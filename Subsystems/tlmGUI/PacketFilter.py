@@ -0,0 +1,255 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+##############################################################################
+# Description:
+#	PacketFilter.py compiles packet filter expressions, e.g.
+#
+#	0x800 <= msgid <= 0x80F and spacecraft == "Spacecraft1"
+#	apid in (5, 6, 9) and sequence % 10 == 0
+#	msgid == 0x800 and {Command Counter} > 3
+#
+# An expression is Python syntax over these names:
+#
+#	msgid       stream id, the first 16 bits of the packet
+#	apid        application id (lower 11 bits of the stream id)
+#	type        0 telemetry, 1 command
+#	secondary   1 if the packet has a secondary header
+#	version     CCSDS version number
+#	segments    sequence flags (3 for an unsegmented packet)
+#	sequence    sequence count
+#	length      length of the packet in bytes
+#	spacecraft  name of the spacecraft that sent the packet
+#
+# and telemetry items referenced as {name}, decoded through the definition
+# files of the telemetry pages (engineering units, Str items as text). A
+# filter with items only matches packets whose definition has all of them.
+# Operators are comparisons (chained ones too), in / not in, and, or, not
+# and arithmetic and bitwise operators. Text (string constants and Str items)
+# can only be compared and added, and << only shifts by a constant of at
+# most 64 bits, so no expression builds huge values for every packet.
+#
+#	compile_filter() turns an expression into a matches(packet,
+# spacecraft, offset) function generated for it, with a header field only
+# computed if the expression uses it, items decoded by compile_packet()
+# with only the items referenced, and lists of constants turned into
+# frozensets.
+#
+# The routing service evaluates filters for its subscribers: subscribing
+# to filter_subscription(expression) on the bus receives the packets that
+# match, with their topics prefixed by the subscription, so no other
+# packet crosses to the subscriber. original_topic() removes the prefix.
+# The routing service decodes items in ROUTER_ENDIAN byte order.
+#
+##############################################################################
+
+import ast
+from operator import itemgetter
+
+from TelemetryConversions import REF_RE, compile_packet
+from TelemetryDefinitions import ROOTDIR, load_items, load_pages
+
+FILTER_PREFIX = b'Filtered.'
+# Byte order of the items in filters evaluated by the routing service
+ROUTER_ENDIAN = 'L'
+# Largest shift allowed
+MAX_SHIFT = 64
+
+# name: source computing it from the packet
+FIELDS = {
+    'msgid': '(packet[0] << 8) | packet[1]',
+    'apid': '((packet[0] & 7) << 8) | packet[1]',
+    'type': '(packet[0] >> 4) & 1',
+    'secondary': '(packet[0] >> 3) & 1',
+    'version': 'packet[0] >> 5',
+    'segments': 'packet[2] >> 6',
+    'sequence': '((packet[2] & 0x3F) << 8) | packet[3]',
+    'length': 'len(packet)'
+}
+
+FILTER_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp,
+                ast.Not, ast.USub, ast.UAdd, ast.Invert, ast.BinOp, ast.Add,
+                ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.BitAnd,
+                ast.BitOr, ast.BitXor, ast.LShift, ast.RShift, ast.Compare,
+                ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In,
+                ast.NotIn, ast.Constant, ast.Name, ast.Load, ast.Tuple,
+                ast.List, ast.Set)
+
+
+def filter_subscription(expression):
+    return FILTER_PREFIX + expression.encode() + b'\0'
+
+
+def original_topic(topic):
+    return topic[topic.find(b'\0') + 1:]
+
+
+#
+# True if the expression references telemetry items
+#
+def uses_items(expression):
+    return REF_RE.search(expression) is not None
+
+
+#
+# Rejects the operations whose cost grows with the value of an operand
+# (string repetition or formatting, shifts by more than MAX_SHIFT);
+# text_names are the names of Str items
+#
+def check_operations(tree, text_names, expression):
+    def is_text(node):
+        return any(isinstance(sub, ast.Constant) and isinstance(sub.value, str)
+                   or isinstance(sub, ast.Name) and sub.id in text_names
+                   for sub in ast.walk(node))
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.BinOp):
+            continue
+        if not isinstance(node.op, ast.Add) and \
+                (is_text(node.left) or is_text(node.right)):
+            raise ValueError(f'Text can only be compared or added in '
+                             f'{expression}')
+        if isinstance(node.op, ast.LShift) and not (
+                isinstance(node.right, ast.Constant) and
+                type(node.right.value) is int and
+                0 <= node.right.value <= MAX_SHIFT):
+            raise ValueError(f'Shifts must be by a constant of 0 to '
+                             f'{MAX_SHIFT} in {expression}')
+
+
+#
+# Replaces lists of constants on the right of in / not in by frozensets
+#
+class ConstantSets(ast.NodeTransformer):
+
+    def __init__(self, env):
+        self.env = env
+
+    def visit_Compare(self, node):  # pylint: disable=invalid-name
+        self.generic_visit(node)
+        for i, (op, comparator) in enumerate(zip(node.ops, node.comparators)):
+            if isinstance(op, (ast.In, ast.NotIn)) and \
+                    isinstance(comparator, (ast.Tuple, ast.List, ast.Set)) and \
+                    all(isinstance(elt, ast.Constant)
+                        for elt in comparator.elts):
+                name = f'c{len(self.env)}'
+                self.env[name] = frozenset(elt.value
+                                           for elt in comparator.elts)
+                node.comparators[i] = ast.Name(name, ast.Load())
+        return node
+
+
+#
+# Returns {packet id: (convert, getter, is Str)} for the packets whose
+# definitions have every item in names; getter returns the values of the
+# items, in the order of names, from what convert returns
+#
+def item_decoders(names, endian='L', tlm_dir=ROOTDIR):
+    items = {}
+    for page in load_pages(tlm_dir):
+        if page.def_file != 'null':
+            items.setdefault(page.appid, []).extend(
+                load_items(page.def_file, tlm_dir))
+    decoders = {}
+    for pkt_id, pkt_items in items.items():
+        indexes = {item.desc: i for i, item in enumerate(pkt_items)}
+        if not all(name in indexes for name in names):
+            continue
+        only = [indexes[name] for name in names]
+        getter = itemgetter(*only) if len(only) > 1 else \
+            lambda values, index=only[0]: (values[index],)
+        decoders[pkt_id] = (
+            compile_packet(pkt_items, endian, hex(pkt_id), only=only),
+            getter, tuple(pkt_items[i].display == 'Str' for i in only))
+    return decoders
+
+
+#
+# Compiles a filter expression into matches(packet, spacecraft='',
+# offset=0), true if the packet matches; offset is the telemetry header
+# offset (only used by items). Raises ValueError if the expression is
+# invalid.
+#
+def compile_filter(expression, endian=ROUTER_ENDIAN, tlm_dir=ROOTDIR):
+    refs = {}
+
+    def reference(match):
+        return refs.setdefault(match.group(1).strip(), f'i{len(refs)}')
+    source = REF_RE.sub(reference, expression)
+
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError(f'Invalid filter {expression}')
+    for node in ast.walk(tree):
+        if not isinstance(node, FILTER_NODES):
+            raise ValueError(f'{type(node).__name__} not allowed in '
+                             f'{expression}')
+        if isinstance(node, ast.Constant) and \
+                not isinstance(node.value, (int, float, str)):
+            raise ValueError(f'Invalid constant in {expression}')
+        if isinstance(node, ast.Name) and node.id not in FIELDS and \
+                node.id != 'spacecraft' and node.id not in refs.values():
+            raise ValueError(f'Unknown name {node.id} in {expression} (items '
+                             'are referenced as {name}; fields are '
+                             f'{", ".join(FIELDS)}, spacecraft)')
+    names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+
+    env = {}
+    tree = ConstantSets(env).visit(tree)
+    lines = ['def matches(packet, spacecraft="", offset=0):',
+             '    if len(packet) < 6:',
+             '        return False']
+    if refs:
+        names.add('msgid')
+    lines += [f'    {name} = {field}' for name, field in FIELDS.items()
+              if name in names]
+    text_names = set()
+    if refs:
+        env['decoders'] = item_decoders(list(refs), endian, tlm_dir)
+        if not env['decoders']:
+            raise ValueError(f'No packet definition has '
+                             f'{", ".join(refs)}')
+        variables = list(refs.values())
+        text_names = {var for i, var in enumerate(variables)
+                      if any(decoder[2][i]
+                             for decoder in env['decoders'].values())}
+        lines += ['    decoder = decoders.get(msgid)',
+                  '    if decoder is None:',
+                  '        return False',
+                  '    values = decoder[0](packet, offset)',
+                  '    if values is None:',
+                  '        return False',
+                  f'    {", ".join(variables)}, = decoder[1](values)']
+        # Str items, as text
+        for i, var in enumerate(variables):
+            if any(decoder[2][i] for decoder in env['decoders'].values()):
+                lines += [f'    if decoder[2][{i}]:',
+                          f'        {var} = {var}.split(b"\\0", 1)[0]'
+                          '.decode("ascii", "replace")']
+    check_operations(tree, text_names, expression)
+    lines.append(f'    return {ast.unparse(tree)}')
+
+    try:
+        exec(compile('\n'.join(lines), f'<filter {expression}>', 'exec'),
+             env)
+    except SyntaxError:
+        raise ValueError(f'Invalid filter {expression}')
+    matches = env['matches']
+    matches.source = '\n'.join(lines)
+    return matches
@@ -0,0 +1,316 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# CPU and memory profiling for the Ground System processes
+#
+# Enabled with the GROUNDSYSTEM_PROFILE environment variable (inherited by
+# the pages the Ground System starts) or a --profile option, set to a comma
+# separated list of:
+#   cpu     sampling CPU profile of every thread
+#   memory  tracemalloc snapshots, from the first SIGUSR2 on
+#   timers  time spent in the receive, decode, render, ... stages
+# or to "all" (--profile alone means all).
+#
+# Each process writes to its own directory,
+#   /tmp/GroundSystem-profile-<user>/<process name>-<pid>/
+# (GROUNDSYSTEM_PROFILE_DIR changes the parent directory):
+#   kill -USR1 <pid>  writes cpu-<n>.folded and timers.json
+#   kill -USR2 <pid>  writes memory-<n>.txt, the largest allocations and
+#                     the growth since the previous snapshot, and
+#                     memory-<n>.snapshot (tracemalloc.Snapshot.load())
+# Everything is also written at exit, and every GROUNDSYSTEM_PROFILE_INTERVAL
+# seconds if that is set.
+#
+# Tracing allocations slows Python down several times, so it only starts
+# with the first memory snapshot: to hunt a leak, send SIGUSR2 once, let
+# the process run, and send it again to see what grew in between.
+#
+# The CPU profile counts the CPU time (in microseconds) each thread used
+# between samples against the stack it is in, in the folded stack format of
+# flamegraph.pl and speedscope. Blocked threads don't use CPU time and
+# don't show up.
+#
+# Stages are timed by decorating the functions that implement them with
+# timed(<stage>). When timers aren't enabled the decorator returns the
+# function itself, so disabled profiling costs nothing per packet.
+#
+
+import atexit
+import functools
+import getpass
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+FEATURES = ('cpu', 'memory', 'timers')
+PROFILE_ENV = 'GROUNDSYSTEM_PROFILE'
+PROFILE_DIR = Path(os.environ.get('GROUNDSYSTEM_PROFILE_DIR', '/tmp')) / \
+    f'GroundSystem-profile-{getpass.getuser()}'
+
+# Seconds between CPU samples
+SAMPLE_INTERVAL = 0.01
+# Frames kept per tracemalloc traceback
+MEMORY_FRAMES = 5
+# Allocation sites listed per memory report
+MEMORY_TOP = 50
+
+
+#
+# Features enabled by a --profile[=...] option or GROUNDSYSTEM_PROFILE
+#
+def requested(argv=None):
+    value = os.environ.get(PROFILE_ENV, '')
+    for arg in sys.argv if argv is None else argv:
+        if arg == '--profile':
+            value = 'all'
+        elif arg.startswith('--profile='):
+            value = arg.split('=', 1)[1]
+    features = {name.strip() for name in value.lower().split(',')
+                if name.strip()}
+    if features & {'1', 'all', 'yes', 'true'}:
+        return set(FEATURES)
+    return features & set(FEATURES)
+
+
+# Decided at import so that timed() can leave functions untouched
+ENABLED = requested()
+
+# stage: [calls, total ns, max ns]
+STAGES = {}
+
+
+#
+# Decorator timing every call of a function as part of a stage
+#
+def timed(stage):
+    def decorate(func):
+        if 'timers' not in ENABLED:
+            return func
+        stats = STAGES.setdefault(stage, [0, 0, 0])
+        perf_counter_ns = time.perf_counter_ns
+
+        # Calls that raise aren't counted
+        @functools.wraps(func)
+        def wrapper(*args):
+            start = perf_counter_ns()
+            result = func(*args)
+            elapsed = perf_counter_ns() - start
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+            return result
+        return wrapper
+    return decorate
+
+
+class Profiler(threading.Thread):
+
+    def __init__(self, name, features, interval=0.0):
+        super().__init__(name='Profiler', daemon=True)
+        self.features = features
+        self.interval = interval
+        self.directory = PROFILE_DIR / f'{name}-{os.getpid()}'
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.cpu_dumps = 0
+        self.memory_dumps = 0
+        self.last_snapshot = None
+        # stack: CPU microseconds
+        self.stacks = {}
+        # thread id: (CPU clock id, CPU ns at the last sample)
+        self.clocks = {}
+        # code object: stack entry
+        self.labels = {}
+        # Woken by the signal handlers through the wakeup fd, even while
+        # the main thread is inside the Qt event loop
+        self.wakeup, wakeup_w = socket.socketpair()
+        wakeup_w.setblocking(False)
+        self.wakeup_w = wakeup_w
+        signal.set_wakeup_fd(wakeup_w.fileno(), warn_on_full_buffer=False)
+        for signum in (signal.SIGUSR1, signal.SIGUSR2):
+            signal.signal(signum, lambda *_: None)
+        atexit.register(self.dump_all)
+
+    def run(self):
+        sample = SAMPLE_INTERVAL if 'cpu' in self.features else None
+        next_dump = time.monotonic() + self.interval if self.interval \
+            else None
+        while True:
+            timeout = sample
+            if next_dump is not None:
+                wait = max(next_dump - time.monotonic(), 0)
+                timeout = wait if timeout is None else min(timeout, wait)
+            readable, _, _ = select.select([self.wakeup], [], [], timeout)
+            if readable:
+                for signum in self.wakeup.recv(64):
+                    if signum == signal.SIGUSR1:
+                        self.dump_cpu()
+                    elif signum == signal.SIGUSR2:
+                        self.dump_memory()
+            if sample:
+                self.sample()
+            if next_dump is not None and time.monotonic() >= next_dump:
+                next_dump += self.interval
+                self.dump_all()
+
+    #
+    # Charges the CPU time each thread used since the last sample to its
+    # current stack
+    #
+    def sample(self):
+        names = None
+        clocks = self.clocks
+        own = threading.get_ident()
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        with self.lock:
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                try:
+                    clock_id, last = clocks.get(ident) or \
+                        (time.pthread_getcpuclockid(ident), None)
+                    now = time.clock_gettime_ns(clock_id)
+                except (OSError, OverflowError):
+                    continue
+                clocks[ident] = (clock_id, now)
+                if last is None or now <= last:
+                    continue
+                if names is None:
+                    names = {thread.ident: thread.name
+                             for thread in threading.enumerate()}
+                stack = [self.label(f.f_code) for f in self.walk(frame)]
+                stack.append(names.get(ident, f'thread-{ident}'))
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + \
+                    (now - last) // 1000
+            for ident in set(clocks) - set(frames):
+                del clocks[ident]
+
+    @staticmethod
+    def walk(frame):
+        while frame is not None:
+            yield frame
+            frame = frame.f_back
+
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = \
+                f'{code.co_name} ({Path(code.co_filename).name}:' \
+                f'{code.co_firstlineno})'
+        return label
+
+    def write(self, file_name, text):
+        path = self.directory / file_name
+        tmp_path = path.with_suffix('.tmp')
+        try:
+            tmp_path.write_text(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("Couldn't write profile:", e)
+
+    def dump_cpu(self):
+        if 'timers' in self.features:
+            self.write('timers.json', json.dumps({
+                stage: {'calls': calls, 'total_ms': round(total / 1e6, 3),
+                        'mean_us': round(total / calls / 1000, 3)
+                        if calls else 0,
+                        'max_us': round(longest / 1000, 3)}
+                for stage, (calls, total, longest) in STAGES.items()},
+                indent=2))
+        if 'cpu' in self.features:
+            with self.lock:
+                stacks, self.stacks = self.stacks, {}
+            self.cpu_dumps += 1
+            self.write(f'cpu-{self.cpu_dumps}.folded', ''.join(
+                f'{stack} {usec}\n' for stack, usec in stacks.items()))
+
+    def dump_memory(self):
+        if 'memory' not in self.features:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            self.last_snapshot = self.snapshot()
+            self.write('memory-0.txt', 'Tracing started at '
+                       f'{time.strftime("%Y-%m-%dT%H:%M:%S")}\n')
+            return
+        snapshot = self.snapshot()
+        self.memory_dumps += 1
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f'Traced memory: {current / 1e6:.1f} MB '
+                 f'(peak {peak / 1e6:.1f} MB)', '',
+                 f'Largest {MEMORY_TOP} allocation sites:']
+        lines += [str(stat) for stat in
+                  snapshot.statistics('lineno')[:MEMORY_TOP]]
+        lines += ['', f'Largest {MEMORY_TOP} changes since memory-'
+                      f'{self.memory_dumps - 1}:']
+        lines += [str(stat) for stat in snapshot.compare_to(
+            self.last_snapshot, 'lineno')[:MEMORY_TOP]]
+        self.write(f'memory-{self.memory_dumps}.txt', '\n'.join(lines) + '\n')
+        try:
+            snapshot.dump(
+                str(self.directory / f'memory-{self.memory_dumps}.snapshot'))
+        except OSError as e:
+            print("Couldn't write memory snapshot:", e)
+        self.last_snapshot = snapshot
+
+    @staticmethod
+    def snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)))
+
+    #
+    # Periodic and exit dumps; memory only once tracing has been started
+    #
+    def dump_all(self):
+        self.dump_cpu()
+        if tracemalloc.is_tracing():
+            self.dump_memory()
+
+
+#
+# Starts profiling the process if it was requested, removing any --profile
+# option from sys.argv; call from the main thread before parsing options.
+# Returns the Profiler, or None.
+#
+def start_profiling(name):
+    sys.argv[1:] = [arg for arg in sys.argv[1:]
+                    if arg != '--profile' and not arg.startswith('--profile=')]
+    if not ENABLED:
+        return None
+    # Pages started from this process profile too
+    os.environ[PROFILE_ENV] = ','.join(sorted(ENABLED))
+    try:
+        interval = float(os.environ.get('GROUNDSYSTEM_PROFILE_INTERVAL', 0))
+    except ValueError:
+        interval = 0.0
+    profiler = Profiler(name, ENABLED, interval)
+    profiler.start()
+    print(f'Profiling {", ".join(sorted(ENABLED))} to {profiler.directory}'
+          f' (kill -USR1 {os.getpid()}: CPU and timers, -USR2: memory)')
+    return profiler
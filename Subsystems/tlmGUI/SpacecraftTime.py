@@ -0,0 +1,221 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Decodes the packet time in the cFE telemetry secondary header
+#
+# The secondary header follows the 6 byte primary header (and the 4 byte
+# extended header with v2 headers, i.e. the telemetry header offset) and
+# holds big endian seconds and subseconds since the mission epoch. The
+# epoch, subseconds format and time scale are set in spacecraft-time.txt
+# to match the cFE mission configuration:
+#
+#   epoch = 1980-01-06T00:00:00   CFE_MISSION_TIME_EPOCH_*
+#   subseconds = 32_16            CFE_MISSION_SB_PACKET_TIME_FORMAT:
+#                                 32_16, 32_32 or 32_32_M_20
+#   time_scale = tai              tai or utc (CFE_MISSION_TIME_CFG_DEFAULT_*)
+#
+# Times are returned in seconds since 1970-01-01 on the UTC (POSIX) or TAI
+# time scale. TAI - UTC is taken from the leap second table below; as with
+# POSIX time, a leap second reads as the second that follows it.
+#
+# SpacecraftClock.utc() and .tai() decode one packet with a single unpack
+# and, as long as the packet isn't on the other side of a leap second from
+# the previous one, no table lookup. .to_datetime64() converts arrays of
+# seconds and subseconds (e.g. from .raw_arrays()) in one call with exact
+# integer arithmetic (requires NumPy).
+#
+
+import calendar
+import csv
+import struct
+import time
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ROOTDIR = Path(__file__).resolve().parent
+CLOCK_FILE = f'{ROOTDIR}/spacecraft-time.txt'
+
+PRIMARY_HEADER_SIZE = 6
+NS = 1000000000
+
+# name: (struct format, subseconds shift, fraction of a second per count
+#        as a ratio in ns (numerator, denominator))
+SUBSECOND_FORMATS = {
+    '32_16': ('>IH', 0, (1953125, 128)),
+    '32_32': ('>II', 0, (1953125, 8388608)),
+    # Microseconds in the upper 20 bits
+    '32_32_M_20': ('>II', 12, (1000, 1))
+}
+
+# (UTC date from which it applies, TAI - UTC in seconds)
+LEAP_SECONDS = (
+    ('1972-01-01', 10), ('1972-07-01', 11), ('1973-01-01', 12),
+    ('1974-01-01', 13), ('1975-01-01', 14), ('1976-01-01', 15),
+    ('1977-01-01', 16), ('1978-01-01', 17), ('1979-01-01', 18),
+    ('1980-01-01', 19), ('1981-07-01', 20), ('1982-07-01', 21),
+    ('1983-07-01', 22), ('1985-07-01', 23), ('1988-01-01', 24),
+    ('1990-01-01', 25), ('1991-01-01', 26), ('1992-07-01', 27),
+    ('1993-07-01', 28), ('1994-07-01', 29), ('1996-01-01', 30),
+    ('1997-07-01', 31), ('1999-01-01', 32), ('2006-01-01', 33),
+    ('2009-01-01', 34), ('2012-07-01', 35), ('2015-07-01', 36),
+    ('2017-01-01', 37)
+)
+
+
+def parse_time(text):
+    return calendar.timegm(datetime.fromisoformat(text).timetuple())
+
+
+#
+# Reads spacecraft-time.txt into SpacecraftClock keyword arguments
+#
+def load_clock(clock_file=CLOCK_FILE):
+    settings = {}
+    try:
+        with open(clock_file) as clock_obj:
+            for row in csv.reader(clock_obj, delimiter='=',
+                                  skipinitialspace=True):
+                if not row or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                key, value = row[0].strip(), row[1].strip()
+                if key not in ('epoch', 'subseconds', 'time_scale'):
+                    raise ValueError(f'{clock_file}: unknown setting {key}')
+                settings[key] = value
+    except IOError:
+        pass
+    return settings
+
+
+class SpacecraftClock:
+
+    def __init__(self, epoch='1980-01-06T00:00:00', subseconds='32_16',
+                 time_scale='tai'):
+        if subseconds not in SUBSECOND_FORMATS:
+            raise ValueError(f'Unknown subseconds format {subseconds}')
+        if time_scale not in ('tai', 'utc'):
+            raise ValueError(f'Unknown time scale {time_scale}')
+        fmt, self.shift, (self.ns_num, self.ns_den) = \
+            SUBSECOND_FORMATS[subseconds]
+        self.time = struct.Struct(fmt)
+        self.scale = self.ns_num / self.ns_den / NS
+        self.epoch = parse_time(epoch)
+        self.is_tai = time_scale == 'tai'
+
+        # Start of each TAI - UTC value, on the spacecraft's time scale
+        self.leap_offsets = [offset for _, offset in LEAP_SECONDS]
+        self.leap_starts = [parse_time(day) + (offset if self.is_tai else 0)
+                            for day, offset in LEAP_SECONDS]
+        # Interval of the last lookup: [low, high) -> offset
+        self.leap_low = self.leap_high = 0
+        self.leap_offset = 0
+
+    #
+    # TAI - UTC at t (seconds on the spacecraft's time scale)
+    #
+    def leap(self, t):
+        if self.leap_low <= t < self.leap_high:
+            return self.leap_offset
+        i = max(bisect_right(self.leap_starts, t) - 1, 0)
+        self.leap_low = self.leap_starts[i] if i else float('-inf')
+        self.leap_high = self.leap_starts[i + 1] \
+            if i + 1 < len(self.leap_starts) else float('inf')
+        self.leap_offset = self.leap_offsets[i]
+        return self.leap_offset
+
+    #
+    # (seconds, subseconds) as stored in the packet
+    #
+    def raw(self, datagram, offset=0):
+        return self.time.unpack_from(datagram, PRIMARY_HEADER_SIZE + offset)
+
+    #
+    # Packet time in seconds since 1970 on the spacecraft's time scale
+    #
+    def seconds(self, datagram, offset=0):
+        secs, subs = self.time.unpack_from(datagram,
+                                           PRIMARY_HEADER_SIZE + offset)
+        return self.epoch + secs + (subs >> self.shift) * self.scale
+
+    def utc(self, datagram, offset=0):
+        t = self.seconds(datagram, offset)
+        return t - self.leap(t) if self.is_tai else t
+
+    def tai(self, datagram, offset=0):
+        t = self.seconds(datagram, offset)
+        return t if self.is_tai else t + self.leap(t)
+
+    #
+    # Ground receive time minus packet time, in seconds (recv_ns is the
+    # time.time_ns() receive time published by the routing service)
+    #
+    def ground_offset(self, datagram, recv_ns, offset=0):
+        return recv_ns / NS - self.utc(datagram, offset)
+
+    #
+    # Seconds and subseconds arrays of a buffer of packets of packet_len
+    # bytes each
+    #
+    def raw_arrays(self, data, packet_len, offset=0):
+        start = PRIMARY_HEADER_SIZE + offset
+        sub_type = '>u2' if self.time.size == 6 else '>u4'
+        dtype = np.dtype({'names': ['seconds', 'subseconds'],
+                          'formats': ['>u4', sub_type],
+                          'offsets': [start, start + 4],
+                          'itemsize': packet_len})
+        records = np.frombuffer(data, dtype,
+                                count=len(data) // packet_len)
+        return records['seconds'], records['subseconds']
+
+    #
+    # Converts arrays of seconds and subseconds to datetime64[ns] on the
+    # given time scale ('utc' or 'tai')
+    #
+    def to_datetime64(self, seconds, subseconds, time_scale='utc'):
+        secs = np.asarray(seconds, np.int64)
+        subs = np.asarray(subseconds, np.int64) >> self.shift
+        ns = (secs + self.epoch) * NS + subs * self.ns_num // self.ns_den
+        if (time_scale == 'utc') == self.is_tai:
+            starts = np.array(self.leap_starts, np.int64) * NS
+            offsets = np.array(self.leap_offsets, np.int64) * NS
+            leaps = offsets[np.maximum(
+                np.searchsorted(starts, ns, 'right') - 1, 0)]
+            ns = ns - leaps if self.is_tai else ns + leaps
+        return ns.astype('datetime64[ns]')
+
+    #
+    # Ground receive times minus packet times, in ns
+    #
+    def ground_offsets(self, seconds, subseconds, recv_ns):
+        utc = self.to_datetime64(seconds, subseconds, 'utc')
+        return np.asarray(recv_ns, np.int64) - utc.astype(np.int64)
+
+
+#
+# Formats seconds since 1970 (UTC) for display
+#
+def format_utc(t):
+    whole = int(t // 1)
+    return f'{time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(whole))}' \
+           f'.{int((t - whole) * 1000000):06d}'
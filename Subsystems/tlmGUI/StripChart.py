@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Strip chart of one or more items of a telemetry packet
+#
+# Every plotted item keeps its samples in a fixed size ring buffer
+# (span * rate samples, allocated up front), so memory doesn't grow however
+# long the chart is open. A sample is the min and max of the packets
+# received until the next one is due, so packets coming faster than rate
+# still show their peaks and the buffer always holds the whole span. Each
+# redraw reduces the visible samples to a min/max pair per pixel column,
+# so the cost of drawing depends on the width of the window rather than on
+# the number of samples.
+#
+# Opened by double clicking an item on a telemetry page, or:
+#   ~$ python3 StripChart.py --title="ES HK Tlm" --appid=0x800
+#       --file=cfe-es-hk-tlm.txt --item="Command Counter" --sub=...
+#
+
+import getopt
+import mmap
+import sys
+import time
+
+import numpy as np
+from PyQt5.QtCore import QPointF, Qt, QTimer
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt5.QtWidgets import QApplication, QDialog, QVBoxLayout, QWidget
+
+from GenericTelemetry import GTTlmReceiver
+from Metrics import start_metrics
+from Profiling import start_profiling, timed
+from TelemetryConversions import compile_packet
+from TelemetryDefinitions import load_items
+
+import getpass
+
+COLORS = ('#1f77b4', '#d62728', '#2ca02c', '#ff7f0e', '#9467bd', '#8c564b')
+MARGIN = 60
+REDRAW_MS = 50
+
+
+class RingBuffer:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = np.empty(capacity)
+        self.lows = np.empty(capacity)
+        self.highs = np.empty(capacity)
+        self.head = 0
+        self.count = 0
+        # Index of the last sample
+        self.last = 0
+
+    def append(self, t, value):
+        self.times[self.head] = t
+        self.lows[self.head] = self.highs[self.head] = value
+        self.last = self.head
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    #
+    # Adds a value to the last sample
+    #
+    def fold(self, value):
+        if value < self.lows[self.last]:
+            self.lows[self.last] = value
+        elif value > self.highs[self.last]:
+            self.highs[self.last] = value
+
+    #
+    # Returns the samples, oldest first, as one or two (times, lows, highs)
+    # views of the buffer (no copy)
+    #
+    def segments(self):
+        if self.count < self.capacity:
+            return [(self.times[:self.count], self.lows[:self.count],
+                     self.highs[:self.count])]
+        return [(self.times[self.head:], self.lows[self.head:],
+                 self.highs[self.head:]),
+                (self.times[:self.head], self.lows[:self.head],
+                 self.highs[:self.head])]
+
+
+#
+# Reduces time ordered samples to the min and max of each of width columns
+# between t0 and t1. Returns (columns, mins, maxs) for the non empty columns.
+#
+def minmax_decimate(times, lows, highs, t0, t1, width):
+    edges = np.searchsorted(times, np.linspace(t0, t1, width + 1))
+    first, last = edges[0], edges[-1]
+    if first == last:
+        return np.empty(0, int), np.empty(0), np.empty(0)
+    starts = edges[:-1]
+    columns = np.flatnonzero(edges[1:] > starts)
+    idx = starts[columns] - first
+    return columns, np.fmin.reduceat(lows[first:last], idx), \
+        np.fmax.reduceat(highs[first:last], idx)
+
+
+class ChartWidget(QWidget):
+
+    def __init__(self, names, span):
+        super().__init__()
+        self.names = names
+        self.span = span
+        self.buffers = []
+        self.setMinimumSize(640, 320)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        width = max(self.width() - 2 * MARGIN, 1)
+        height = max(self.height() - 2 * MARGIN, 1)
+        t1 = time.monotonic()
+        t0 = t1 - self.span
+
+        traces = []
+        for buffer in self.buffers:
+            parts = [minmax_decimate(*segment, t0, t1, width)
+                     for segment in buffer.segments()]
+            traces.append(tuple(np.concatenate(p) for p in zip(*parts)))
+        lows = [t[1].min() for t in traces if t[1].size]
+        highs = [t[2].max() for t in traces if t[2].size]
+
+        painter.setPen(Qt.black)
+        painter.drawRect(MARGIN, MARGIN, width, height)
+        painter.drawText(MARGIN, self.height() - MARGIN // 2,
+                         f'-{self.span:g} s')
+        painter.drawText(MARGIN + width - 20, self.height() - MARGIN // 2,
+                         'now')
+        if not lows:
+            painter.drawText(MARGIN + 10, MARGIN + 20, 'Waiting for data')
+            return
+        y_min, y_max = min(lows), max(highs)
+        if y_max == y_min:
+            y_min, y_max = y_min - 1, y_max + 1
+        painter.drawText(4, MARGIN + 10, f'{y_max:.6g}')
+        painter.drawText(4, MARGIN + height, f'{y_min:.6g}')
+        scale = height / (y_max - y_min)
+
+        for i, (columns, mins, maxs) in enumerate(traces):
+            color = QColor(COLORS[i % len(COLORS)])
+            painter.setPen(QPen(color, 1))
+            painter.drawText(MARGIN + 10 + 160 * i, MARGIN - 10,
+                             self.names[i])
+            if not columns.size:
+                continue
+            # Zig-zag through each column's min and max
+            xs = np.repeat(columns + MARGIN, 2)
+            ys = np.empty(xs.size)
+            ys[0::2] = MARGIN + (y_max - mins) * scale
+            ys[1::2] = MARGIN + (y_max - maxs) * scale
+            painter.drawPolyline(
+                QPolygonF([QPointF(x, y) for x, y in zip(xs, ys)]))
+
+
+class StripChart(QDialog):
+
+    def __init__(self, items, indexes, span, rate, endian):
+        super().__init__()
+        self.indexes = indexes
+        self.convert = compile_packet(items, endian, 'strip chart',
+                                      only=indexes)
+        self.chart = ChartWidget([items[i].desc for i in indexes], span)
+        self.chart.buffers = [RingBuffer(int(span * rate)) for _ in indexes]
+        # Seconds between samples, and when the next one is taken
+        self.interval = 1 / rate
+        self.next_sample = 0.0
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.chart)
+        self.resize(900, 420)
+
+        with open(f"/tmp/OffsetData-{getpass.getuser()}", "r+b") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.chart.update)
+        self.timer.start(REDRAW_MS)
+
+    # Start the telemetry receiver (see GTTlmReceiver class)
+    def init_tlm_receiver(self, subscr):
+        self.setWindowTitle(f"{page_title} for: {subscr}")
+        self.thread = GTTlmReceiver(subscr, f"{page_title} strip chart")
+        self.thread.gt_signal_tlm_datagram.connect(self.process_pending_datagrams)
+        self.thread.finished.connect(self.thread.deleteLater)
+        self.thread.start()
+
+    @timed('render')
+    def process_pending_datagrams(self, datagram, stamp):
+        now = time.monotonic()
+        tlm_offset = 0
+        try:
+            tlm_offset = self.mm[0]
+        except ValueError:
+            pass
+        values = self.convert(datagram, tlm_offset)
+        if values is None:
+            return
+        if now < self.next_sample:
+            # Before the next sample is due: part of the last one
+            for buffer, index in zip(self.chart.buffers, self.indexes):
+                buffer.fold(values[index])
+            return
+        # At most rate samples per second on average, whatever the gaps
+        self.next_sample = max(self.next_sample, now - self.interval) + \
+            self.interval
+        for buffer, index in zip(self.chart.buffers, self.indexes):
+            buffer.append(now, values[index])
+        self.thread.latency.displayed(stamp)
+
+    # Reimplements closeEvent
+    # to properly quit the thread
+    # and close the window
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.thread.runs = False
+        self.thread.wait(2000)
+        self.thread.latency.close()
+        self.mm.close()
+        super().closeEvent(event)
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Must specify --title=\"<page name>\" --appid=<packet_app_id(hex)> "
+           "--file=<tlm_def_file> --item=\"<item>\" [--item=...] "
+           "--endian=<endian(L|B)> --sub=<subscription> "
+           "[--span=<seconds>] [--rate=<max samples per second>]\n\n"
+           "example: --title=\"ES HK Tlm\" --appid=0x800 "
+           "--file=cfe-es-hk-tlm.txt --item=\"Command Counter\" "
+           "--sub=GroundSystem.Spacecraft1.TelemetryPackets.0x800"))
+
+
+#
+# Main
+#
+if __name__ == '__main__':
+    start_profiling('StripChart')
+    start_metrics('StripChart')
+    page_title = "Strip Chart"
+    tlm_def_file = ""
+    item_names = []
+    endian = "L"
+    subscription = ""
+    chart_span = 3600.0
+    chart_rate = 50.0
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "ht:a:f:i:e:s:",
+            ["help", "title=", "appid=", "file=", "item=", "endian=", "sub=",
+             "span=", "rate="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-t", "--title"):
+            page_title = arg
+        elif opt in ("-f", "--file"):
+            tlm_def_file = arg
+        elif opt in ("-i", "--item"):
+            item_names.append(arg)
+        elif opt in ("-e", "--endian"):
+            endian = arg
+        elif opt in ("-s", "--sub"):
+            subscription = arg
+        elif opt == "--span":
+            chart_span = float(arg)
+        elif opt == "--rate":
+            chart_rate = float(arg)
+
+    if not (tlm_def_file and item_names and subscription):
+        usage()
+        sys.exit(2)
+
+    tlm_items = load_items(tlm_def_file)
+    tlm_names = [item.desc for item in tlm_items]
+    try:
+        item_indexes = [tlm_names.index(name) for name in item_names]
+    except ValueError as e:
+        print("ERROR: item not found in", tlm_def_file, e)
+        sys.exit(2)
+
+    app = QApplication(sys.argv)
+    chart = StripChart(tlm_items, item_indexes, chart_span, chart_rate,
+                       endian)
+    chart.show()
+    chart.raise_()
+    chart.init_tlm_receiver(subscription)
+
+    sys.exit(app.exec_())
@@ -0,0 +1,340 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+##############################################################################
+# Description:
+#	TelemetryConversions.py turns raw telemetry values into engineering
+# units. Three display types in the telemetry definition files take their
+# arguments from columns 6 and up:
+#
+#	Poly - polynomial, columns are the coefficients c0, c1, c2, ...
+#	       Battery Volts, 40, 2, H, Poly, 0.0, 0.01
+#	Tab  - lookup table of raw:value points, linearly interpolated and
+#	       clamped at both ends
+#	       Panel Temp, 42, 2, H, Tab, 0:-40.0, 2048:20.0, 4095:125.0
+#	Der  - derived item, an expression over other items in {}. Offset and
+#	       size are 0; the data type is ignored.
+#	       Bus Power, 0, 0, d, Der, {Battery Volts} * {Battery Amps}
+#
+# Items referenced by a Der expression are used in engineering units. A Der
+# item may only reference items that aren't derived, or derived items that
+# come before it in the file.
+#
+#	compile_packet() builds one function per packet definition that unpacks
+# and converts every item of a packet; compile_arrays() builds the NumPy
+# equivalent that converts any number of packets in one evaluation.
+#
+##############################################################################
+
+import ast
+import math
+import re
+from bisect import bisect_right
+from struct import Struct
+
+from Profiling import timed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CONVERSION_TYPES = ('Poly', 'Tab', 'Der')
+
+REF_RE = re.compile(r'\{([^{}]+)\}')
+
+# Functions allowed in Der expressions: (per packet, NumPy)
+FUNCTIONS = {
+    'abs': (abs, 'abs'),
+    'min': (min, 'minimum'),
+    'max': (max, 'maximum'),
+    'sqrt': (math.sqrt, 'sqrt'),
+    'exp': (math.exp, 'exp'),
+    'log': (math.log, 'log'),
+    'log10': (math.log10, 'log10'),
+    'sin': (math.sin, 'sin'),
+    'cos': (math.cos, 'cos'),
+    'tan': (math.tan, 'tan'),
+    'atan2': (math.atan2, 'arctan2'),
+    'floor': (math.floor, 'floor'),
+    'ceil': (math.ceil, 'ceil')
+}
+
+EXPR_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name,
+              ast.Load, ast.Call, ast.Add, ast.Sub, ast.Mult, ast.Div,
+              ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd)
+
+# python struct type: NumPy type
+NUMPY_TYPES = {
+    'b': 'i1', 'B': 'u1', '?': '?',
+    'h': 'i2', 'H': 'u2',
+    'i': 'i4', 'I': 'u4', 'l': 'i4', 'L': 'u4',
+    'q': 'i8', 'Q': 'u8',
+    'f': 'f4', 'd': 'f8'
+}
+
+
+def poly_coeffs(item):
+    try:
+        coeffs = [float(c) for c in item.args]
+    except ValueError:
+        raise ValueError(f'{item.desc}: Poly coefficients must be numbers')
+    if not coeffs:
+        raise ValueError(f'{item.desc}: Poly without coefficients')
+    return coeffs
+
+
+#
+# Returns the (raw, value) points of a Tab item
+#
+def table_points(item):
+    try:
+        points = [tuple(float(x) for x in arg.split(':'))
+                  for arg in item.args]
+    except ValueError:
+        points = []
+    if len(points) < 2 or any(len(p) != 2 for p in points):
+        raise ValueError(f'{item.desc}: Tab needs at least two raw:value '
+                         'points')
+    raws = [p[0] for p in points]
+    if any(a >= b for a, b in zip(raws, raws[1:])):
+        raise ValueError(f'{item.desc}: Tab raw values must be increasing')
+    return raws, [p[1] for p in points]
+
+
+#
+# Returns a function interpolating the points of a Tab item
+#
+def make_table(raws, values):
+    slopes = [(v1 - v0) / (r1 - r0) for r0, r1, v0, v1 in
+              zip(raws, raws[1:], values, values[1:])]
+    last = len(slopes) - 1
+
+    def convert(raw):
+        if raw <= raws[0]:
+            return values[0]
+        if raw >= raws[-1]:
+            return values[-1]
+        i = min(bisect_right(raws, raw) - 1, last)
+        return values[i] + (raw - raws[i]) * slopes[i]
+    return convert
+
+
+#
+# Replaces {item} references in a Der expression by v<index> and checks
+# that only numbers, arithmetic and FUNCTIONS are used
+#
+def expression_source(item, index, names, items):
+    # csv splits expressions such as max({a}, {b}) into several columns
+    text = ', '.join(item.args)
+    if not text:
+        raise ValueError(f'{item.desc}: Der without an expression')
+
+    def reference(match):
+        name = match.group(1).strip()
+        ref = names.get(name)
+        if ref is None:
+            raise ValueError(f'{item.desc}: unknown item {name}')
+        if items[ref].display == 'Der' and ref >= index:
+            raise ValueError(f'{item.desc}: {name} must be defined before '
+                             'it is used')
+        if items[ref].display in ('Str', 'Enm'):
+            raise ValueError(f'{item.desc}: {name} is not numeric')
+        return f'v{ref}'
+    source = REF_RE.sub(reference, text)
+
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError:
+        raise ValueError(f'{item.desc}: invalid expression {text}')
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPR_NODES):
+            raise ValueError(f'{item.desc}: {type(node).__name__} not '
+                             f'allowed in {text}')
+        if isinstance(node, ast.Constant) and \
+                not isinstance(node.value, (int, float)):
+            raise ValueError(f'{item.desc}: invalid constant in {text}')
+        if isinstance(node, ast.Call) and (
+                not isinstance(node.func, ast.Name) or node.keywords or
+                node.func.id not in FUNCTIONS):
+            raise ValueError(f'{item.desc}: unknown function in {text}')
+        if isinstance(node, ast.Name) and node.id not in FUNCTIONS and \
+                not re.fullmatch(r'v\d+', node.id):
+            raise ValueError(f'{item.desc}: unknown name {node.id} in {text}'
+                             ' (items are referenced as {name})')
+    return source
+
+
+def _horner(coeffs, var):
+    source = repr(coeffs[-1])
+    for coeff in reversed(coeffs[:-1]):
+        source = f'{coeff!r} + {var} * ({source})'
+    return source
+
+
+#
+# Checks the conversions of a definition file; returns a list of errors
+#
+def check_conversions(items):
+    errors = []
+    names = {item.desc: i for i, item in enumerate(items)}
+    for i, item in enumerate(items):
+        try:
+            if item.display == 'Poly':
+                poly_coeffs(item)
+            elif item.display == 'Tab':
+                table_points(item)
+            elif item.display == 'Der':
+                expression_source(item, i, names, items)
+        except ValueError as e:
+            errors.append(str(e))
+        if item.display in ('Poly', 'Tab') and item.data_type.endswith('s'):
+            errors.append(f'{item.desc}: {item.display} needs a numeric type')
+    return errors
+
+
+#
+# Compiles a packet definition into convert(datagram, offset), which
+# returns a tuple with the value of every item (engineering units for
+# Poly/Tab/Der items, raw values otherwise), or None if the datagram is
+# too short. offset is added to every item offset. If only is given, just
+# those item indexes (and the items their expressions use) are decoded; the
+# others are None. If partial is set, a datagram too short for every item
+# still has the items that fit in it decoded; the others are None (nan for
+# the Der items using them).
+#
+def compile_packet(items, endian='L', name='packet', only=None,
+                   partial=False):
+    # Local import; TelemetryDefinitions imports this module
+    from TelemetryDefinitions import item_format
+
+    names = {item.desc: i for i, item in enumerate(items)}
+    needed = set(range(len(items)) if only is None else only)
+    pending = list(needed)
+    while pending:
+        item = items[pending.pop()]
+        if item.display == 'Der':
+            for ref in REF_RE.findall(', '.join(item.args)):
+                ref = names.get(ref.strip())
+                if ref is not None and ref not in needed:
+                    needed.add(ref)
+                    pending.append(ref)
+
+    env = {fn: funcs[0] for fn, funcs in FUNCTIONS.items()}
+    env['nan'] = math.nan
+    end = max([item.offset + item.size for i, item in enumerate(items)
+               if item.display != 'Der' and i in needed] + [0])
+    lines = ['def convert(datagram, offset):',
+             f'    if len(datagram) < offset + {end}:',
+             '        return short(datagram, offset)' if partial else
+             '        return None']
+    short = ['def short(datagram, offset):',
+             '    size = len(datagram) - offset']
+    for i, item in enumerate(items):
+        if i not in needed:
+            continue
+        if item.display == 'Der':
+            for body in lines, short:
+                body += ['    try:',
+                         f'        v{i} = '
+                         f'{expression_source(item, i, names, items)}',
+                         # TypeError: uses an item that didn't fit (short)
+                         '    except (ArithmeticError, TypeError, ValueError):',
+                         f'        v{i} = nan']
+            continue
+        env[f's{i}'] = Struct(item_format(item, endian))
+        unpack = [f'v{i}, = s{i}.unpack_from(datagram, '
+                  f'offset + {item.offset})']
+        if item.display == 'Poly':
+            unpack.append(f'v{i} = {_horner(poly_coeffs(item), f"v{i}")}')
+        elif item.display == 'Tab':
+            env[f't{i}'] = make_table(*table_points(item))
+            unpack.append(f'v{i} = t{i}(v{i})')
+        lines += [f'    {line}' for line in unpack]
+        short += [f'    if size < {item.offset + item.size}:',
+                  f'        v{i} = None',
+                  '    else:'] + [f'        {line}' for line in unpack]
+    values = ''.join(f'v{i}, ' if i in needed else 'None, '
+                     for i in range(len(items)))
+    lines.append(f'    return ({values})')
+    short.append(f'    return ({values})')
+    if partial:
+        lines += short
+
+    exec(compile('\n'.join(lines), f'<{name}>', 'exec'), env)
+    return timed('decode')(env['convert'])
+
+
+#
+# NumPy version of compile_packet(). Returns convert(data, packet_len,
+# offset=0) where data is a buffer of equal length packets (or an array of
+# shape (packets, packet_len)); the result is a dict of one array per item.
+# Requires NumPy.
+#
+def compile_arrays(items, endian='L'):
+    if np is None:
+        raise ImportError('NumPy is required for array conversions')
+    from TelemetryDefinitions import item_format
+
+    byte_order = '<' if endian.upper() == 'L' else '>'
+    names = {item.desc: i for i, item in enumerate(items)}
+    env = {fn: getattr(np, funcs[1]) for fn, funcs in FUNCTIONS.items()}
+
+    fields, steps = {}, []
+    for i, item in enumerate(items):
+        if item.display == 'Der':
+            steps.append((i, compile(expression_source(item, i, names, items),
+                                     item.desc, 'eval')))
+            continue
+        fmt = item_format(item, endian)
+        fields[f'v{i}'] = (f'S{item.size}' if fmt.endswith('s') else
+                           byte_order + NUMPY_TYPES[fmt[-1]], item.offset)
+        if item.display == 'Poly':
+            steps.append((i, np.polynomial.polynomial.Polynomial(
+                poly_coeffs(item))))
+        elif item.display == 'Tab':
+            raws, values = table_points(item)
+            steps.append((i, lambda x, r=np.array(raws), v=np.array(values):
+                          np.interp(x, r, v)))
+    end = max([offset + np.dtype(dt).itemsize
+               for dt, offset in fields.values()] + [0])
+
+    def convert(data, packet_len, offset=0):
+        if packet_len < end + offset:
+            raise ValueError(f'Packets of {packet_len} bytes are shorter '
+                             f'than the definition ({end + offset} bytes)')
+        dtype = np.dtype({
+            'names': list(fields),
+            'formats': [dt for dt, _ in fields.values()],
+            'offsets': [off + offset for _, off in fields.values()],
+            'itemsize': packet_len
+        })
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+        raw = np.frombuffer(data, dtype=dtype)
+        values = {name: raw[name] for name in fields}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, step in steps:
+                if callable(step):
+                    values[f'v{i}'] = step(values[f'v{i}'])
+                else:
+                    values[f'v{i}'] = np.broadcast_to(
+                        eval(step, {'__builtins__': {}}, {**env, **values}),
+                        raw.shape)
+        return {item.desc: values[f'v{i}'] for i, item in enumerate(items)}
+    return convert
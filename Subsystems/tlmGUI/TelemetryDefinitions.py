@@ -0,0 +1,461 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+##############################################################################
+# Description:
+#	TelemetryDefinitions.py is the one place the telemetry definition files
+# (*-tlm.txt) and telemetry-pages.txt are read. Both are parsed into typed
+# records (TlmItem, TlmPage), validated, and compiled into a binary cache
+# that is memory-mapped by the telemetry pages.
+#
+#	Each source file is recorded in the cache with its mtime, size and
+# SHA-256. A page only stats its own definition file; the cache is rebuilt
+# when the contents of a source file no longer match.
+#
+# Usage:
+#	~$ python3 TelemetryDefinitions.py
+#	Validates every definition file, reports problems and rebuilds the
+#	cache. Exits non-zero if any errors were found.
+#
+##############################################################################
+
+import csv
+import glob
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+from TelemetryConversions import CONVERSION_TYPES, check_conversions
+
+# ../cFS/tools/cFS-GroundSystem/Subsystems/tlmGUI
+ROOTDIR = Path(__file__).resolve().parent
+CACHE_FILE = f'{ROOTDIR}/.tlm-defs-cache.bin'
+PAGES_FILE = 'telemetry-pages.txt'
+
+# Largest datagram the RoutingService receives
+MAX_PACKET_SIZE = 4096
+
+DISPLAY_TYPES = ('Dec', 'Hex', 'Enm', 'Str') + CONVERSION_TYPES
+
+# Limits given as key=value in the columns after the display type; other
+# key=value columns (e.g. an Enm label MODE=SAFE) are ordinary arguments
+LIMIT_KEYS = ('red_low', 'yellow_low', 'yellow_high', 'red_high',
+              'yellow_delta', 'red_delta')
+LIMIT_RE = re.compile(r'^(\w+)\s*=\s*(.*)$')
+
+MAGIC = b'CFSTLMDB'
+FORMAT_VERSION = 3
+
+HEADER = struct.Struct('<8sHH10I')
+FILE_REC = struct.Struct('<IqQ32sII')
+ITEM_REC = struct.Struct('<IIIIIII')
+PAGE_REC = struct.Struct('<IIII')
+U32 = struct.Struct('<I')
+
+#
+# desc       - data item description
+# offset     - offset of the item in the packet, without the header offset
+# size       - length of the item in bytes
+# data_type  - python struct type (e.g. I, H, s, 64s)
+# display    - Dec, Hex, Enm, Str, or a conversion (Poly, Tab, Der; see
+#              TelemetryConversions.py)
+# args       - display strings for enumerated values 0, 1, 2, ... of Enm
+#              items, or the arguments of a conversion
+# limits     - (key, value) pairs, key is one of LIMIT_KEYS
+#
+TlmItem = namedtuple('TlmItem',
+                     'desc, offset, size, data_type, display, args, limits',
+                     defaults=((),))
+TlmPage = namedtuple('TlmPage', 'desc, tlm_class, appid, def_file')
+
+
+#
+# Returns the struct format used to unpack an item
+#
+def item_format(item, endian='L'):
+    if item.data_type.lower().endswith('s'):
+        return f'{item.size}s'
+    return f"{'<' if endian.upper() == 'L' else '>'}{item.data_type}"
+
+
+def _rows(def_file):
+    with open(def_file) as def_obj:
+        for line_num, row in enumerate(
+                csv.reader(def_obj, skipinitialspace=True), start=1):
+            if row and row[0].strip() and not row[0].startswith('#'):
+                yield line_num, [col.strip() for col in row]
+
+
+#
+# Splits the columns after the display type into (args, limits)
+#
+def split_columns(display, columns):
+    args, limits = [], []
+    for col in columns:
+        limit = LIMIT_RE.match(col)
+        if limit and limit.group(1) in LIMIT_KEYS:
+            limits.append((limit.group(1), float(limit.group(2))))
+        elif display == 'Enm' or display in CONVERSION_TYPES:
+            args.append(col)
+    # Any number of arguments; trailing NULLs are padding
+    while args and args[-1] == 'NULL':
+        args.pop()
+    return tuple(args), tuple(limits)
+
+
+def _limit_columns(item):
+    return tuple(f'{key}={value!r}' for key, value in item.limits)
+
+
+#
+# Parses a telemetry definition file into TlmItems
+#
+def parse_item_file(def_file):
+    items = []
+    for line_num, row in _rows(def_file):
+        try:
+            items.append(
+                TlmItem(row[0], int(row[1]), int(row[2]), row[3], row[4],
+                        *split_columns(row[4], row[5:])))
+        except (IndexError, ValueError) as e:
+            raise ValueError(f'{def_file}:{line_num}: {e}') from e
+    return items
+
+
+#
+# Parses telemetry-pages.txt into TlmPages
+#
+def parse_page_file(pages_file):
+    pages = []
+    for line_num, row in _rows(pages_file):
+        try:
+            pages.append(TlmPage(row[0], row[1], int(row[2], 16), row[3]))
+        except (IndexError, ValueError) as e:
+            raise ValueError(f'{pages_file}:{line_num}: {e}') from e
+    return pages
+
+
+#
+# Checks a definition file; returns (errors, warnings) as lists of strings
+#
+def validate_items(def_file, items):
+    errors, warnings = [], []
+    name = os.path.basename(def_file)
+    for item in items:
+        where = f'{name}: {item.desc}'
+        if item.display == 'Der':
+            continue  # Not read from the packet
+        try:
+            type_size = struct.calcsize(item_format(item))
+        except struct.error:
+            errors.append(f'{where}: unknown data type {item.data_type}')
+            continue
+        if type_size != item.size:
+            errors.append(f'{where}: size {item.size} does not match '
+                          f'type {item.data_type} ({type_size} bytes)')
+        if item.display not in DISPLAY_TYPES:
+            errors.append(f'{where}: unknown display type {item.display}')
+        elif item.display == 'Str' and not item.data_type.endswith('s'):
+            errors.append(f'{where}: Str display needs an s data type')
+        elif item.display == 'Enm' and not item.args:
+            errors.append(f'{where}: Enm display without enumerated values')
+        if item.offset + item.size > MAX_PACKET_SIZE:
+            errors.append(f'{where}: ends at byte {item.offset + item.size}, '
+                          f'past the {MAX_PACKET_SIZE} byte packet limit')
+
+    errors += [f'{name}: {error}' for error in check_conversions(items)]
+
+    for item in items:
+        if not item.limits:
+            continue
+        where = f'{name}: {item.desc}'
+        limits = dict(item.limits)
+        if item.display == 'Str':
+            errors.append(f'{where}: limits on a Str item')
+        levels = [limits[key] for key in LIMIT_KEYS[:4] if key in limits]
+        if levels != sorted(levels):
+            errors.append(f'{where}: limits must be ordered red_low <= '
+                          'yellow_low <= yellow_high <= red_high')
+        if any(limits.get(key, 1) <= 0 for key in LIMIT_KEYS[4:]) or \
+                limits.get('yellow_delta', 0) > limits.get('red_delta',
+                                                           float('inf')):
+            errors.append(f'{where}: delta limits must be positive and '
+                          'yellow_delta <= red_delta')
+
+    ordered = sorted((item for item in items if item.display != 'Der'),
+                     key=lambda item: (item.offset, item.size))
+    for prev, item in zip(ordered, ordered[1:]):
+        if item.offset < prev.offset + prev.size:
+            warnings.append(f'{name}: {item.desc} (offset {item.offset}) '
+                            f'overlaps {prev.desc} (offset {prev.offset}, '
+                            f'size {prev.size})')
+    return errors, warnings
+
+
+def validate_pages(pages, root=ROOTDIR):
+    errors = []
+    for page in pages:
+        if not os.path.exists(f'{root}/{page.tlm_class}'):
+            errors.append(f'{PAGES_FILE}: {page.desc}: no such page class '
+                          f'{page.tlm_class}')
+        if page.def_file != 'null' and not os.path.exists(
+                f'{root}/{page.def_file}'):
+            errors.append(f'{PAGES_FILE}: {page.desc}: no such definition '
+                          f'file {page.def_file}')
+    return errors
+
+
+def _file_info(path):
+    stat = os.stat(path)
+    with open(path, 'rb') as src_obj:
+        digest = hashlib.sha256(src_obj.read()).digest()
+    return stat.st_mtime_ns, stat.st_size, digest
+
+
+def source_files(root=ROOTDIR):
+    return [PAGES_FILE] + sorted(
+        os.path.basename(f) for f in glob.glob(f'{root}/*-tlm.txt'))
+
+
+#
+# Parses and validates every source file and writes the compiled cache.
+# Prints any warnings; raises ValueError, without writing the cache, if
+# any file has errors.
+#
+def compile_cache(root=ROOTDIR, cache_file=CACHE_FILE):
+    strings, string_ids = [], {}
+
+    def sid(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    files, items, args, pages = [], [], [], []
+    all_errors, all_warnings = [], []
+    for name in source_files(root):
+        path = f'{root}/{name}'
+        mtime, size, digest = _file_info(path)
+        try:
+            if name == PAGES_FILE:
+                file_pages = parse_page_file(path)
+                all_errors += validate_pages(file_pages, root)
+            else:
+                file_items = parse_item_file(path)
+                errors, warnings = validate_items(name, file_items)
+                all_errors += errors
+                all_warnings += warnings
+        except ValueError as e:
+            all_errors.append(str(e))
+            continue
+        if name == PAGES_FILE:
+            for page in file_pages:
+                pages.append((sid(page.desc), sid(page.tlm_class), page.appid,
+                              sid(page.def_file)))
+            files.append((sid(name), mtime, size, digest, 0, 0))
+            continue
+        files.append((sid(name), mtime, size, digest, len(items),
+                      len(file_items)))
+        for item in file_items:
+            items.append((sid(item.desc), item.offset, item.size,
+                          sid(item.data_type), sid(item.display), len(args),
+                          len(item.args) + len(item.limits)))
+            args.extend(sid(arg) for arg in item.args + _limit_columns(item))
+
+    for warning in all_warnings:
+        print('WARNING:', warning)
+    for error in all_errors:
+        print('ERROR:', error)
+    if all_errors:
+        raise ValueError('telemetry definitions have errors')
+
+    encoded = [s.encode() for s in strings]
+    offsets, pos = [], 0
+    for s in encoded:
+        offsets.append(pos)
+        pos += len(s)
+    offsets.append(pos)
+
+    sections = [
+        (b''.join(FILE_REC.pack(*f) for f in files), len(files)),
+        (b''.join(ITEM_REC.pack(*i) for i in items), len(items)),
+        (b''.join(U32.pack(a) for a in args), len(args)),
+        (b''.join(PAGE_REC.pack(*p) for p in pages), len(pages)),
+        (struct.pack(f'<{len(offsets)}I', *offsets) + b''.join(encoded),
+         len(strings)),
+    ]
+    body, table = bytearray(), []
+    for data, count in sections:
+        body.extend(bytes(-(HEADER.size + len(body)) % 8))
+        table.extend((HEADER.size + len(body), count))
+        body.extend(data)
+
+    # Write to a temporary file first so readers never see a partial file
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as cache_obj:
+        cache_obj.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, *table))
+        cache_obj.write(body)
+    os.replace(tmp_file, cache_file)
+
+
+#
+# Read-only, memory-mapped view of the compiled cache
+#
+class TelemetryDefinitionCache:
+
+    def __init__(self, cache_file=CACHE_FILE):
+        with open(cache_file, 'rb') as cache_obj:
+            self.mm = mmap.mmap(cache_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fields = HEADER.unpack_from(self.mm, 0)
+        except struct.error:
+            self.mm.close()
+            raise ValueError(f'{cache_file} is not a telemetry cache')
+        if fields[0] != MAGIC or fields[1] != FORMAT_VERSION:
+            self.mm.close()
+            raise ValueError(f'{cache_file} has an unsupported format')
+        (self.files_off, self.n_files, self.items_off, _, self.args_off, _,
+         self.pages_off, self.n_pages, str_off, n_strings) = fields[3:]
+        self.str_offsets = str_off
+        self.str_data = str_off + 4 * (n_strings + 1)
+        self.file_index = {
+            self.string(FILE_REC.unpack_from(
+                self.mm, self.files_off + FILE_REC.size * i)[0]): i
+            for i in range(self.n_files)
+        }
+
+    def close(self):
+        self.mm.close()
+
+    def string(self, sid):
+        start, end = struct.unpack_from('<II', self.mm,
+                                        self.str_offsets + 4 * sid)
+        return self.mm[self.str_data + start:self.str_data + end].decode()
+
+    def _file(self, name):
+        idx = self.file_index.get(name)
+        if idx is None:
+            return None
+        return FILE_REC.unpack_from(self.mm, self.files_off + FILE_REC.size * idx)
+
+    #
+    # True if the cached copy of a source file is current
+    #
+    def is_current(self, name, root=ROOTDIR):
+        rec = self._file(name)
+        if rec is None:
+            return False
+        path = f'{root}/{name}'
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == (rec[1], rec[2]):
+            return True
+        # Touched but maybe not changed: fall back to the content hash
+        return stat.st_size == rec[2] and _file_info(path)[2] == rec[3]
+
+    def items(self, name):
+        rec = self._file(name)
+        if rec is None:
+            return None
+        items = []
+        for i in range(rec[4], rec[4] + rec[5]):
+            desc, offset, size, data_type, display, first_arg, n_args = \
+                ITEM_REC.unpack_from(self.mm, self.items_off + ITEM_REC.size * i)
+            display = self.string(display)
+            columns = [
+                self.string(U32.unpack_from(self.mm, self.args_off + 4 * a)[0])
+                for a in range(first_arg, first_arg + n_args)]
+            items.append(TlmItem(self.string(desc), offset, size,
+                                 self.string(data_type), display,
+                                 *split_columns(display, columns)))
+        return items
+
+    def pages(self):
+        pages = []
+        for i in range(self.n_pages):
+            desc, tlm_class, appid, def_file = PAGE_REC.unpack_from(
+                self.mm, self.pages_off + PAGE_REC.size * i)
+            pages.append(TlmPage(self.string(desc), self.string(tlm_class),
+                                 appid, self.string(def_file)))
+        return pages
+
+
+#
+# Opens the cache, rebuilding it first if name isn't current
+#
+def _open_cache(name, root=ROOTDIR, cache_file=CACHE_FILE):
+    try:
+        cache = TelemetryDefinitionCache(cache_file)
+        if cache.is_current(name, root):
+            return cache
+        cache.close()
+    except (IOError, ValueError):
+        pass
+    try:
+        compile_cache(root, cache_file)
+        return TelemetryDefinitionCache(cache_file)
+    except (IOError, ValueError) as e:
+        print("Couldn't build telemetry definition cache:", e)
+        return None
+
+
+#
+# Returns the TlmItems of a definition file (relative to ROOTDIR)
+#
+def load_items(def_file, root=ROOTDIR):
+    name = os.path.basename(def_file)
+    if os.path.dirname(def_file) or not name.endswith('-tlm.txt'):
+        # Not one of the cached files
+        return parse_item_file(f'{root}/{def_file}')
+    cache = _open_cache(name, root)
+    if cache is None:
+        return parse_item_file(f'{root}/{def_file}')
+    items = cache.items(name)
+    cache.close()
+    return items
+
+
+#
+# Returns the TlmPages of telemetry-pages.txt
+#
+def load_pages(root=ROOTDIR):
+    cache = _open_cache(PAGES_FILE, root)
+    if cache is None:
+        return parse_page_file(f'{root}/{PAGES_FILE}')
+    pages = cache.pages()
+    cache.close()
+    return pages
+
+
+#
+# Main
+#
+if __name__ == '__main__':
+    try:
+        compile_cache()
+        print(f'Wrote {CACHE_FILE}')
+    except ValueError as e:
+        print("Couldn't build telemetry definition cache:", e)
+        sys.exit(1)
@@ -18,7 +18,6 @@
 #  limitations under the License.
 #
 
-import csv
 import getopt
 import shlex
 import subprocess
@@ -31,6 +30,10 @@ from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtWidgets import (QApplication, QDialog, QHeaderView, QPushButton,
                              QTableWidgetItem)
 
+from LatencyHistogram import LatencyRecorder
+from Metrics import start_metrics
+from Profiling import start_profiling, timed
+from TelemetryDefinitions import load_pages
 from UiTelemetrysystemdialog import UiTelemetrysystemdialog
 
 import getpass
@@ -97,7 +100,8 @@ class TelemetrySystem(QDialog, UiTelemetrysystemdialog):
     # This method processes packets.
     # Called when the TelemetryReceiver receives a message/packet
     #
-    def process_pending_datagrams(self, datagram):
+    @timed('render')
+    def process_pending_datagrams(self, datagram, stamp):
         #
         # Show number of packets received
         #
@@ -114,23 +118,23 @@ class TelemetrySystem(QDialog, UiTelemetrysystemdialog):
         # Uncomment the next two lines to debug
         # print("Packet ID =", hex(stream_id[0]))
         # self.dumpPacket(datagram)
-        for l in range(self.tbl_tlm_sys.rowCount()):
-            if stream_id[0] == tlm_page_appid[l]:
-                # send_host = "127.0.0.1"
-                # send_port = tlmPagePort[l]
-                # sendSocket.sendto(datagram, (send_host, send_port))
-
-                tlm_page_count[l] += 1
-                # I wish I knew a better way to update the count field
-                # in the GUI. Maybe store a pointer to the field in the gui
-                self.tbl_tlm_sys.item(l, 2).setText(str(tlm_page_count[l]))
-
-                # Unclear why line 15 is skipped. Removing for now, need
-                # to evaluate long term (lbleier 06/01/2020)
-                # if l < 15:
-                #     self.tblTlmSys.item(l, 2).setText(str(tlmPageCount[l]))
-                # else:
-                #     self.tblTlmSys.item(l + 1, 2).setText(str(tlmPageCount[l]))
+        for l in tlm_page_rows.get(stream_id[0], ()):
+            # send_host = "127.0.0.1"
+            # send_port = tlmPagePort[l]
+            # sendSocket.sendto(datagram, (send_host, send_port))
+
+            tlm_page_count[l] += 1
+            # I wish I knew a better way to update the count field
+            # in the GUI. Maybe store a pointer to the field in the gui
+            self.tbl_tlm_sys.item(l, 2).setText(str(tlm_page_count[l]))
+
+            # Unclear why line 15 is skipped. Removing for now, need
+            # to evaluate long term (lbleier 06/01/2020)
+            # if l < 15:
+            #     self.tblTlmSys.item(l, 2).setText(str(tlmPageCount[l]))
+            # else:
+            #     self.tblTlmSys.item(l + 1, 2).setText(str(tlmPageCount[l]))
+        self.thread.latency.displayed(stamp)
 
     # Reimplements closeEvent
     # to properly quit the thread
@@ -138,17 +142,21 @@ class TelemetrySystem(QDialog, UiTelemetrysystemdialog):
     def closeEvent(self, event):
         self.thread.runs = False
         self.thread.wait(2000)
+        self.thread.latency.close()
         super().closeEvent(event)
 
 
 # Subscribes and receives zeroMQ messages
 class TSTlmReceiver(QThread):
     # Setup signal to communicate with front-end GUI
-    ts_signal_tlm_datagram = pyqtSignal(bytes)
+    # (packet, receive time)
+    ts_signal_tlm_datagram = pyqtSignal(bytes, object)
 
     def __init__(self, subscr):
         super().__init__()
         self.runs = True
+        # Latency histograms (see LatencyHistogram.py)
+        self.latency = LatencyRecorder(f"Telemetry System {subscr}")
 
         # Init zeroMQ
         context = zmq.Context()
@@ -159,15 +167,19 @@ class TSTlmReceiver(QThread):
     def run(self):
         while self.runs:
             # Receive and read envelope with address
-            _, datagram = self.subscriber.recv_multipart()
+            parts = self.subscriber.recv_multipart()
             # Send signal with received packet to front-end/GUI
-            self.ts_signal_tlm_datagram.emit(datagram)
+            self.ts_signal_tlm_datagram.emit(parts[1],
+                                             self.latency.received(parts))
 
 
 #
 # Main
 #
 if __name__ == '__main__':
+    start_profiling('TelemetrySystem')
+    start_metrics('TelemetrySystem')
+
     #
     # Init the QT application and the telemetry dialog class
     #
@@ -178,7 +190,6 @@ if __name__ == '__main__':
     #
     # Set defaults for the arguments
     #
-    tlm_def_file = f"{ROOTDIR}/telemetry-pages.txt"
     endian = "L"
     subscription = ""
 
@@ -203,20 +214,19 @@ if __name__ == '__main__':
     #
     tlm_page_is_valid, tlm_page_desc, tlm_class, tlm_page_port, \
     tlm_page_appid, tlm_page_count, tlm_page_def_file = ([] for _ in range(7))
-    i = 0
-
-    with open(tlm_def_file) as tlmfile:
-        reader = csv.reader(tlmfile, skipinitialspace=True)
-        for row in reader:
-            if not row[0].startswith('#'):
-                tlm_page_is_valid.append(True)
-                tlm_page_desc.append(row[0])
-                tlm_class.append(row[1])
-                tlm_page_port.append(int(row[2], 16) + 10000)
-                tlm_page_appid.append(int(row[2], 16))
-                tlm_page_def_file.append(row[3])
-                tlm_page_count.append(0)
-                i += 1
+
+    for page in load_pages(ROOTDIR):
+        tlm_page_is_valid.append(True)
+        tlm_page_desc.append(page.desc)
+        tlm_class.append(page.tlm_class)
+        tlm_page_port.append(page.appid + 10000)
+        tlm_page_appid.append(page.appid)
+        tlm_page_def_file.append(page.def_file)
+        tlm_page_count.append(0)
+    # packet id: [row]
+    tlm_page_rows = {}
+    for i, appid in enumerate(tlm_page_appid):
+        tlm_page_rows.setdefault(appid, []).append(i)
     #
     # Mark the remaining values as invalid
     #
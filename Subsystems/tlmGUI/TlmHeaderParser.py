@@ -0,0 +1,377 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+##############################################################################
+# Description:
+#	TlmHeaderParser.py generates telemetry definition files (*-tlm.txt)
+# from the housekeeping telemetry structures in the cFS headers, so the
+# offsets don't have to be typed in by hand. It reads the same header list
+# as CHeaderParser.py, lays each structure out with C natural alignment
+# (every member aligned to its own size, structures to their largest
+# member, padding inserted as the compiler would) and writes one definition
+# file per packet. The compiled telemetry definition cache is rebuilt
+# afterwards (see TelemetryDefinitions.py).
+#
+#	Offsets are written relative to a 12 byte telemetry header (CCSDS
+# primary and secondary header), like the hand written files; the offset
+# selected in the Ground System main window (TLM_HDR_V1/V2_OFFSET) is still
+# added when packets are displayed.
+#
+# Usage:
+#	~$ python3 TlmHeaderParser.py
+#	Generates a definition file for every *HkTlm_t / *HousekeepingTlm_t /
+#	*HkPacket_t structure found in ../cmdGui/CHeaderParser-hdr-paths.txt.
+#	~$ python3 TlmHeaderParser.py --struct=CFE_SB_StatsTlm_t
+#	Generates a definition file for the named structure(s) instead.
+#
+##############################################################################
+
+import getopt
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from struct import calcsize
+
+# ../cFS/tools/cFS-GroundSystem/Subsystems/tlmGUI
+ROOTDIR = Path(__file__).resolve().parent
+sys.path.insert(0, f'{ROOTDIR.parent}/cmdGui')
+
+# pylint: disable=wrong-import-position
+from CHeaderParser import CAMEL_RE, get_file_list, index_header, name_words
+from HTMLDocsParser import get_macro_index
+from MacroIndex import MacroIndex
+
+from TelemetryDefinitions import (PAGES_FILE, TlmItem, compile_cache,
+                                  parse_page_file, validate_items)
+
+TLM_HDR_SIZE = 12
+PATHS_FILE = f'{ROOTDIR.parent}/cmdGui/CHeaderParser-hdr-paths.txt'
+MAX_DEPTH = 8
+
+# C type: python struct type
+C_TYPES = {
+    'char': 's',
+    'int8': 'b', 'int8_t': 'b',
+    'uint8': 'B', 'uint8_t': 'B', 'boolean': 'B', 'bool': '?',
+    'int16': 'h', 'int16_t': 'h',
+    'uint16': 'H', 'uint16_t': 'H',
+    'int32': 'i', 'int32_t': 'i', 'int': 'i',
+    'uint32': 'I', 'uint32_t': 'I', 'unsigned': 'I',
+    'int64': 'q', 'int64_t': 'q',
+    'uint64': 'Q', 'uint64_t': 'Q',
+    'float': 'f',
+    'double': 'd'
+}
+
+# Words that name the same thing in structure, macro and file names
+SYNONYMS = {'housekeeping': 'hk', 'packet': 'tlm', 'pkt': 'tlm'}
+
+FILE_HEADER = """#
+# {file_name}
+#
+# Generated by TlmHeaderParser.py from {struct_name}
+# Changes made by hand are lost when the file is regenerated.
+#
+# This file should have the following comma delimited fields:
+#   1. Data item description
+#   2. Offset of data item in packet
+#   3. Length of data item
+#   4. Python data type of item ( using python struct library )
+#   5. Display type of item ( Currently Dec, Hex, Str, Enm )
+#   6. Display string for enumerated value 0 ( or NULL if none )
+#   7. Display string for enumerated value 1 ( or NULL if none )
+#   8. Display string for enumerated value 2 ( or NULL if none )
+#   9. Display string for enumerated value 3 ( or NULL if none )
+#
+#  Note(1): A line that begins with # is a comment
+#  Note(2): Remove any blank lines from the end of the file
+#
+"""
+
+
+def packet_words(name):
+    return frozenset(SYNONYMS.get(w, w) for w in name_words(name)) - {'mid'}
+
+
+#
+# Returns True for housekeeping telemetry structure names
+#
+def is_hk_packet(name):
+    words = packet_words(name)
+    return name.endswith('_t') and {'hk', 'tlm'} <= words and \
+        'payload' not in words
+
+
+#
+# Definition file name of a structure,
+# e.g. CFE_ES_HousekeepingTlm_t -> cfe-es-hk-tlm.txt
+#
+def def_file_name(struct_name):
+    words = []
+    for part in struct_name[:-2].split('_') if struct_name.endswith('_t') \
+            else struct_name.split('_'):
+        for word in CAMEL_RE.findall(part):
+            word = SYNONYMS.get(word.lower(), word.lower())
+            if word not in words[-1:]:
+                words.append(word)
+    if words[-1] != 'tlm':
+        words.append('tlm')
+    return '-'.join(words) + '.txt'
+
+
+class StructLayout:
+
+    def __init__(self, structs, aliases, macros):
+        self.structs = structs
+        self.aliases = aliases
+        self.macros = macros
+        self.sizes = {}
+
+    def base_type(self, c_type):
+        while c_type in self.aliases and c_type not in self.structs:
+            c_type = self.aliases[c_type]
+        return c_type
+
+    #
+    # Returns (size, alignment) of a C type
+    #
+    def type_size(self, c_type, depth=0):
+        c_type = self.base_type(c_type)
+        if c_type in C_TYPES:
+            size = calcsize(f'<{C_TYPES[c_type]}')
+            return size, size
+        if c_type not in self.sizes:
+            self.sizes[c_type] = self.layout(c_type, depth=depth + 1)[1:]
+        return self.sizes[c_type]
+
+    def array_dims(self, dims):
+        counts = []
+        for dim in dims.strip('[]').split(']['):
+            count = self.macros.resolve(dim) if dim else None
+            if count is None or count < 0:
+                raise ValueError(f'array size {dim} not found')
+            counts.append(count)
+        return counts
+
+    #
+    # Lays out a structure; returns (items, size, alignment). Header
+    # members of the outermost structure are skipped, the other members
+    # being laid out from start (the header size), and Payload members
+    # are flattened without adding their name to the description.
+    #
+    def layout(self, struct_name, prefix='', depth=0, start=0):
+        if depth > MAX_DEPTH:
+            raise ValueError(f'{struct_name} nests too deeply')
+        struct_name = self.base_type(struct_name)
+        if struct_name not in self.structs:
+            raise ValueError(f'unknown type {struct_name}')
+
+        items, offset, max_align = [], start, 1
+        for c_type, name, dims in self.structs[struct_name]:
+            if depth == 0 and any(x in name or x in c_type
+                                  for x in ('Header', 'Hdr')):
+                continue
+            base = self.base_type(c_type)
+            counts = self.array_dims(dims) if dims else []
+            if base == 'char' and counts:
+                # The innermost dimension of a char array is a string
+                elem_size, align = counts.pop(), 1
+            else:
+                elem_size, align = self.type_size(base, depth)
+            count = 1
+            for n in counts:
+                count *= n
+
+            offset += -offset % align
+            max_align = max(max_align, align)
+            desc = prefix if name == 'Payload' else f'{prefix}{name}'
+            for i in range(count):
+                elem_desc = desc
+                if counts:
+                    elem_desc = f'{desc}{self.index_text(i, counts)}'
+                elem_offset = offset + i * elem_size
+                if base in C_TYPES:
+                    data_type = f'{elem_size}s' if base == 'char' else \
+                        C_TYPES[base]
+                    display = 'Str' if base == 'char' else 'Dec'
+                    items.append(TlmItem(elem_desc, elem_offset, elem_size,
+                                         data_type, display, ()))
+                else:
+                    sub_prefix = f'{elem_desc}.' if elem_desc else ''
+                    for item in self.layout(base, sub_prefix, depth + 1)[0]:
+                        items.append(
+                            item._replace(offset=item.offset + elem_offset))
+            offset += count * elem_size
+
+        # Trailing padding so arrays of this structure stay aligned
+        offset += -offset % max_align
+        return items, offset, max_align
+
+    @staticmethod
+    def index_text(i, counts):
+        index = []
+        for n in reversed(counts):
+            index.append(i % n)
+            i //= n
+        return ''.join(f'[{n}]' for n in reversed(index))
+
+
+def format_items(items):
+    rows = [(f'{item.desc},', f'{item.offset},', f'{item.size},',
+             f'{item.data_type},', f'{item.display},') for item in items]
+    widths = [max([len(row[col]) for row in rows] + [0]) + 1
+              for col in range(5)]
+    return ''.join(
+        ''.join(col.ljust(width) for col, width in zip(row, widths)) +
+        'NULL, NULL, NULL, NULL\n' for row in rows)
+
+
+#
+# Writes a text file only if its contents changed
+#
+def write_text(file_name, text):
+    try:
+        with open(file_name) as file_obj:
+            if file_obj.read() == text:
+                return False
+    except IOError:
+        pass
+    with open(file_name, 'w') as file_obj:
+        file_obj.write(text)
+    return True
+
+
+def run(file_list, struct_names=(), hdr_size=TLM_HDR_SIZE, out_dir=ROOTDIR,
+        jobs=None):
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        indexes = list(pool.map(index_header, file_list))
+
+    macros = MacroIndex()
+    aliases, structs = {}, {}
+    for index in indexes:
+        macros.add_defines(index['defines'])
+        aliases.update(index['aliases'])
+        structs.update(index['structs'])
+    macros.add_defines(get_macro_index().defines)
+    layout = StructLayout(structs, aliases, macros)
+
+    if not struct_names:
+        struct_names = sorted(
+            name for name in set(structs) | set(aliases)
+            if is_hk_packet(name) and layout.base_type(name) in structs)
+
+    mids = {}
+    for name in macros.defines:
+        if name.endswith('_MID'):
+            mids.setdefault(packet_words(name), name)
+    try:
+        paged = {page.def_file
+                 for page in parse_page_file(f'{ROOTDIR}/{PAGES_FILE}')}
+    except (IOError, ValueError):
+        paged = set()
+
+    written, failed = 0, []
+    for struct_name in struct_names:
+        try:
+            # Members are aligned within the whole packet, header included
+            items = layout.layout(struct_name, start=hdr_size)[0]
+        except ValueError as e:
+            failed.append(f'{struct_name}: {e}')
+            continue
+        file_name = def_file_name(struct_name)
+        errors, _ = validate_items(file_name, items)
+        if errors:
+            failed.extend(errors)
+            continue
+        written += write_text(
+            f'{out_dir}/{file_name}',
+            FILE_HEADER.format(file_name=file_name, struct_name=struct_name) +
+            format_items(items))
+        print(f'{struct_name}: {len(items)} items -> {file_name}')
+
+        if file_name not in paged:
+            mid = mids.get(packet_words(struct_name))
+            app_id = macros.resolve(mid) if mid else None
+            app_id = '<packet id>' if app_id is None else hex(app_id)
+            print(f'  not in {PAGES_FILE}; add e.g.\n  '
+                  f'{struct_name}, GenericTelemetry.py, '
+                  f'{app_id}, {file_name}')
+
+    print(f'Wrote {written} updated definition files')
+    if written and Path(out_dir).resolve() == ROOTDIR:
+        try:
+            compile_cache()
+        except ValueError as e:
+            failed.append(f"Couldn't build telemetry definition cache: {e}")
+    for failure in failed:
+        print('ERROR:', failure)
+    return not failed
+
+
+#
+# Display usage
+#
+def usage():
+    print("usage: TlmHeaderParser.py [--file=<header paths file>] "
+          "[--struct=<name>]... [--hdr-size=<bytes>] [--out=<dir>] "
+          "[--jobs=<N>]\n\n"
+          f"Default header paths file is {PATHS_FILE}\n"
+          f"Default telemetry header size is {TLM_HDR_SIZE}")
+
+
+if __name__ == '__main__':
+    paths_file = PATHS_FILE
+    struct_list = []
+    header_size = TLM_HDR_SIZE
+    output_dir = ROOTDIR
+    num_jobs = None
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "hf:s:o:j:",
+            ["help", "file=", "struct=", "hdr-size=", "out=", "jobs="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-f", "--file"):
+            paths_file = arg
+        elif opt in ("-s", "--struct"):
+            struct_list.append(arg)
+        elif opt == "--hdr-size":
+            header_size = int(arg)
+        elif opt in ("-o", "--out"):
+            output_dir = arg
+        elif opt in ("-j", "--jobs"):
+            num_jobs = int(arg)
+
+    # Paths in the paths file are relative to the file itself
+    paths_dir = os.path.dirname(os.path.abspath(paths_file))
+    hdr_list = [os.path.join(paths_dir, path)
+                for path in get_file_list(paths_file)]
+    if not hdr_list:
+        print("ERROR: Empty file list. Nothing to be done. Exiting now.")
+        sys.exit(1)
+
+    sys.exit(0 if run(hdr_list, struct_list, header_size, output_dir,
+                      num_jobs) else 1)
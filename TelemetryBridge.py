@@ -0,0 +1,518 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Forwards the telemetry bus to another host over TCP
+#
+# On the Ground System host, --mode=send subscribes to the local bus and
+# collects messages into batches. A batch is sent when it reaches
+# --max-bytes or when its first message is --max-delay milliseconds old,
+# whichever comes first. Each batch is compressed and sent as one ZMQ
+# message:
+#
+#   header: codec (uint8), messages (uint32), uncompressed length (uint32),
+#           batch sequence (uint32), time of first message (uint64, ns)
+#   body:   compressed records of topic length (uint16),
+#           data length (uint32), receive time (uint64, 0 if none),
+#           topic, data
+#
+# On the remote host, --mode=receive unpacks the batches and republishes
+# every message with its original topic on a local bus, so the telemetry
+# pages and tools there work unchanged:
+#
+#   remote ~$ python3 TelemetryBridge.py --mode=receive --listen=tcp://*:5560
+#   ground ~$ python3 TelemetryBridge.py --mode=send
+#                 --remote=tcp://<remote host>:5560 --codec=lz4
+#
+# --filter forwards only the packets that match a packet filter expression
+# (see Subsystems/tlmGUI/PacketFilter.py), evaluated by the routing service.
+# The copies the routing service publishes for the filters of other
+# subscribers are never forwarded.
+#
+# --mode=bench runs a sender and receiver over TCP loopback in one process
+# and routes synthetic packets through them.
+#
+# zlib is always available; lz4 (pip install lz4) and zstd
+# (pip install zstandard) are used if installed.
+#
+
+import getopt
+import getpass
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import zmq
+
+from FleetBenchmark import make_traffic
+from TelemetryRouter import TelemetryRouter
+# From Subsystems/tlmGUI (see TelemetryRouter.py)
+from Metrics import start_metrics
+from PacketFilter import (FILTER_PREFIX, compile_filter,
+                          filter_subscription, original_topic)
+from Profiling import start_profiling
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUS_ADDRESS = f'ipc:///tmp/GroundSystem-{getpass.getuser()}'
+BRIDGE_PORT = 5560
+STATS_INTERVAL = 5.0
+
+BATCH_HEADER = struct.Struct('>BIIIQ')
+RECORD = struct.Struct('>HI8s')
+NO_STAMP = bytes(8)
+# Largest uncompressed batch the receiver accepts; --max-bytes is at most
+# half of it, so a batch has room for the message that fills it
+MAX_BATCH_BYTES = 16 << 20
+
+# Codec names, in the order of their ids in the batch header
+CODEC_NAMES = ('none', 'zlib', 'lz4', 'zstd')
+
+
+# Errors of a corrupt batch
+BATCH_ERRORS = (ValueError, IndexError, struct.error, zlib.error,
+                RuntimeError)
+if zstandard is not None:
+    BATCH_ERRORS += (zstandard.ZstdError,)
+
+
+def zlib_decompress(data, max_length):
+    decompressor = zlib.decompressobj()
+    raw = decompressor.decompress(data, max_length)
+    if not decompressor.eof:
+        raise ValueError('Truncated or oversized zlib stream')
+    return raw
+
+
+def lz4_decompress(data, max_length):
+    decompressor = lz4.frame.LZ4FrameDecompressor()
+    raw = decompressor.decompress(data, max_length)
+    if not decompressor.eof:
+        raise ValueError('Truncated or oversized lz4 frame')
+    return raw
+
+
+def zstd_decompress(data, max_length):
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        return reader.read(max_length)
+
+
+#
+# Returns {codec id: (compress, decompress)} for the installed codecs;
+# decompress(data, max_length) returns at most max_length bytes
+#
+def available_codecs():
+    codecs = {
+        0: (bytes, lambda data, max_length: bytes(data[:max_length])),
+        1: (lambda data: zlib.compress(data, 1), zlib_decompress)
+    }
+    if lz4 is not None:
+        codecs[2] = (lz4.frame.compress, lz4_decompress)
+    if zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=1)
+        codecs[3] = (compressor.compress, zstd_decompress)
+    return codecs
+
+
+#
+# Returns the [(topic, data, stamp)] of a batch; raises ValueError if it
+# doesn't hold exactly count records
+#
+def unpack_batch(raw, count):
+    view = memoryview(raw)
+    records = []
+    pos = 0
+    for _ in range(count):
+        topic_len, data_len, stamp = RECORD.unpack_from(view, pos)
+        pos += RECORD.size
+        topic = view[pos:pos + topic_len]
+        pos += topic_len
+        records.append((topic, view[pos:pos + data_len], stamp))
+        pos += data_len
+    if pos != len(raw):
+        raise ValueError(f'Batch of {len(raw)} bytes has {pos} bytes of '
+                         'records')
+    return records
+
+
+class BridgeStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.monotonic()
+        self.next_report = self.start + STATS_INTERVAL
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.messages = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+        self.dropped = 0
+        self.corrupt = 0
+
+    def add(self, messages, raw_bytes, sent_bytes, latency_ns):
+        self.batches += 1
+        self.messages += messages
+        self.raw_bytes += raw_bytes
+        self.sent_bytes += sent_bytes
+        self.latency_sum += latency_ns
+        self.latency_max = max(self.latency_max, latency_ns)
+
+    def report(self, now):
+        elapsed = now - self.start
+        batches = max(self.batches, 1)
+        print(f'{self.name}: {self.messages / elapsed:.0f} msg/s, '
+              f'{self.raw_bytes / elapsed / 1e6:.2f} MB/s, '
+              f'{self.sent_bytes / elapsed / 1e6:.2f} MB/s on the wire, '
+              f'ratio {self.raw_bytes / max(self.sent_bytes, 1):.2f}, '
+              f'{self.messages / batches:.0f} msg/batch, latency '
+              f'{self.latency_sum / batches / 1e6:.2f} ms mean '
+              f'{self.latency_max / 1e6:.2f} ms max, '
+              f'{self.dropped} dropped, {self.corrupt} corrupt')
+        self.start = now
+        self.next_report = now + STATS_INTERVAL
+        self.reset()
+
+    def maybe_report(self):
+        now = time.monotonic()
+        if now >= self.next_report:
+            self.report(now)
+
+
+class BridgeSender:
+
+    def __init__(self, context, remote, codec='zlib', max_bytes=65536,
+                 max_delay=10.0, subscriptions=(b'',), bus=BUS_ADDRESS):
+        codecs = available_codecs()
+        self.codec = CODEC_NAMES.index(codec)
+        if self.codec not in codecs:
+            raise ValueError(f'Codec {codec} is not installed')
+        self.compress = codecs[self.codec][0]
+        if not 0 < max_bytes <= MAX_BATCH_BYTES // 2:
+            raise ValueError(f'Batches are at most {MAX_BATCH_BYTES // 2} '
+                             'bytes')
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay / 1000
+        self.sequence = 0
+        self.stats = BridgeStats('send')
+        self.runs = True
+
+        self.subscriber = context.socket(zmq.SUB)
+        self.subscriber.setsockopt(zmq.RCVHWM, 0)
+        self.subscriber.connect(bus)
+        for subscription in subscriptions:
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, subscription)
+        # Filter subscriptions of this bridge (see filter_subscription())
+        self.filters = {subscription for subscription in subscriptions
+                        if subscription.startswith(FILTER_PREFIX)}
+        self.push = context.socket(zmq.PUSH)
+        self.push.setsockopt(zmq.LINGER, 1000)
+        self.push.connect(remote)
+
+    def send_batch(self, records, count, first_time, first_ns):
+        raw = b''.join(records)
+        body = self.compress(raw)
+        header = BATCH_HEADER.pack(self.codec, count, len(raw),
+                                   self.sequence, first_ns)
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        try:
+            self.push.send_multipart([header, body], zmq.NOBLOCK, copy=False)
+        except zmq.Again:
+            # Receiver is gone or too slow; don't hold up the bus
+            self.stats.dropped += count
+            return
+        self.stats.add(count, len(raw), len(header) + len(body),
+                       (time.monotonic() - first_time) * 1e9)
+
+    def run(self):
+        recv = self.subscriber.recv_multipart
+        pack = RECORD.pack
+        max_bytes = self.max_bytes
+        records = []
+        count = size = 0
+        first_time = deadline = first_ns = 0
+
+        while self.runs:
+            # Wait for the first message of a batch, or until it is due
+            timeout = 1000 if not count \
+                else max(deadline - time.monotonic(), 0) * 1000
+            if self.subscriber.poll(timeout):
+                if not count:
+                    first_time = time.monotonic()
+                    first_ns = time.time_ns()
+                    deadline = first_time + self.max_delay
+                # Take everything that is already queued
+                try:
+                    while size < max_bytes:
+                        topic, data, *stamp = recv(zmq.NOBLOCK)
+                        if topic.startswith(FILTER_PREFIX):
+                            # A copy for another subscriber's filter
+                            if topic[:topic.find(b'\0') + 1] \
+                                    not in self.filters:
+                                continue
+                            topic = original_topic(topic)
+                        records += (pack(len(topic), len(data),
+                                         stamp[0] if stamp else NO_STAMP),
+                                    topic, data)
+                        count += 1
+                        size += RECORD.size + len(topic) + len(data)
+                except zmq.Again:
+                    pass
+            if count and (size >= max_bytes or
+                          time.monotonic() >= deadline):
+                self.send_batch(records, count, first_time, first_ns)
+                records = []
+                count = size = 0
+            self.stats.maybe_report()
+
+    def close(self):
+        self.subscriber.close()
+        self.push.close()
+
+
+class BridgeReceiver:
+
+    def __init__(self, context, listen, bus=BUS_ADDRESS):
+        self.codecs = available_codecs()
+        self.sequence = None
+        self.stats = BridgeStats('receive')
+        self.runs = True
+
+        self.pull = context.socket(zmq.PULL)
+        self.pull.bind(listen)
+        self.publisher = context.socket(zmq.PUB)
+        self.publisher.setsockopt(zmq.SNDHWM, 0)
+        self.publisher.bind(bus)
+
+    def run(self):
+        publish = self.publisher.send_multipart
+        while self.runs:
+            if not self.pull.poll(1000):
+                self.stats.maybe_report()
+                continue
+            message = self.pull.recv_multipart()
+            # Anyone can connect to the listening port; a corrupt batch is
+            # counted and dropped
+            try:
+                header, body = message
+                codec, count, raw_len, sequence, first_ns = \
+                    BATCH_HEADER.unpack(header)
+                if codec not in self.codecs:
+                    print('Batch', sequence, 'uses codec',
+                          CODEC_NAMES[codec], 'which is not installed')
+                    continue
+                if raw_len > MAX_BATCH_BYTES:
+                    raise ValueError(f'Batch of {raw_len} bytes')
+                # One more byte than expected shows a longer batch
+                raw = self.codecs[codec][1](body, raw_len + 1)
+                if len(raw) != raw_len:
+                    raise ValueError(f'Batch of {len(raw)} bytes, not '
+                                     f'{raw_len}')
+                records = unpack_batch(raw, count)
+            except BATCH_ERRORS:
+                self.stats.corrupt += 1
+                self.stats.maybe_report()
+                continue
+            if self.sequence is not None and sequence != self.sequence:
+                # Counts batches, not messages, lost by the sender
+                self.stats.dropped += (sequence - self.sequence) & 0xFFFFFFFF
+            self.sequence = (sequence + 1) & 0xFFFFFFFF
+            for topic, data, stamp in records:
+                if stamp != NO_STAMP:
+                    publish([topic, data, stamp])
+                else:
+                    publish([topic, data])
+            # Latency from the first message reaching the sender, which
+            # needs the clocks of the two hosts to be synchronized
+            self.stats.add(count, raw_len, len(header) + len(body),
+                           time.time_ns() - first_ns)
+            self.stats.maybe_report()
+
+    def close(self):
+        self.pull.close()
+        self.publisher.close()
+
+
+#
+# Routes num_packets synthetic packets through a sender and receiver
+# connected over TCP loopback
+#
+def bench(codec, max_bytes, max_delay, num_packets):
+    context = zmq.Context()
+    bus = 'inproc://bridge-bench-bus'
+    remote_bus = 'inproc://bridge-bench-remote'
+
+    bus_publisher = context.socket(zmq.PUB)
+    bus_publisher.setsockopt(zmq.SNDHWM, 0)
+    bus_publisher.bind(bus)
+    receiver = BridgeReceiver(context, f'tcp://127.0.0.1:{BRIDGE_PORT}',
+                              remote_bus)
+    sender = BridgeSender(context, f'tcp://127.0.0.1:{BRIDGE_PORT}', codec,
+                          max_bytes, max_delay, (b'GroundSystem',), bus)
+    counter = context.socket(zmq.SUB)
+    counter.setsockopt(zmq.RCVHWM, 0)
+    counter.connect(remote_bus)
+    counter.setsockopt(zmq.SUBSCRIBE, b'GroundSystem')
+    threads = [threading.Thread(target=component.run, daemon=True)
+               for component in (sender, receiver)]
+    for thread in threads:
+        thread.start()
+    # Let the subscriptions reach the publishers
+    time.sleep(0.5)
+
+    router = TelemetryRouter(bus_publisher, spacecraft_map={})
+    traffic = make_traffic(20)
+    start = time.perf_counter()
+    received = sent = 0
+    while sent < num_packets:
+        for ip_address, datagram in traffic:
+            router.route(datagram, ip_address)
+        sent += len(traffic)
+        while counter.poll(0):
+            counter.recv_multipart()
+            received += 1
+    while received < sent and counter.poll(2000):
+        counter.recv_multipart()
+        received += 1
+    elapsed = time.perf_counter() - start
+
+    sender.stats.report(time.monotonic())
+    print(f'Bridged {received} of {sent} packets in {elapsed:.2f} s '
+          f'({received / elapsed:.0f} packets/s) with {codec}')
+    router.close()
+    sender.runs = receiver.runs = False
+    for thread in threads:
+        thread.join()
+    for sock in (bus_publisher, counter):
+        sock.close()
+    sender.close()
+    receiver.close()
+    context.term()
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: TelemetryBridge.py --mode=send|receive|bench "
+           "[--remote=<tcp address>] [--listen=<tcp address>] "
+           "[--bus=<zmq address>] [--sub=<topic prefix>] "
+           "[--filter=<expression>] "
+           "[--codec=none|zlib|lz4|zstd] [--max-bytes=<batch bytes>] "
+           "[--max-delay=<batch ms>] [--packets=<bench packets>]\n\n"
+           "example: --mode=send --remote=tcp://10.0.0.2:5560 --codec=lz4"))
+
+
+#
+# Main
+#
+if __name__ == '__main__':
+    start_profiling('TelemetryBridge')
+    start_metrics('TelemetryBridge')
+    mode = ''
+    remote_address = f'tcp://127.0.0.1:{BRIDGE_PORT}'
+    listen_address = f'tcp://*:{BRIDGE_PORT}'
+    bus_address = BUS_ADDRESS
+    topics = []
+    codec_name = 'zlib'
+    batch_bytes = 65536
+    batch_delay = 10.0
+    bench_packets = 1000000
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "hm:c:",
+            ["help", "mode=", "remote=", "listen=", "bus=", "sub=", "filter=",
+             "codec=", "max-bytes=", "max-delay=", "packets="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-m", "--mode"):
+            mode = arg
+        elif opt == "--remote":
+            remote_address = arg
+        elif opt == "--listen":
+            listen_address = arg
+        elif opt == "--bus":
+            bus_address = arg
+        elif opt == "--sub":
+            topics.append(arg.encode())
+        elif opt == "--filter":
+            try:
+                compile_filter(arg)
+            except ValueError as e:
+                print(e)
+                sys.exit(2)
+            topics.append(filter_subscription(arg))
+        elif opt in ("-c", "--codec"):
+            codec_name = arg
+        elif opt == "--max-bytes":
+            batch_bytes = int(arg)
+        elif opt == "--max-delay":
+            batch_delay = float(arg)
+        elif opt == "--packets":
+            bench_packets = int(arg)
+
+    if codec_name not in CODEC_NAMES:
+        usage()
+        sys.exit(2)
+
+    try:
+        if mode == 'bench':
+            bench(codec_name, batch_bytes, batch_delay, bench_packets)
+            sys.exit()
+        zmq_context = zmq.Context()
+        if mode == 'send':
+            bridge = BridgeSender(zmq_context, remote_address, codec_name,
+                                  batch_bytes, batch_delay, topics or [b''],
+                                  bus_address)
+            print('Forwarding', bus_address, 'to', remote_address)
+        elif mode == 'receive':
+            bridge = BridgeReceiver(zmq_context, listen_address, bus_address)
+            print('Republishing', listen_address, 'on', bus_address)
+        else:
+            usage()
+            sys.exit(2)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+
+    try:
+        bridge.run()
+    except KeyboardInterrupt:
+        pass
+    bridge.close()
+    zmq_context.term()
@@ -0,0 +1,453 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Per-packet routing used by the RoutingService (kept free of Qt so it can
+# be run and benchmarked headless)
+#
+# Each source IP address is a spacecraft. Names come from spacecraft-map.txt
+# if the address is listed there, otherwise they are learned in the order
+# spacecraft are first heard from (Spacecraft1, Spacecraft2, ...). Every
+# lookup on the packet path is a dictionary lookup, so the cost of routing
+# a packet doesn't depend on the number of spacecraft.
+#
+# Addresses listed in spacecraft-map.txt with the same name are ground
+# stations receiving the same spacecraft: their packets are merged into
+# one stream by a StreamMerge (see StreamMerge.py), which drops the copies
+# and restores the sequence count order, and published once. Held packets
+# are released by route() and flush(), which should be called every
+# MERGE_FLUSH_INTERVAL seconds when no packet arrives.
+#
+# With PriorityQueues (see PriorityQueues.py), receive() reads the
+# datagrams waiting on the socket, which must be non-blocking, into the
+# queues of their classes, then publishes from the queues by priority;
+# packets are shed there when they come in faster than they can be
+# published. Limits are checked before a packet is queued, so alarms are
+# published at once, even for packets that are shed.
+#
+# Packets are published as
+#   [GroundSystem.<spacecraft>.TelemetryPackets.<packet id>, packet,
+#    receive time]
+# where the receive time is time.time_ns() as an unsigned 64 bit big
+# endian integer (see Subsystems/tlmGUI/LatencyHistogram.py),
+# and per-spacecraft statistics, once per STATS_INTERVAL seconds, as JSON on
+#   Stats.<spacecraft>
+# (with the StreamMerge counters of spacecraft with several stations)
+# along with the FrameDecoder counters, if there is one, on
+#   Stats.Framing
+# and the counters of the priority classes, if there are PriorityQueues, on
+#   Stats.Priority
+#
+# With an XPUB publisher, subscribers can also subscribe to filter
+# expressions (see Subsystems/tlmGUI/PacketFilter.py); the packets that
+# match a filter are published again under
+#   Filtered.<expression>\0GroundSystem.<spacecraft>.TelemetryPackets.<id>
+# Subscriptions are read every FILTER_POLL_INTERVAL seconds while packets
+# are routed. A filter that raises an error on a packet (e.g. comparing a
+# Str item with a number) is dropped. Items are decoded in the router's
+# endian (ROUTER_ENDIAN unless given).
+#
+# The same counts are exported as metrics (see Subsystems/tlmGUI/Metrics.py)
+# by a collector, read when the metrics are scraped.
+#
+
+import csv
+import json
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+import zmq
+
+ROOTDIR = Path(__file__).resolve().parent
+sys.path.insert(0, f'{ROOTDIR}/Subsystems/tlmGUI')
+
+# pylint: disable=wrong-import-position
+from Metrics import REGISTRY
+from PacketFilter import FILTER_PREFIX, ROUTER_ENDIAN, compile_filter
+from PriorityQueues import COUNTERS as PRIORITY_COUNTERS
+from Profiling import timed
+from StreamMerge import COUNTERS as MERGE_COUNTERS, StreamMerge, load_merge
+
+SPACECRAFT_MAP_FILE = f'{ROOTDIR}/spacecraft-map.txt'
+STATS_INTERVAL = 1.0
+FILTER_POLL_INTERVAL = 0.1
+MERGE_FLUSH_INTERVAL = 0.005
+# Most datagrams read into the priority queues at once, and packets
+# published from them while more datagrams are waiting
+READ_BATCH = 256
+PUBLISH_BATCH = 64
+# Largest datagram read from the socket
+RECV_SIZE = 65536
+# Receive buffer asked for the socket with priority queues, so bursts wait
+# there until they are read into the queues (the kernel may give less)
+SOCKET_BUFFER = 4 * 1024 * 1024
+RECEIVE_TIME = struct.Struct('>Q')
+
+
+#
+# Reads spacecraft-map.txt into {ip address: name}
+#
+def load_spacecraft_map(map_file=SPACECRAFT_MAP_FILE):
+    names = {}
+    try:
+        with open(map_file) as map_obj:
+            for row in csv.reader(map_obj, skipinitialspace=True):
+                if not row or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                ip_address, name = row[0].strip(), row[1].strip()
+                if not name or '.' in name or name == 'All':
+                    raise ValueError(f'{map_file}: invalid spacecraft name '
+                                     f'"{name}" (names may not contain ".")')
+                names[ip_address] = name
+    except IOError:
+        pass
+    return names
+
+
+class Spacecraft:
+    __slots__ = ('name', 'ip_address', 'addresses', 'merge', 'topic_prefix',
+                 'topics', 'packets', 'bytes', 'last_packets', 'last_bytes',
+                 'last_seen')
+
+    def __init__(self, name, ip_address, merge=None):
+        self.name = name
+        self.ip_address = ip_address
+        # Ground station addresses, in the order they were first heard from
+        self.addresses = [ip_address]
+        # StreamMerge of the packets from the stations, if there are several
+        self.merge = merge
+        self.topic_prefix = f'GroundSystem.{name}.TelemetryPackets.'
+        # packet id: topic
+        self.topics = {}
+        self.packets = 0
+        self.bytes = 0
+        self.last_packets = 0
+        self.last_bytes = 0
+        self.last_seen = 0.0
+
+    def topic(self, stream_id):
+        topic = self.topics.get(stream_id)
+        if topic is None:
+            topic = self.topics[stream_id] = \
+                f'{self.topic_prefix}{hex(stream_id)}'.encode()
+        return topic
+
+
+class TelemetryRouter:
+
+    def __init__(self, publisher, spacecraft_map=None, limit_monitor=None,
+                 merge_settings=None, endian=ROUTER_ENDIAN):
+        self.publisher = publisher
+        # Byte order of the items in filters
+        self.endian = endian
+        self.limit_monitor = limit_monitor
+        # FrameDecoder used by receive(), whose counters are published with
+        # the statistics (without one, every datagram is one packet)
+        self.framing = None
+        # PriorityQueues the packets go through before they are published
+        # (without them, packets are published as they are received)
+        self.queues = None
+        self.static_names = load_spacecraft_map() if spacecraft_map is None \
+            else spacecraft_map
+        # ip address: Spacecraft (the same one for all its stations)
+        self.spacecraft = {}
+        self.learned_count = 0
+        # Names listed for several addresses, and the StreamMerge settings
+        names = list(self.static_names.values())
+        self.merged_names = {name for name in names if names.count(name) > 1}
+        self.merge_settings = load_merge() if merge_settings is None \
+            else merge_settings
+        # Spacecraft with several stations
+        self.merged = []
+        self.next_flush = 0.0
+        self.next_stats = time.monotonic() + STATS_INTERVAL
+        # [(subscription, matches)] of the filters subscribed to
+        self.filters = []
+        self.subscriptions = getattr(publisher, 'socket_type', None) == \
+            zmq.XPUB
+        self.next_filter_poll = 0.0
+        # Telemetry header offset, for filters on items
+        self.tlm_offset = lambda: 0
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def add_spacecraft(self, ip_address):
+        name = self.static_names.get(ip_address)
+        if name in self.merged_names:
+            for spacecraft in self.merged:
+                if spacecraft.name == name:
+                    # Another station of a spacecraft already heard from
+                    spacecraft.addresses.append(ip_address)
+                    self.spacecraft[ip_address] = spacecraft
+                    return spacecraft
+            spacecraft = self.spacecraft[ip_address] = Spacecraft(
+                name, ip_address, StreamMerge(**self.merge_settings))
+            self.merged.append(spacecraft)
+            return spacecraft
+        if name is None:
+            taken = {sc.name for sc in self.spacecraft.values()}
+            taken.update(self.static_names.values())
+            while name is None or name in taken:
+                self.learned_count += 1
+                name = f'Spacecraft{self.learned_count}'
+        spacecraft = self.spacecraft[ip_address] = Spacecraft(name, ip_address)
+        return spacecraft
+
+    #
+    # Reads one datagram from sock and routes the packets in it (see
+    # FrameDecoder.py), or reads a batch with PriorityQueues; returns the
+    # first new Spacecraft, if any
+    #
+    @timed('receive')
+    def receive(self, sock):
+        if self.queues is not None:
+            return self.receive_queued(sock)
+        datagram, host = sock.recvfrom(RECV_SIZE)
+        return self.route_datagram(datagram, host[0])
+
+    #
+    # Reads the datagrams waiting on the non-blocking sock, up to
+    # READ_BATCH, into the priority queues, then publishes up to
+    # PUBLISH_BATCH queued packets, or READ_BATCH if no datagram is left
+    # waiting; waits up to MERGE_FLUSH_INTERVAL seconds for a datagram if
+    # there is nothing to publish. Returns the first new Spacecraft, if any
+    #
+    def receive_queued(self, sock):
+        if not self.queues.ready(time.monotonic()):
+            select.select((sock,), (), (), MERGE_FLUSH_INTERVAL)
+        new_spacecraft = None
+        limit = PUBLISH_BATCH
+        try:
+            for _ in range(READ_BATCH):
+                datagram, host = sock.recvfrom(RECV_SIZE)
+                spacecraft = self.route_datagram(datagram, host[0])
+                if spacecraft and not new_spacecraft:
+                    new_spacecraft = spacecraft
+        except BlockingIOError:
+            limit = READ_BATCH
+
+        now = time.monotonic()
+        if self.merged and now >= self.next_flush:
+            self.flush(now)
+        for spacecraft, packet, recv_ns in self.queues.get(limit, now):
+            self.publish(spacecraft, packet, recv_ns, now, True)
+        return new_spacecraft
+
+    def route_datagram(self, datagram, ip_address):
+        recv_ns = time.time_ns()
+        new_spacecraft = None
+        packets = self.framing.decode(datagram, ip_address) if self.framing \
+            else (datagram,)
+        for packet in packets:
+            spacecraft = self.route(packet, ip_address, recv_ns)
+            if spacecraft and not new_spacecraft:
+                new_spacecraft = spacecraft
+        return new_spacecraft
+
+    #
+    # Publishes one packet, received at recv_ns (time.time_ns(), now if
+    # not given); returns the Spacecraft if it is the first packet from
+    # that address (the last of its addresses), otherwise None
+    #
+    @timed('route')
+    def route(self, datagram, ip_address, recv_ns=0):
+        spacecraft = self.spacecraft.get(ip_address)
+        new_spacecraft = None
+        if spacecraft is None:
+            spacecraft = new_spacecraft = self.add_spacecraft(ip_address)
+
+        now = time.monotonic()
+        if spacecraft.merge is None:
+            self.publish(spacecraft, datagram, recv_ns or time.time_ns(),
+                         now)
+        else:
+            for packet, packet_ns in spacecraft.merge.add(
+                    datagram, recv_ns or time.time_ns(), now):
+                self.publish(spacecraft, packet, packet_ns, now)
+
+        if now >= self.next_stats:
+            self.publish_stats(now)
+        if self.merged and now >= self.next_flush:
+            self.flush(now)
+        if self.subscriptions and now >= self.next_filter_poll:
+            self.next_filter_poll = now + FILTER_POLL_INTERVAL
+            self.update_filters()
+        return new_spacecraft
+
+    #
+    # Publishes a packet, or queues it if there are PriorityQueues and it
+    # isn't already dequeued
+    #
+    def publish(self, spacecraft, datagram, recv_ns, now, dequeued=False):
+        if not dequeued:
+            if self.limit_monitor:
+                for alarm in self.limit_monitor.check(spacecraft.name,
+                                                      datagram):
+                    self.publisher.send_multipart(alarm)
+            if self.queues is not None:
+                self.queues.put((datagram[0] << 8) | datagram[1],
+                                (spacecraft, datagram, recv_ns))
+                return
+
+        topic = spacecraft.topic((datagram[0] << 8) | datagram[1])
+        stamp = RECEIVE_TIME.pack(recv_ns)
+        self.publisher.send_multipart([topic, datagram, stamp])
+        if self.filters:
+            offset = self.tlm_offset()
+            for subscription, matches in self.filters:
+                try:
+                    matched = matches(datagram, spacecraft.name, offset)
+                except Exception as e:  # pylint: disable=broad-except
+                    # A subscriber's expression can't stop the routing
+                    print("Dropped filter subscription", subscription, e)
+                    self.filters = [f for f in self.filters
+                                    if f[0] != subscription]
+                    continue
+                if matched:
+                    self.publisher.send_multipart(
+                        [subscription + topic, datagram, stamp])
+
+        spacecraft.packets += 1
+        spacecraft.bytes += len(datagram)
+        spacecraft.last_seen = now
+
+    #
+    # Publishes the merged packets whose gaps have waited long enough
+    #
+    def flush(self, now=None):
+        now = now or time.monotonic()
+        self.next_flush = now + MERGE_FLUSH_INTERVAL
+        for spacecraft in self.merged:
+            for packet, packet_ns in spacecraft.merge.flush(now):
+                self.publish(spacecraft, packet, packet_ns, now)
+
+    #
+    # Compiles the filters subscribed to since the last call and drops the
+    # ones nobody subscribes to anymore
+    #
+    def update_filters(self):
+        while True:
+            try:
+                message = self.publisher.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            subscription = message[1:]
+            if not subscription.startswith(FILTER_PREFIX):
+                continue
+            if message[0] == 0:
+                self.filters = [f for f in self.filters
+                                if f[0] != subscription]
+                continue
+            expression = subscription[len(FILTER_PREFIX):].rstrip(b'\0')
+            try:
+                matches = compile_filter(expression.decode(), self.endian)
+            except (UnicodeDecodeError, ValueError) as e:
+                print("Ignored filter subscription:", e)
+                continue
+            self.filters.append((subscription, matches))
+
+    def publish_stats(self, now):
+        interval = now - self.next_stats + STATS_INTERVAL
+        self.next_stats = now + STATS_INTERVAL
+        for spacecraft in dict.fromkeys(self.spacecraft.values()):
+            stats = {
+                'spacecraft': spacecraft.name,
+                'address': ', '.join(spacecraft.addresses),
+                'packets': spacecraft.packets,
+                'bytes': spacecraft.bytes,
+                'packet_rate': (spacecraft.packets - spacecraft.last_packets)
+                               / interval,
+                'byte_rate': (spacecraft.bytes - spacecraft.last_bytes)
+                             / interval,
+                'idle': now - spacecraft.last_seen
+            }
+            if spacecraft.merge is not None:
+                stats.update(spacecraft.merge.counters())
+            spacecraft.last_packets = spacecraft.packets
+            spacecraft.last_bytes = spacecraft.bytes
+            self.publisher.send_multipart([
+                f'Stats.{spacecraft.name}'.encode(),
+                json.dumps(stats).encode()
+            ])
+        if self.framing:
+            self.publisher.send_multipart([
+                b'Stats.Framing', json.dumps(self.framing.counters()).encode()
+            ])
+        if self.queues is not None:
+            self.publisher.send_multipart([
+                b'Stats.Priority', json.dumps(self.queues.counters()).encode()
+            ])
+
+    def collect_metrics(self):
+        now = time.monotonic()
+        spacecraft = list(dict.fromkeys(self.spacecraft.values()))
+        labels = [{'spacecraft': sc.name, 'address': ', '.join(sc.addresses)}
+                  for sc in spacecraft]
+        metrics = [
+            ('groundsystem_router_spacecraft', 'gauge',
+             'Spacecraft heard from',
+             [('groundsystem_router_spacecraft', {}, len(spacecraft))]),
+            ('groundsystem_router_packets', 'counter',
+             'Telemetry packets published',
+             [('groundsystem_router_packets_total', sc_labels, sc.packets)
+              for sc, sc_labels in zip(spacecraft, labels)]),
+            ('groundsystem_router_bytes', 'counter',
+             'Telemetry bytes published',
+             [('groundsystem_router_bytes_total', sc_labels, sc.bytes)
+              for sc, sc_labels in zip(spacecraft, labels)]),
+            ('groundsystem_router_idle_seconds', 'gauge',
+             'Time since the last packet from the spacecraft',
+             [('groundsystem_router_idle_seconds', sc_labels,
+               round(now - sc.last_seen, 3))
+              for sc, sc_labels in zip(spacecraft, labels)])
+        ]
+        if self.framing:
+            metrics += [
+                (f'groundsystem_framing_{counter}', 'counter',
+                 f'FrameDecoder {counter.replace("_", " ")}',
+                 [(f'groundsystem_framing_{counter}_total', {}, value)])
+                for counter, value in self.framing.counters().items()]
+        if self.merged:
+            merge_counters = [({'spacecraft': sc.name}, sc.merge.counters())
+                              for sc in self.merged]
+            metrics += [
+                (f'groundsystem_merge_{counter}', 'counter',
+                 f'Packets counted by StreamMerge as {counter}',
+                 [(f'groundsystem_merge_{counter}_total', sc_labels,
+                   counters[counter])
+                  for sc_labels, counters in merge_counters])
+                for counter in MERGE_COUNTERS]
+        if self.queues is not None:
+            classes = self.queues.counters().items()
+            metrics += [
+                (f'groundsystem_priority_{counter}', 'counter',
+                 f'Packets {counter} by the priority queues',
+                 [(f'groundsystem_priority_{counter}_total', {'class': name},
+                   counters[counter]) for name, counters in classes])
+                for counter in PRIORITY_COUNTERS]
+            metrics.append(
+                ('groundsystem_priority_queue_depth', 'gauge',
+                 'Packets waiting in the priority queues',
+                 [('groundsystem_priority_queue_depth', {'class': name},
+                   counters['depth']) for name, counters in classes]))
+        return metrics
+
+    def close(self):
+        REGISTRY.remove_collector(self.collect_metrics)
@@ -18,33 +18,428 @@
 #  limitations under the License.
 #
 
-import zmq
+#
+# Writes the messages on the Ground System bus to stdout or files, without
+# Qt, for shell pipelines and analysis jobs
+#
+# Formats:
+#   text    [topic] (age) contents, one message per line (the default)
+#   jsonl   one JSON object per line; telemetry packets listed in
+#           telemetry-pages.txt are decoded through their definition files
+#           into "items", others are given as "data" in hex. Alarms and
+#           statistics are given as "message".
+#   csv     one row per telemetry packet: time, spacecraft, packet, then
+#           the decoded items, or the packet in hex. A header row is
+#           written before the first packet of each packet id, so give
+#           --packet or an --output with {packet} for one table per file.
+#   binary  every message as a record: receive time (ns since 1970, 0 if
+#           the message has none), topic length and message length as
+#           big endian Q, H and I, then the topic and the message. See
+#           read_records().
+#
+# --filter subscribes to a packet filter expression (see
+# Subsystems/tlmGUI/PacketFilter.py), evaluated by the routing service, so
+# only the packets that match are sent to the tap.
+#
+# Messages are read in batches of up to BATCH_SIZE; each batch is formatted
+# at once and written with one write per output file.
+#
+# Examples:
+#   ~$ python3 TlmMQRecv.py --format=jsonl --packet=0x800
+#   ~$ python3 TlmMQRecv.py --format=csv --topic=GroundSystem.Spacecraft1 \
+#          --output='tlm-{spacecraft}-{packet}.csv'
+#   ~$ python3 TlmMQRecv.py --format=binary --output=session.bin
+#   ~$ python3 TlmMQRecv.py --format=jsonl \
+#          --filter='apid in (0, 6) and {Command Counter} > 0'
+#
+
+import csv
+import getopt
 import getpass
+import json
+import mmap
+import struct
+import sys
+import time
+from pathlib import Path
+
+import zmq
+
+ROOTDIR = Path(__file__).resolve().parent
+TLM_DIR = f'{ROOTDIR}/Subsystems/tlmGUI'
+sys.path.insert(0, TLM_DIR)
+
+# pylint: disable=wrong-import-position
+from LatencyHistogram import receive_time
+from Metrics import start_metrics
+from PacketFilter import (ROUTER_ENDIAN, compile_filter, filter_subscription,
+                          original_topic, uses_items)
+from Profiling import start_profiling
+from TelemetryConversions import compile_packet
+from TelemetryDefinitions import load_items, load_pages
+
+FORMATS = ('text', 'jsonl', 'csv', 'binary')
+# Most messages read and written at once
+BATCH_SIZE = 1000
+# Milliseconds to wait for a message
+POLL_TIMEOUT = 200
+WRITE_BUFFER = 1 << 20
+# Messages queued by ZMQ for the tap before the bus drops them
+RECEIVE_HWM = 100000
+RECORD = struct.Struct('>QHI')
 
 
 #
-# Receive zeroMQ messages (used for debugging only - not used by CFS Ground System)
+# Reads the records of a binary tap file; yields (receive time, topic,
+# message)
+#
+def read_records(stream):
+    while True:
+        header = stream.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        recv_ns, topic_len, message_len = RECORD.unpack(header)
+        topic = stream.read(topic_len)
+        yield recv_ns, topic, stream.read(message_len)
+
+
+#
+# Telemetry header offset selected in the main window, or 0
+#
+def open_offsets():
+    try:
+        with open(f"/tmp/OffsetData-{getpass.getuser()}", "r+b") as f:
+            return mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+    except (IOError, ValueError):
+        return None
+
+
+#
+# Decodes telemetry packets through the definition files of the pages in
+# telemetry-pages.txt. A packet id with several definition files (e.g. the
+# TIME DIAG pages) is decoded with all of them.
+#
+class PacketDecoder:
+
+    def __init__(self, endian='L', tlm_dir=TLM_DIR):
+        # packet id: [(convert, [(index, fixup)])]
+        self.converters = {}
+        # packet id: item names
+        self.names = {}
+        for page in load_pages(tlm_dir):
+            if page.def_file == 'null':
+                continue
+            try:
+                items = load_items(page.def_file, tlm_dir)
+            except (IOError, ValueError) as e:
+                print(f"Couldn't load {page.def_file}:", e, file=sys.stderr)
+                continue
+            fixups = []
+            for index, item in enumerate(items):
+                if item.display == 'Str':
+                    fixups.append((index, self.string))
+                elif item.display == 'Enm':
+                    fixups.append((index, self.enumeration(item.args)))
+            self.converters.setdefault(page.appid, []).append(
+                (compile_packet(items, endian, page.def_file), fixups))
+            self.names[page.appid] = self.names.get(page.appid, ()) + \
+                tuple(item.desc for item in items)
+
+    @staticmethod
+    def string(value):
+        return value.split(b'\0', 1)[0].decode('ascii', 'replace')
+
+    @staticmethod
+    def enumeration(labels):
+        def label(value):
+            return labels[value] if 0 <= value < len(labels) else value
+        return label
+
+    #
+    # Returns the item values of a packet, or None if there is no
+    # definition or the packet is too short
+    #
+    def decode(self, pkt_id, packet, offset):
+        converters = self.converters.get(pkt_id)
+        if converters is None:
+            return None
+        values = []
+        for convert, fixups in converters:
+            decoded = convert(packet, offset)
+            if decoded is None:
+                return None
+            if fixups:
+                decoded = list(decoded)
+                for index, fixup in fixups:
+                    decoded[index] = fixup(decoded[index])
+            values.extend(decoded)
+        return values
+
+
+class Tap:
+
+    def __init__(self, fmt='text', output='-', decoder=None, offset=None):
+        self.format = fmt
+        self.output = output
+        self.decoder = decoder
+        self.offset = offset
+        self.offsets_mm = None if offset is not None else open_offsets()
+        # file name: file
+        self.files = {}
+        # (file name, packet id) with a CSV header written
+        self.headers = set()
+        self.encoder = json.JSONEncoder(check_circular=False)
+        self.messages = 0
+        self.decoded = 0
+
+    def tlm_offset(self):
+        if self.offset is not None:
+            return self.offset
+        try:
+            return self.offsets_mm[0]
+        except (TypeError, IndexError, ValueError):
+            return 0
+
+    def file(self, name):
+        output = self.files.get(name)
+        if output is None:
+            binary = self.format == 'binary'
+            if name == '-':
+                output = open(sys.stdout.fileno(), 'wb' if binary else 'w',
+                              buffering=WRITE_BUFFER, closefd=False,
+                              **({} if binary else {'newline': ''}))
+            elif binary:
+                output = open(name, 'wb', buffering=WRITE_BUFFER)
+            else:
+                output = open(name, 'w', buffering=WRITE_BUFFER, newline='')
+            self.files[name] = output
+        return output
+
+    #
+    # Formats and writes a batch of messages, [topic, message(, receive
+    # time)] as read from the bus
+    #
+    def write(self, batch):
+        offset = self.tlm_offset()
+        now = time.time_ns()
+        # file name: [text, bytes or csv rows]
+        chunks = {}
+        for parts in batch:
+            topic = parts[0].decode(errors='replace')
+            fields = topic.split('.')
+            recv_ns = receive_time(parts)
+            message = parts[1] if len(parts) > 1 else b''
+            telemetry = len(fields) == 4 and fields[2] == 'TelemetryPackets'
+            name = self.output
+            if '{' in name:
+                name = name.format(
+                    spacecraft=fields[1] if len(fields) > 1 else 'All',
+                    packet=fields[3] if telemetry else fields[0])
+            if self.format == 'binary':
+                chunk = RECORD.pack(recv_ns, len(parts[0]), len(message)) + \
+                    parts[0] + message
+            elif self.format == 'text':
+                if recv_ns:
+                    chunk = f'[{parts[0]}] ({(now - recv_ns) / 1e6:.3f} ms) ' \
+                            f'{message}\n'
+                else:
+                    chunk = f'[{parts[0]}] {message}\n'
+            elif telemetry:
+                chunk = self.format_packet(name, fields, message,
+                                           recv_ns or now, offset)
+            elif self.format == 'jsonl':
+                try:
+                    body = json.loads(message)
+                except ValueError:
+                    body = message.decode(errors='replace')
+                chunk = self.encoder.encode(
+                    {'topic': topic, 'time': (recv_ns or now) / 1e9,
+                     'message': body}) + '\n'
+            else:
+                continue
+            chunks.setdefault(name, []).extend(
+                chunk if self.format == 'csv' else (chunk,))
+            self.messages += 1
+
+        for name, chunk in chunks.items():
+            output = self.file(name)
+            if self.format == 'binary':
+                output.write(b''.join(chunk))
+            elif self.format == 'csv':
+                csv.writer(output, lineterminator='\n').writerows(chunk)
+            else:
+                output.write(''.join(chunk))
+            output.flush()
+
+    #
+    # A telemetry packet as a JSON line, or as CSV rows (with the header
+    # if it is the first packet of its id in the file)
+    #
+    def format_packet(self, name, fields, packet, recv_ns, offset):
+        pkt_id = (packet[0] << 8) | packet[1] if len(packet) > 1 else -1
+        values = self.decoder.decode(pkt_id, packet, offset) \
+            if self.decoder else None
+        if values is not None:
+            self.decoded += 1
+        if self.format == 'jsonl':
+            record = {'time': recv_ns / 1e9, 'spacecraft': fields[1],
+                      'packet': fields[3]}
+            if values is None:
+                record['data'] = packet.hex()
+            else:
+                record['items'] = dict(zip(self.decoder.names[pkt_id],
+                                           values))
+            return self.encoder.encode(record) + '\n'
+
+        rows = []
+        if (name, pkt_id) not in self.headers:
+            self.headers.add((name, pkt_id))
+            rows.append(['time', 'spacecraft', 'packet'] + (
+                ['data'] if values is None else
+                list(self.decoder.names[pkt_id])))
+        rows.append([f'{recv_ns // 1000000000}.{recv_ns % 1000000000:09d}',
+                     fields[1], fields[3]] +
+                    ([packet.hex()] if values is None else values))
+        return rows
+
+    def close(self):
+        for output in self.files.values():
+            try:
+                output.close()
+            except BrokenPipeError:
+                pass
+        if self.offsets_mm is not None:
+            self.offsets_mm.close()
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: TlmMQRecv.py [--format=text|jsonl|csv|binary] "
+           "[--topic=<prefix>]... [--packet=<ids>]\n"
+           "                    [--filter=<expression>] [--output=<file>] [--count=<messages>] "
+           "[--offset=<bytes>] [--endian=L|B] [--raw]\n\n"
+           "--topic      topic prefix to subscribe to, default GroundSystem "
+           "(e.g. GroundSystem.Spacecraft1, Alarms, Stats)\n"
+           "--packet     comma separated packet ids to keep, e.g. "
+           "0x800,0x808\n"
+           "--filter     packet filter expression, e.g. "
+           "'0x800 <= msgid <= 0x80F and spacecraft == \"Spacecraft1\"'\n"
+           "--output     file to write to, default - (stdout); {spacecraft}"
+           " and {packet} give one file per spacecraft or packet\n"
+           "--count      stop after that many messages\n"
+           "--offset     telemetry header offset, default the one selected "
+           "in the main window\n"
+           "--raw        don't decode packets"))
+
+
+#
+# Main
 #
 def main():
-    """ main method """
+    start_profiling('TlmMQRecv')
+    start_metrics('TlmMQRecv')
+
+    fmt = 'text'
+    topics = []
+    filters = []
+    packets = None
+    output = '-'
+    count = 0
+    offset = None
+    endian = 'L'
+    decode = True
+
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "hf:t:p:o:c:e:r", [
+            "help", "format=", "topic=", "packet=", "filter=", "output=",
+            "count=", "offset=", "endian=", "raw"
+        ])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif opt in ("-f", "--format"):
+                if arg not in FORMATS:
+                    raise ValueError(arg)
+                fmt = arg
+            elif opt in ("-t", "--topic"):
+                topics.append(arg)
+            elif opt in ("-p", "--packet"):
+                packets = {f'.{hex(int(pkt_id, 16))}'
+                           for pkt_id in arg.split(',')}
+            elif opt == "--filter":
+                # Checked here; the routing service evaluates it
+                compile_filter(arg)
+                filters.append(arg)
+            elif opt in ("-o", "--output"):
+                output = arg
+            elif opt in ("-c", "--count"):
+                count = int(arg)
+            elif opt == "--offset":
+                offset = int(arg)
+            elif opt in ("-e", "--endian"):
+                endian = arg
+            elif opt in ("-r", "--raw"):
+                decode = False
+        if endian != ROUTER_ENDIAN and any(map(uses_items, filters)):
+            raise ValueError(f'Filter items are decoded by the routing '
+                             f'service with --endian={ROUTER_ENDIAN}')
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        usage()
+        sys.exit(2)
+
+    decoder = PacketDecoder(endian) if decode and fmt in ('jsonl', 'csv') \
+        else None
+    tap = Tap(fmt, output, decoder, offset)
 
-    # Prepare our context and publisher
     context = zmq.Context()
     subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.RCVHWM, RECEIVE_HWM)
     subscriber.connect(f"ipc:///tmp/GroundSystem-{getpass.getuser()}")
-    subscriber.setsockopt(zmq.SUBSCRIBE, b"GroundSystem")
+    for topic in topics or ([] if filters else ['GroundSystem']):
+        subscriber.setsockopt(zmq.SUBSCRIBE, topic.encode())
+    for expression in filters:
+        subscriber.setsockopt(zmq.SUBSCRIBE, filter_subscription(expression))
 
-    while True:
-        try:
-            # Read envelope with address
-            address, contents = subscriber.recv_multipart()
-            print(f"[{address}] {contents}")
-        except KeyboardInterrupt:
-            break
-
-    # We never get here but clean up anyhow
-    subscriber.close()
-    context.term()
+    received = 0
+    try:
+        while not count or received < count:
+            if not subscriber.poll(POLL_TIMEOUT):
+                continue
+            batch = []
+            limit = min(BATCH_SIZE, count - received) if count else BATCH_SIZE
+            while len(batch) < limit:
+                try:
+                    parts = subscriber.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                if filters:
+                    parts[0] = original_topic(parts[0])
+                # Same suffix check as the pages (see GenericTelemetry.py)
+                if packets is None or \
+                        parts[0][parts[0].rfind(b'.'):].decode() in packets:
+                    batch.append(parts)
+            received += len(batch)
+            tap.write(batch)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # The reading end of the pipeline is gone (e.g. | head)
+        pass
+    finally:
+        tap.close()
+        subscriber.close()
+        context.term()
+        print(f'{tap.messages} messages written', (f'({tap.decoded} packets '
+              'decoded)' if decoder else ''), file=sys.stderr)
 
 
 if __name__ == "__main__":
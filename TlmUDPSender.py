@@ -1,5 +1,3 @@
-#!/usr/bin/env python3
-
 #
 #  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
 #
@@ -19,22 +17,335 @@
 #
 
 #
-# Send UDP messages for debugging (not used by Ground System)
+# Synthetic telemetry load generator (for testing, not used by Ground
+# System)
 #
-import time
+# Sends CCSDS telemetry packets built from the telemetry definitions in
+# Subsystems/tlmGUI (telemetry-pages.txt and the *-tlm.txt files) to the
+# routing service: valid primary headers, per source sequence counts, the
+# current time in the secondary header (see spacecraft-time.txt) and item
+# values that change from packet to packet. Event message packets (0x808)
+# carry a synthetic event.
+#
+# Every packet ID is sent at --rate packets per second unless given its
+# own rate (--rate=0x800:5000). A rate of 0 sends as fast as possible.
+# --burst multiplies the rates for part of every cycle. --sources sends
+# from several 127.0.x.x addresses, i.e. several spacecraft, and
+# --processes splits the load over several processes. The achieved send
+# rate is printed every second.
+#
+#   ~$ python3 TlmUDPSender.py --rate=0 --sources=10 --processes=4
+#
+
+import getopt
+import math
+import multiprocessing
 import socket
+import struct
+import sys
+import time
+from pathlib import Path
+
+ROOTDIR = Path(__file__).resolve().parent
+TLM_DIR = f'{ROOTDIR}/Subsystems/tlmGUI'
+sys.path.insert(0, TLM_DIR)
+
+# pylint: disable=wrong-import-position
+from SpacecraftTime import SpacecraftClock, load_clock
+from TelemetryDefinitions import TlmItem, item_format, load_items, load_pages
+
+# Receive port of the routing service (see RoutingService.py)
+udp_recv_port = 2234
+
+# Packets with different item values sent in turn for each packet ID
+VARIANTS = 64
+# Seconds between sends of the rate limited packets
+TICK = 0.005
+# Most packets sent at once when a stream is unlimited or catching up
+MAX_BATCH = 256
+
+EVENT_MSG_ID = 0x808
+EVENT_ITEMS = (
+    TlmItem('App Name', 12, 20, '20s', 'Str', ()),
+    TlmItem('Event ID', 32, 2, 'H', 'Dec', ()),
+    TlmItem('Event Type', 34, 2, 'H', 'Enm',
+            ('', 'DEBUG', 'INFORMATION', 'ERROR', 'CRITICAL')),
+    TlmItem('Spacecraft ID', 36, 4, 'I', 'Dec', ()),
+    TlmItem('Processor ID', 40, 4, 'I', 'Dec', ()),
+    TlmItem('Message', 44, 122, '122s', 'Str', ()),
+)
+
+
+#
+# Value of an item in the given variant of its packet
+#
+def item_value(item, fmt, index, variant):
+    if fmt.endswith('s'):
+        text = f'{item.desc} {variant}' if item.size > 8 else f'SIM{variant}'
+        return text.encode()[:item.size]
+    data_type = fmt[-1]
+    if data_type in 'fd':
+        return 100 * math.sin(2 * math.pi * variant / VARIANTS + index)
+    if data_type == '?':
+        return bool(variant & 1)
+    if item.display == 'Enm' and item.args:
+        return variant % len(item.args)
+    value = variant * (2 * index + 1)
+    bits = 8 * struct.calcsize(fmt)
+    if data_type.islower():
+        return value % (1 << (bits - 1))
+    return value % (1 << bits)
+
+
+#
+# Returns VARIANTS packets (bytearrays) for a packet ID with the items of
+# one or more definition files
+#
+def build_variants(msg_id, items, hdr_offset, endian):
+    length = max([12] + [item.offset + item.size for item in items
+                         if item.size]) + hdr_offset
+    variants = []
+    for variant in range(VARIANTS):
+        packet = bytearray(length)
+        struct.pack_into('>HHH', packet, 0, msg_id, 0xC000, length - 7)
+        for index, item in enumerate(items):
+            if not item.size:
+                continue
+            fmt = item_format(item, endian)
+            struct.pack_into(fmt, packet, item.offset + hdr_offset,
+                             item_value(item, fmt, index, variant))
+        variants.append(packet)
+    return variants
+
+
+#
+# Returns {packet id: variants} for the telemetry pages
+#
+def load_streams(hdr_offset, endian, only=()):
+    items = {EVENT_MSG_ID: list(EVENT_ITEMS)}
+    for page in load_pages(TLM_DIR):
+        if page.def_file == 'null' or (only and page.appid not in only):
+            continue
+        items.setdefault(page.appid, []).extend(
+            load_items(page.def_file, TLM_DIR))
+    return {msg_id: build_variants(msg_id, page_items, hdr_offset, endian)
+            for msg_id, page_items in items.items()
+            if not only or msg_id in only}
+
+
+class Stream:
+    __slots__ = ('msg_id', 'variants', 'length', 'rate', 'credit', 'next',
+                 'seqs')
+
+    def __init__(self, msg_id, variants, rate, num_sources):
+        self.msg_id = msg_id
+        self.variants = variants
+        self.length = len(variants[0]) - 7
+        self.rate = rate
+        self.credit = 0.0
+        self.next = 0
+        self.seqs = [0] * num_sources
+
+
+#
+# Sends the streams from the given source addresses until the duration
+# (seconds, 0 for ever) has passed, counting packets and bytes in
+# counters[2 * index] and counters[2 * index + 1]
+#
+def send_streams(streams, sources, host, hdr_offset, duration, burst,
+                 counters, index):
+    socks = []
+    for source in sources:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if source:
+            sock.bind((source, 0))
+        socks.append(sock)
+    dest = (host, udp_recv_port)
+    clock = SpacecraftClock(**load_clock())
+    # Sequence count, length and time
+    header = struct.Struct(
+        f'>HH{hdr_offset}xI{"H" if clock.time.size == 6 else "I"}')
+    num_sources = len(socks)
+    source = 0
+
+    start = last = time.monotonic()
+    while not duration or last - start < duration:
+        now = time.monotonic()
+        elapsed, last = now - last, now
+        factor = 1.0
+        if burst:
+            on, off, burst_factor = burst
+            if (now - start) % (on + off) < on:
+                factor = burst_factor
+
+        # Packet time since the mission epoch
+        sc_time = time.time()
+        if clock.is_tai:
+            sc_time += clock.leap(sc_time)
+        sc_time -= clock.epoch
+        secs = int(sc_time)
+        subs = int((sc_time - secs) * clock.ns_den * 1e9 / clock.ns_num) \
+            << clock.shift
+        sent = size = 0
+        for stream in streams:
+            if stream.rate:
+                stream.credit = min(stream.credit +
+                                    stream.rate * factor * elapsed,
+                                    MAX_BATCH)
+                count = int(stream.credit)
+                stream.credit -= count
+            else:
+                count = MAX_BATCH
+            variants, seqs, length = stream.variants, stream.seqs, \
+                stream.length
+            for _ in range(count):
+                packet = variants[stream.next]
+                stream.next = (stream.next + 1) % VARIANTS
+                seq = seqs[source] = (seqs[source] + 1) & 0x3FFF
+                header.pack_into(packet, 2, 0xC000 | seq, length, secs, subs)
+                socks[source].sendto(packet, dest)
+                source = (source + 1) % num_sources
+                size += length + 7
+            sent += count
+        counters[2 * index] += sent
+        counters[2 * index + 1] += size
+        if all(stream.rate for stream in streams):
+            time.sleep(max(TICK - (time.monotonic() - now), 0))
+
+    for sock in socks:
+        sock.close()
+
+
+#
+# Sends every packet ID at rates[packet id] or, if it isn't listed, at
+# default_rate (or not at all if default_rate is None), sharing the load
+# with the other processes
+#
+def sender_process(index, sources, rates, default_rate, host, hdr_offset,
+                   endian, duration, burst, counters, processes):
+    only = list(rates) if default_rate is None else ()
+    streams = [Stream(msg_id, variants,
+                      rates.get(msg_id, default_rate) / processes,
+                      len(sources))
+               for msg_id, variants in
+               load_streams(hdr_offset, endian, only).items()]
+    try:
+        send_streams(streams, sources, host, hdr_offset, duration, burst,
+                     counters, index)
+    except KeyboardInterrupt:
+        pass
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: TlmUDPSender.py [--host=<address>] [--rate=<pps>] "
+           "[--rate=<packet id>:<pps>] [--burst=<on s>,<off s>,<factor>] "
+           "[--sources=<n>] [--processes=<n>] [--duration=<s>] "
+           "[--hdr-offset=<bytes>] [--endian=L|B]\n\n"
+           "example: --rate=10 --rate=0x800:1000 --sources=20 "
+           "--burst=1,4,10"))
+
 
 #
 # Main
 #
 if __name__ == "__main__":
-    num = 0
-    while True:
-        num += 1
-        time.sleep(1)
-        send_host = "127.0.0.1"
-        send_port = 2234
-        datagram = b'Test tlm message'
-        send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        send_socket.sendto(datagram, (send_host, send_port))
-        print(f'Sent msg #{num} to {send_host}:{send_port}')
+    send_host = "127.0.0.1"
+    # packet id: rate
+    stream_rates = {}
+    rate_default = None
+    burst_profile = None
+    num_sources = 1
+    num_processes = 1
+    send_duration = 0.0
+    tlm_hdr_offset = 0
+    tlm_endian = "L"
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], "hr:s:p:d:",
+            ["help", "host=", "rate=", "burst=", "sources=", "processes=",
+             "duration=", "hdr-offset=", "endian="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif opt == "--host":
+                send_host = arg
+            elif opt in ("-r", "--rate"):
+                if ':' in arg:
+                    msg_id, rate = arg.split(':')
+                    stream_rates[int(msg_id, 16)] = float(rate)
+                else:
+                    rate_default = float(arg)
+            elif opt == "--burst":
+                on_time, off_time, burst_factor = map(float, arg.split(','))
+                burst_profile = (on_time, off_time, burst_factor)
+            elif opt in ("-s", "--sources"):
+                num_sources = int(arg)
+            elif opt in ("-p", "--processes"):
+                num_processes = int(arg)
+            elif opt in ("-d", "--duration"):
+                send_duration = float(arg)
+            elif opt == "--hdr-offset":
+                tlm_hdr_offset = int(arg)
+            elif opt == "--endian":
+                tlm_endian = arg
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    if rate_default is None and not stream_rates:
+        rate_default = 1.0
+
+    # 127.0.1.1, ..., 127.0.1.250, 127.0.2.1, ... (no bind with a single
+    # source)
+    source_addresses = [f'127.0.{1 + n // 250}.{1 + n % 250}'
+                        for n in range(num_sources)] \
+        if num_sources > 1 else ['']
+    shared_counters = multiprocessing.Array('d', 2 * num_processes,
+                                            lock=False)
+    workers = []
+    for worker in range(num_processes):
+        # Split the sources between the processes if there are enough,
+        # otherwise every process sends from all of them
+        worker_sources = source_addresses[worker::num_processes] \
+            if len(source_addresses) >= num_processes else source_addresses
+        workers.append(multiprocessing.Process(
+            target=sender_process,
+            args=(worker, worker_sources, stream_rates, rate_default,
+                  send_host, tlm_hdr_offset, tlm_endian, send_duration,
+                  burst_profile, shared_counters, num_processes)))
+    for worker in workers:
+        worker.start()
+
+    print(f'Sending to {send_host}:{udp_recv_port} from {num_sources} '
+          f'source(s) in {num_processes} process(es)')
+    report_start = report_time = time.monotonic()
+    report_packets = report_bytes = 0
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+            now = time.monotonic()
+            packets = sum(shared_counters[0::2])
+            total_bytes = sum(shared_counters[1::2])
+            print(f'{(packets - report_packets) / (now - report_time):.0f} '
+                  f'packets/s, {(total_bytes - report_bytes) / (now - report_time) / 1e6:.1f} '
+                  f'MB/s ({packets:.0f} packets sent)')
+            report_time, report_packets, report_bytes = \
+                now, packets, total_bytes
+    except KeyboardInterrupt:
+        pass
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - report_start
+    total = sum(shared_counters[0::2])
+    print(f'Sent {total:.0f} packets in {elapsed:.1f} s '
+          f'({total / elapsed:.0f} packets/s)')
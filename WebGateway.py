@@ -0,0 +1,726 @@
+#
+#  NASA Docket No. GSC-19,200-1, and identified as "cFS Draco"
+#
+#  Copyright (c) 2023 United States Government as represented by the
+#  Administrator of the National Aeronautics and Space Administration.
+#  All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License"); you may
+#  not use this file except in compliance with the License. You may obtain
+#  a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+#
+# Serves decoded telemetry to browsers over WebSocket
+#
+# The gateway subscribes to the telemetry bus and decodes the packets of
+# the telemetry pages through their definition files (see TlmMQRecv.py).
+# A stream is the packets of one packet id from one spacecraft,
+# "<spacecraft>/<packet id>", e.g. "Spacecraft1/0x800".
+#
+# Messages to the browser are JSON text frames:
+#   {"type": "hello", "streams": [...]}         on connection
+#   {"type": "snapshot", "streams": {stream: {"time": t, "items": {...}}}}
+#       every item of the subscribed streams; sent first, and again when a
+#       client changes its subscription or has fallen behind
+#   {"type": "delta", "streams": {stream: {"time": t, "items": {...}}}}
+#       the items that changed since the previous update
+# Updates are coalesced: a client gets at most <rate> messages a second,
+# each holding the latest value of every item that changed since the last.
+#
+# Browsers may send
+#   {"subscribe": ["Spacecraft1/0x800", ...] or "*", "rate": <updates/s>}
+# Clients are subscribed to every stream at DEFAULT_RATE until they do.
+#
+# A client whose connection has more than CLIENT_BUFFER bytes waiting to be
+# sent gets no updates until it has caught up, then a snapshot, so a slow
+# browser costs the gateway nothing but the memory of what it already
+# queued. Clients stalled for STALL_TIMEOUT seconds are disconnected.
+#
+#   ~$ python3 WebGateway.py --listen=0.0.0.0:8765
+# then open http://<ground host>:8765/ for a simple display of all items.
+#
+# --bench=<clients> runs the gateway on synthetic telemetry with that many
+# simulated clients, some of which (--slow) stop reading, and reports the
+# gateway's CPU and memory use every second.
+#
+
+import asyncio
+import base64
+import getopt
+import getpass
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+
+import zmq
+import zmq.asyncio
+
+ROOTDIR = Path(__file__).resolve().parent
+TLM_DIR = f'{ROOTDIR}/Subsystems/tlmGUI'
+sys.path.insert(0, TLM_DIR)
+
+# pylint: disable=wrong-import-position
+from TlmMQRecv import PacketDecoder, open_offsets
+from LatencyHistogram import receive_time
+from Metrics import counter, gauge, start_metrics
+from PacketFilter import (ROUTER_ENDIAN, compile_filter, filter_subscription,
+                          original_topic, uses_items)
+from Profiling import start_profiling
+
+BUS_ADDRESS = f'ipc:///tmp/GroundSystem-{getpass.getuser()}'
+GATEWAY_PORT = 8765
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Updates per second
+DEFAULT_RATE = 10.0
+MIN_RATE = 0.1
+MAX_RATE = 50.0
+# Bytes waiting to be sent to a client above which it gets no updates
+CLIENT_BUFFER = 256 * 1024
+STALL_TIMEOUT = 30.0
+# Largest message accepted from a client
+MAX_MESSAGE = 65536
+# Messages read from the bus before letting the clients' updates run
+BATCH_SIZE = 1000
+
+# Opcodes
+TEXT, CLOSE, PING, PONG = 0x1, 0x8, 0x9, 0xA
+
+ALL = '*'
+
+CLIENTS = gauge('groundsystem_gateway_clients', 'Connected WebSocket clients')
+MESSAGES = counter('groundsystem_gateway_messages',
+                   'Messages sent to WebSocket clients')
+SKIPPED = counter('groundsystem_gateway_skipped',
+                  'Updates not sent to clients that were behind')
+
+PAGE = b'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>cFS Ground System</title>
+<style>body{font-family:sans-serif}td{padding:0 1em}h2{margin-bottom:0}</style>
+</head><body><div id="streams"></div><script>
+const streams = {};
+const ws = new WebSocket(`ws://${location.host}/`);
+ws.onmessage = (event) => {
+  const msg = JSON.parse(event.data);
+  for (const [name, update] of Object.entries(msg.streams || {})) {
+    let table = streams[name];
+    if (!table) {
+      const title = document.createElement('h2');
+      title.textContent = name;
+      table = streams[name] = document.createElement('table');
+      document.getElementById('streams').append(title, table);
+      table.cells = {};
+    }
+    for (const [item, value] of Object.entries(update.items)) {
+      let cell = table.cells[item];
+      if (!cell) {
+        const row = table.insertRow();
+        row.insertCell().textContent = item;
+        cell = table.cells[item] = row.insertCell();
+      }
+      cell.textContent = value;
+    }
+  }
+};
+</script></body></html>
+'''
+
+
+def frame(payload, opcode=TEXT, mask=None):
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('>BB', 0x80 | opcode, mask_bit | length)
+    elif length < 65536:
+        header = struct.pack('>BBH', 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, mask_bit | 127, length)
+    if mask:
+        return header + mask + unmask(payload, mask)
+    return header + payload
+
+
+def unmask(payload, mask):
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^
+            int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+
+#
+# Reads one frame; returns (opcode, payload)
+#
+async def read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('>H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('>Q', await reader.readexactly(8))
+    if length > MAX_MESSAGE:
+        raise ValueError(f'{length} byte message')
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    return first & 0x0F, unmask(payload, mask) if mask else payload
+
+
+def finite(value):
+    if value.__class__ is float and not math.isfinite(value):
+        return None
+    return value
+
+
+class Client:
+    __slots__ = ('writer', 'streams', 'rate', 'stale', 'stalled_since')
+
+    def __init__(self, writer):
+        self.writer = writer
+        # Stream names, or ALL
+        self.streams = ALL
+        self.rate = DEFAULT_RATE
+        # Needs a snapshot
+        self.stale = True
+        self.stalled_since = None
+
+    def wants(self, stream):
+        return self.streams is ALL or stream in self.streams
+
+    #
+    # Queues a message unless the client is behind; returns True if sent
+    #
+    def send(self, data, now):
+        transport = self.writer.transport
+        if transport.is_closing():
+            return False
+        if transport.get_write_buffer_size() > CLIENT_BUFFER:
+            self.stale = True
+            if self.stalled_since is None:
+                self.stalled_since = now
+            elif now - self.stalled_since > STALL_TIMEOUT:
+                transport.abort()
+            return False
+        self.stalled_since = None
+        self.writer.write(data)
+        MESSAGES.inc()
+        return True
+
+
+#
+# The clients with the same update rate, and the changes since their last
+# update
+#
+class RateGroup:
+
+    def __init__(self, gateway, rate):
+        self.gateway = gateway
+        self.rate = rate
+        self.clients = set()
+        # Streams wanted by at least one client, or ALL
+        self.wanted = set()
+        # stream: [time, {item: value}]
+        self.changes = {}
+        self.task = None
+
+    def update_wanted(self):
+        wanted = set()
+        for client in self.clients:
+            if client.streams is ALL:
+                wanted = ALL
+                break
+            wanted |= client.streams
+        self.wanted = wanted
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.rate
+        next_tick = loop.time()
+        while self.clients:
+            next_tick = max(next_tick + interval, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+            self.flush()
+
+    #
+    # Sends every client the changes since the last update, or a snapshot
+    # if it needs one. Each stream is encoded once per update, and the
+    # message once per distinct subscription.
+    #
+    def flush(self):
+        changes, self.changes = self.changes, {}
+        now = time.monotonic()
+        deltas, snapshots = {}, {}
+        # kind: {stream: encoded}
+        encoded = {}
+        for client in list(self.clients):
+            key = client.streams if client.streams is ALL \
+                else frozenset(client.streams)
+            if client.stale:
+                message = snapshots.get(key)
+                if message is None:
+                    message = snapshots[key] = self.message(
+                        'snapshot', self.gateway.latest, client, encoded)
+                if client.send(message, now):
+                    client.stale = False
+                else:
+                    SKIPPED.inc()
+                continue
+            if not changes:
+                continue
+            message = deltas.get(key)
+            if message is None:
+                message = deltas[key] = self.message('delta', changes, client,
+                                                     encoded)
+            if message and not client.send(message, now):
+                SKIPPED.inc()
+
+    def message(self, kind, streams, client, encoded):
+        fragments = encoded.get(kind)
+        if fragments is None:
+            fragments = encoded[kind] = self.gateway.fragments(streams)
+        body = ','.join(fragment for stream, fragment in fragments.items()
+                        if client.wants(stream))
+        if not body and kind == 'delta':
+            return b''
+        return frame(f'{{"type":"{kind}","streams":{{{body}}}}}'.encode())
+
+
+class Gateway:
+
+    def __init__(self, bus=BUS_ADDRESS, filters=(), endian='L', offset=None):
+        self.decoder = PacketDecoder(endian)
+        self.offset = offset
+        self.offsets_mm = None if offset is not None else open_offsets()
+        self.encoder = json.JSONEncoder(check_circular=False, allow_nan=False)
+        # stream: [time, {item: value}]
+        self.latest = {}
+        # stream: values of the last packet
+        self.last_values = {}
+        # topic: stream
+        self.streams = {}
+        # rate: RateGroup
+        self.groups = {}
+        self.clients = set()
+        self.undecoded = 0
+
+        self.context = zmq.asyncio.Context()
+        self.subscriber = self.context.socket(zmq.SUB)
+        self.subscriber.connect(bus)
+        self.filtered = bool(filters)
+        for subscription in [filter_subscription(f) for f in filters] or \
+                [b'GroundSystem']:
+            self.subscriber.setsockopt(zmq.SUBSCRIBE, subscription)
+
+    def tlm_offset(self):
+        if self.offset is not None:
+            return self.offset
+        try:
+            return self.offsets_mm[0]
+        except (TypeError, IndexError, ValueError):
+            return 0
+
+    async def read_bus(self):
+        recv = self.subscriber.recv_multipart
+        while True:
+            offset = self.tlm_offset()
+            for _ in range(BATCH_SIZE):
+                self.handle(await recv(), offset)
+                if not self.subscriber.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                    break
+            # Let the updates go out even if the bus never pauses
+            await asyncio.sleep(0)
+
+    #
+    # Decodes a packet and records the items that changed
+    #
+    def handle(self, parts, offset):
+        topic = original_topic(parts[0]) if self.filtered else parts[0]
+        stream = self.streams.get(topic)
+        if stream is None:
+            fields = topic.decode(errors='replace').split('.')
+            if len(fields) != 4 or fields[2] != 'TelemetryPackets':
+                return
+            stream = self.streams[topic] = f'{fields[1]}/{fields[3]}'
+        packet = parts[1]
+        pkt_id = (packet[0] << 8) | packet[1]
+        values = self.decoder.decode(pkt_id, packet, offset)
+        if values is None:
+            self.undecoded += 1
+            return
+        names = self.decoder.names[pkt_id]
+        last = self.last_values.get(stream)
+        self.last_values[stream] = values
+        if last is None or len(last) != len(values):
+            changed = {name: finite(value)
+                       for name, value in zip(names, values)}
+        else:
+            changed = {names[i]: finite(value)
+                       for i, value in enumerate(values) if value != last[i]}
+        if not changed:
+            return
+        stamp = (receive_time(parts) or time.time_ns()) / 1e9
+        latest = self.latest.get(stream)
+        if latest is None:
+            self.latest[stream] = [stamp, changed]
+        else:
+            latest[0] = stamp
+            latest[1].update(changed)
+        for group in self.groups.values():
+            if group.wanted is ALL or stream in group.wanted:
+                pending = group.changes.get(stream)
+                if pending is None:
+                    group.changes[stream] = [stamp, dict(changed)]
+                else:
+                    pending[0] = stamp
+                    pending[1].update(changed)
+
+    #
+    # {stream: '"<stream>":{"time":...,"items":{...}}'}
+    #
+    def fragments(self, streams):
+        encode = self.encoder.encode
+        return {stream: f'{encode(stream)}:{{"time":{stamp!r},'
+                        f'"items":{encode(items)}}}'
+                for stream, (stamp, items) in streams.items()}
+
+    def join(self, client, rate):
+        group = self.groups.get(rate)
+        if group is None:
+            group = self.groups[rate] = RateGroup(self, rate)
+        group.clients.add(client)
+        group.update_wanted()
+        if group.task is None or group.task.done():
+            group.task = asyncio.create_task(group.run())
+
+    def leave(self, client):
+        group = self.groups.get(client.rate)
+        if group is not None:
+            group.clients.discard(client)
+            group.update_wanted()
+            if not group.clients:
+                del self.groups[client.rate]
+
+    def command(self, client, payload):
+        try:
+            request = json.loads(payload)
+            streams = request.get('subscribe', client.streams)
+            if streams != ALL:
+                # "*" or a list of stream names; anything else is ignored
+                if not isinstance(streams, (list, set)) or \
+                        not all(isinstance(stream, str) for stream in streams):
+                    raise TypeError(streams)
+                streams = ALL if ALL in streams else set(streams)
+            rate = float(request.get('rate', client.rate))
+            if math.isnan(rate):
+                raise ValueError(rate)
+        except (ValueError, TypeError, AttributeError):
+            return
+        self.leave(client)
+        client.streams = streams
+        client.rate = rate = min(max(rate, MIN_RATE), MAX_RATE)
+        client.stale = True
+        self.join(client, rate)
+
+    async def serve_client(self, reader, writer):
+        client = None
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            lines = request.decode('latin-1').split('\r\n')
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            key = headers.get('sec-websocket-key')
+            if headers.get('upgrade', '').lower() != 'websocket' or not key:
+                if lines[0].startswith('GET / '):
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html;'
+                                 b' charset=utf-8\r\nContent-Length: ' +
+                                 str(len(PAGE)).encode() + b'\r\n\r\n' + PAGE)
+                else:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\n'
+                                 b'Content-Length: 0\r\n\r\n')
+                await writer.drain()
+                return
+            accept = base64.b64encode(
+                hashlib.sha1(key.encode() + WS_GUID).digest())
+            writer.write(b'HTTP/1.1 101 Switching Protocols\r\n'
+                         b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                         b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+            client = Client(writer)
+            self.clients.add(client)
+            CLIENTS.set(len(self.clients))
+            client.send(frame(self.encoder.encode(
+                {'type': 'hello', 'streams': sorted(self.latest)}).encode()),
+                time.monotonic())
+            self.join(client, client.rate)
+
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == CLOSE:
+                    writer.write(frame(payload[:2], CLOSE))
+                    break
+                if opcode == PING:
+                    client.send(frame(payload, PONG), time.monotonic())
+                elif opcode == TEXT:
+                    self.command(client, payload)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            if client is not None:
+                self.leave(client)
+                self.clients.discard(client)
+                CLIENTS.set(len(self.clients))
+            writer.close()
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.serve_client, host,
+                                                 port)
+        self.bus_task = asyncio.create_task(self.read_bus())
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self.server.close()
+        self.bus_task.cancel()
+        self.subscriber.close(linger=0)
+        self.context.term()
+
+
+#
+# Publishes the pages' packets, with changing values, on bus at rate
+# packets per second
+#
+def publish_traffic(bus, rate, duration):
+    # pylint: disable=import-outside-toplevel
+    from TlmUDPSender import load_streams
+
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind(bus)
+    messages = [
+        (f'GroundSystem.Spacecraft1.TelemetryPackets.{hex(pkt_id)}'.encode(),
+         bytes(variant))
+        for pkt_id, variants in load_streams(0, 'L').items()
+        for variant in variants]
+    time.sleep(1)
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < duration:
+        due = int((time.monotonic() - start) * rate)
+        while sent < due:
+            topic, packet = messages[sent % len(messages)]
+            publisher.send_multipart(
+                [topic, packet, struct.pack('>Q', time.time_ns())])
+            sent += 1
+        time.sleep(0.001)
+    publisher.close(linger=0)
+    context.term()
+
+
+#
+# Simulated browsers: connect, subscribe to everything, and count what
+# they receive; slow ones stop reading after the first message
+#
+async def simulated_clients(port, clients, slow, duration, rate):
+    received = [[0, 0] for _ in range(clients)]
+
+    async def browser(n):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        key = base64.b64encode(os.urandom(16))
+        writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+                     b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Version: 13\r\nSec-WebSocket-Key: ' +
+                     key + b'\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(frame(json.dumps({'subscribe': ALL, 'rate': rate})
+                           .encode(), mask=os.urandom(4)))
+        deadline = time.monotonic() + duration
+        try:
+            while time.monotonic() < deadline:
+                _, payload = await asyncio.wait_for(
+                    read_frame(reader), deadline - time.monotonic())
+                received[n][0] += 1
+                received[n][1] += len(payload)
+                if n < slow:
+                    # Never read again
+                    await asyncio.sleep(deadline - time.monotonic())
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                ConnectionError):
+            pass
+        writer.close()
+
+    await asyncio.gather(*(browser(n) for n in range(clients)))
+    return received
+
+
+def run_clients(port, clients, slow, duration, rate, results):
+    results.put(asyncio.run(
+        simulated_clients(port, clients, slow, duration, rate)))
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGESIZE') \
+                / 1e6
+    except OSError:
+        return 0.0
+
+
+async def bench(clients, slow_fraction, duration, packet_rate, client_rate):
+    bus = f'ipc:///tmp/GroundSystem-webbench-{getpass.getuser()}'
+    # Not forked from a process with a ZMQ context and an event loop
+    processes = multiprocessing.get_context('spawn')
+    publisher = processes.Process(
+        target=publish_traffic, args=(bus, packet_rate, duration + 3),
+        daemon=True)
+    publisher.start()
+    gateway = Gateway(bus, offset=0)
+    port = await gateway.start('127.0.0.1', 0)
+    slow = int(clients * slow_fraction)
+    results = processes.Queue()
+    browsers = processes.Process(
+        target=run_clients,
+        args=(port, clients, slow, duration, client_rate, results),
+        daemon=True)
+    browsers.start()
+
+    print(f'{clients} clients ({slow} not reading) at {client_rate:g} '
+          f'updates/s, {packet_rate} packets/s on the bus')
+    print(f'{"s":>3} {"clients":>8} {"cpu %":>6} {"rss MB":>7} '
+          f'{"sent":>8} {"skipped":>8}')
+    last_cpu = time.process_time()
+    last_sent = MESSAGES.value()
+    peak_rss = 0.0
+    cpu_samples = []
+    for second in range(1, int(duration) + 2):
+        await asyncio.sleep(1)
+        cpu = time.process_time()
+        sent = MESSAGES.value()
+        rss = rss_mb()
+        peak_rss = max(peak_rss, rss)
+        cpu_samples.append((cpu - last_cpu) * 100)
+        print(f'{second:>3} {len(gateway.clients):>8} '
+              f'{cpu_samples[-1]:>6.1f} {rss:>7.1f} {sent - last_sent:>8} '
+              f'{SKIPPED.value():>8}')
+        last_cpu, last_sent = cpu, sent
+
+    received = await asyncio.get_running_loop().run_in_executor(
+        None, results.get)
+    browsers.join()
+    publisher.join()
+    gateway.close()
+    reading = received[slow:]
+    print(f'Gateway CPU {max(cpu_samples):.1f} % at most, memory '
+          f'{peak_rss:.1f} MB at most')
+    if reading:
+        print(f'Reading clients got {sum(r[0] for r in reading) / len(reading) / duration:.1f}'
+              f' messages/s ({sum(r[1] for r in reading) / len(reading) / duration / 1000:.1f}'
+              f' kB/s) each; not reading clients got {sum(r[0] for r in received[:slow])}'
+              ' messages in total')
+
+
+#
+# Display usage
+#
+def usage():
+    print(("Usage: WebGateway.py [--listen=<host>:<port>] [--bus=<zmq address>]"
+           " [--filter=<expression>] [--offset=<bytes>] [--endian=L|B]\n"
+           "       WebGateway.py --bench=<clients> [--slow=<fraction>] "
+           "[--duration=<s>] [--packets=<packets/s>] [--rate=<updates/s>]\n\n"
+           "example: --listen=0.0.0.0:8765"))
+
+
+#
+# Main
+#
+def main():
+    start_profiling('WebGateway')
+    start_metrics('WebGateway')
+
+    host, port = '127.0.0.1', GATEWAY_PORT
+    bus = BUS_ADDRESS
+    filters = []
+    offset = None
+    endian = 'L'
+    bench_clients = 0
+    slow_fraction = 0.1
+    duration = 10.0
+    packet_rate = 1000
+    client_rate = DEFAULT_RATE
+
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "hl:", [
+            "help", "listen=", "bus=", "filter=", "offset=", "endian=",
+            "bench=", "slow=", "duration=", "packets=", "rate="
+        ])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit()
+            elif opt in ("-l", "--listen"):
+                host, _, port = arg.rpartition(':')
+                port = int(port)
+            elif opt == "--bus":
+                bus = arg
+            elif opt == "--filter":
+                compile_filter(arg)
+                filters.append(arg)
+            elif opt == "--offset":
+                offset = int(arg)
+            elif opt == "--endian":
+                endian = arg
+            elif opt == "--bench":
+                bench_clients = int(arg)
+            elif opt == "--slow":
+                slow_fraction = float(arg)
+            elif opt == "--duration":
+                duration = float(arg)
+            elif opt == "--packets":
+                packet_rate = int(arg)
+            elif opt == "--rate":
+                client_rate = float(arg)
+        if endian != ROUTER_ENDIAN and any(map(uses_items, filters)):
+            raise ValueError(f'Filter items are decoded by the routing '
+                             f'service with --endian={ROUTER_ENDIAN}')
+    except ValueError as e:
+        print(e)
+        usage()
+        sys.exit(2)
+
+    if bench_clients:
+        asyncio.run(bench(bench_clients, slow_fraction, duration,
+                          packet_rate, client_rate))
+        return
+
+    async def serve():
+        gateway = Gateway(bus, filters, endian, offset)
+        await gateway.start(host, port)
+        print(f'Serving {bus} on ws://{host}:{port}/')
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()